@@ -4,6 +4,7 @@
 from celery import current_app
 from django.conf import settings
 from django.test.runner import DiscoverRunner
+from sqlalchemy import create_engine
 
 
 def _set_eager():
@@ -17,3 +18,23 @@ class CeleryTestSuiteRunner(DiscoverRunner):
     def setup_test_environment(self, **kwargs):
         _set_eager()
         super().setup_test_environment(**kwargs)
+
+    def setup_databases(self, **kwargs):
+        old_config = super().setup_databases(**kwargs)
+
+        # point the engine used to load achilles results data to the test database
+        achilles_db = settings.DATABASES["achilles"]
+        settings.ACHILLES_DB_SQLALCHEMY_ENGINE = create_engine(
+            "postgresql"
+            f"://{achilles_db['USER']}:{achilles_db['PASSWORD']}"
+            f"@{achilles_db['HOST']}:{achilles_db['PORT']}"
+            f"/{achilles_db['NAME']}"
+        )
+
+        return old_config
+
+    def teardown_databases(self, old_config, **kwargs):
+        # close the pooled connections, otherwise the test database can't be dropped
+        settings.ACHILLES_DB_SQLALCHEMY_ENGINE.dispose()
+
+        super().teardown_databases(old_config, **kwargs)
@@ -82,6 +82,7 @@ INSTALLED_APPS = [
     "markdownify",
     "martor",
     "rest_framework",
+    "rest_framework.authtoken",
     "sass_processor",
     "materialized_queries_manager",
     "tabsManager",
@@ -221,6 +222,57 @@ MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 
 # Uploader app specific settings
 ACHILLES_RESULTS_STORAGE_PATH = "achilles_results_files"
+# Engine used to parse and validate uploaded results files: "pandas" or "arrow" (multithreaded)
+UPLOADER_VALIDATION_ENGINE = os.environ.get("UPLOADER_VALIDATION_ENGINE", "pandas")
+# Number of connections used to run the queries of the materialized views against uploaded data
+UPLOADER_VALIDATION_CONNECTIONS = int(
+    os.environ.get("UPLOADER_VALIDATION_CONNECTIONS", 4)
+)
+# Number of bytes of each request sent by the upload page when uploading a results file
+UPLOADER_RESUMABLE_CHUNK_SIZE = int(
+    os.environ.get("UPLOADER_RESUMABLE_CHUNK_SIZE", 8 * 1024 * 1024)
+)
+# Number of days after which an upload session that stopped receiving chunks is deleted
+UPLOADER_RESUMABLE_SESSION_EXPIRY_DAYS = int(
+    os.environ.get("UPLOADER_RESUMABLE_SESSION_EXPIRY_DAYS", 7)
+)
+# If only the records of an upload that changed since the previous upload of the data source
+#  should be written, instead of replacing all of them. The previous records are still
+#  archived in full. Not used if the achilles_results table is versioned
+UPLOADER_DELTA_INGESTION = (
+    strtobool(os.environ.get("UPLOADER_DELTA_INGESTION", "n")) == 1
+)
+# Default retention policy of the archived records of each data source: the records of the
+#  most recent uploads, or of the uploads younger than a number of days, are kept on the
+#  database and the remaining ones are moved to Parquet files. If both are unset, archived
+#  records are kept on the database forever
+UPLOADER_ARCHIVE_KEEP_UPLOADS = (
+    int(os.environ["UPLOADER_ARCHIVE_KEEP_UPLOADS"])
+    if os.environ.get("UPLOADER_ARCHIVE_KEEP_UPLOADS")
+    else None
+)
+UPLOADER_ARCHIVE_KEEP_DAYS = (
+    int(os.environ["UPLOADER_ARCHIVE_KEEP_DAYS"])
+    if os.environ.get("UPLOADER_ARCHIVE_KEEP_DAYS")
+    else None
+)
+
+
+# Materialized queries manager app specific settings
+# Number of connections used to refresh materialized views and maintained tables at the same time
+MATERIALIZED_QUERIES_REFRESH_PARALLELISM = int(
+    os.environ.get("MATERIALIZED_QUERIES_REFRESH_PARALLELISM", 1)
+)
+# Seconds to wait, after the results data changes, for further changes to be refreshed together.
+#  Each change restarts the wait
+MATERIALIZED_QUERIES_REFRESH_WINDOW = int(
+    os.environ.get("MATERIALIZED_QUERIES_REFRESH_WINDOW", 60)
+)
+# Maximum seconds between a change of the results data and the refresh covering it,
+#  even if changes keep arriving
+MATERIALIZED_QUERIES_REFRESH_MAX_STALENESS = int(
+    os.environ.get("MATERIALIZED_QUERIES_REFRESH_MAX_STALENESS", 900)
+)
 
 
 # Redis
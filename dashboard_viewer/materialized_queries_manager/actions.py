@@ -2,11 +2,15 @@ from django.contrib import messages
 from django.http import HttpResponseRedirect
 from django.utils.translation import gettext as _, gettext_lazy
 
-from .tasks import refresh_materialized_views_task
+from .incremental import incremental_qualification
+from .tasks import (
+    convert_materialized_queries_task,
+    refresh_materialized_views_task,
+)
 
 
 def refresh_materialized_views_action(model_admin, request, queryset):
-    refresh_materialized_views_task.delay([obj.matviewname for obj in queryset])
+    refresh_materialized_views_task.delay([obj.pk for obj in queryset])
 
     model_admin.message_user(
         request,
@@ -20,3 +24,55 @@ def refresh_materialized_views_action(model_admin, request, queryset):
 refresh_materialized_views_action.short_description = gettext_lazy(
     "Refresh selected %(verbose_name_plural)s"
 )
+
+
+def convert_to_maintained_action(model_admin, request, queryset):
+    names = []
+    for obj in queryset:
+        reason = incremental_qualification(obj)
+        if reason is None:
+            names.append(obj.matviewname)
+        else:
+            model_admin.message_user(
+                request,
+                _("%(name)s can't be maintained per data source: %(reason)s.")
+                % {"name": obj.matviewname, "reason": reason},
+                messages.WARNING,
+            )
+
+    if names:
+        convert_materialized_queries_task.delay(names, True)
+
+        model_admin.message_user(
+            request,
+            _(
+                "Converting materialized view(s) into maintained tables on a background task."
+            ),
+            messages.SUCCESS,
+        )
+
+    return HttpResponseRedirect("/admin/")
+
+
+convert_to_maintained_action.short_description = gettext_lazy(
+    "Maintain selected %(verbose_name_plural)s per data source"
+)
+
+
+def convert_to_materialized_action(model_admin, request, queryset):
+    convert_materialized_queries_task.delay([obj.name for obj in queryset], False)
+
+    model_admin.message_user(
+        request,
+        _(
+            "Converting maintained table(s) into materialized views on a background task."
+        ),
+        messages.SUCCESS,
+    )
+
+    return HttpResponseRedirect("/admin/")
+
+
+convert_to_materialized_action.short_description = gettext_lazy(
+    "Convert selected %(verbose_name_plural)s back into materialized views"
+)
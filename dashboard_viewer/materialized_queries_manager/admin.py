@@ -6,27 +6,87 @@ from django.contrib.admin.templatetags.admin_urls import add_preserved_filters
 from django.contrib.admin.utils import flatten_fieldsets, quote, unquote
 from django.core import serializers
 from django.core.exceptions import PermissionDenied
+from django.db import connections
 from django.forms import all_valid
 from django.http import HttpResponseRedirect
+from django.template.defaultfilters import filesizeformat
 from django.urls import reverse
 from django.utils.html import format_html
 from django.utils.http import urlquote
 from django.utils.translation import gettext as _
 from django_celery_results.models import TaskResult
 
-from .actions import refresh_materialized_views_action
-from .models import MaterializedQuery
+from .actions import (
+    convert_to_maintained_action,
+    convert_to_materialized_action,
+    refresh_materialized_views_action,
+)
+from .dependencies import dependency_graph, dependents
+from .forms import MaterializedQueryForm
+from .incremental import incremental_qualifications
+from .models import (
+    MaintainedQuery,
+    MaterializedQuery,
+    RefreshRun,
+    RefreshRunItem,
+)
 from .tasks import create_materialized_view
 
 
+def _dependency_graph():
+    with connections["achilles"].cursor() as cursor:
+        return dependency_graph(cursor)
+
+
 @admin.register(MaterializedQuery)
 class MaterializedQueryAdmin(admin.ModelAdmin):
     save_as_continue = False
     save_as = False
 
-    list_display = ("matviewname",)
+    form = MaterializedQueryForm
+
+    list_display = (
+        "matviewname",
+        "incremental_maintenance",
+        "depends_on",
+        "required_by",
+    )
+
+    actions = (refresh_materialized_views_action, convert_to_maintained_action)
+
+    def get_changelist_instance(self, request):
+        """
+        The columns of the dependencies and of the incremental maintenance need information
+         about all materialized views, so it is fetched once for the listed ones and stored on
+         each of them
+        """
+        changelist = super().get_changelist_instance(request)
+
+        graph = _dependency_graph()
+
+        qualifications = incremental_qualifications(changelist.result_list)
+        for obj in changelist.result_list:
+            obj.qualification = qualifications[obj.matviewname]
+            obj.dependencies = sorted(graph.get(obj.matviewname, ()))
+            obj.dependents = sorted(dependents(graph, obj.matviewname))
+
+        return changelist
+
+    def incremental_maintenance(self, obj):
+        reason = obj.qualification
+        return "Qualifies" if reason is None else f"No: {reason}"
 
-    actions = (refresh_materialized_views_action,)
+    incremental_maintenance.short_description = "Incremental maintenance"
+
+    def depends_on(self, obj):
+        return ", ".join(obj.dependencies)
+
+    depends_on.short_description = "Depends on"
+
+    def required_by(self, obj):
+        return ", ".join(obj.dependents)
+
+    required_by.short_description = "Required by"
 
     def delete_queryset(self, _, queryset):
         from django.db import connections  # noqa
@@ -84,11 +144,18 @@ class MaterializedQueryAdmin(admin.ModelAdmin):
                 request, new_object, change=not add
             )
             if all_valid(formsets) and form_validated:
+                # the unique index is only touched if the declared key changed
+                extra_kwargs = (
+                    {"unique_key": form.cleaned_data["unique_key"]}
+                    if "unique_key" in form.changed_data
+                    else {}
+                )
                 self.background_task = create_materialized_view.delay(
                     request.user.pk,
                     obj_dict,
                     serializers.serialize("json", [new_object]),
                     self.construct_change_message(request, form, formsets, add),
+                    **extra_kwargs,
                 )
                 if add:
                     return self.response_add(request, new_object)
@@ -252,3 +319,93 @@ class MaterializedQueryAdmin(admin.ModelAdmin):
                 return f"The {{name}} is being created on the background task {link}."
 
         return "The {name} is being created on a background task."
+
+
+@admin.register(MaintainedQuery)
+class MaintainedQueryAdmin(admin.ModelAdmin):
+    list_display = ("name",)
+
+    actions = (refresh_materialized_views_action, convert_to_materialized_action)
+
+    def has_add_permission(self, *_, **__):
+        return False
+
+    def has_change_permission(self, *_, **__):
+        return False
+
+    def has_delete_permission(self, *_, **__):
+        return False
+
+
+class RefreshRunItemInline(admin.TabularInline):
+    model = RefreshRunItem
+    fields = ("name", "maintained", "duration", "row_count", "size", "error")
+    readonly_fields = fields
+
+    def has_add_permission(self, *_, **__):
+        return False
+
+    def has_change_permission(self, *_, **__):
+        return False
+
+    def has_delete_permission(self, *_, **__):
+        return False
+
+
+@admin.register(RefreshRun)
+class RefreshRunAdmin(admin.ModelAdmin):
+    list_display = ("start_time", "end_time", "origin")
+    date_hierarchy = "start_time"
+
+    inlines = (RefreshRunItemInline,)
+
+    def has_add_permission(self, *_, **__):
+        return False
+
+    def has_change_permission(self, *_, **__):
+        return False
+
+
+@admin.register(RefreshRunItem)
+class RefreshRunItemAdmin(admin.ModelAdmin):
+    """
+    Sorted by the slowest refreshes by default, to find which queries to optimise
+    """
+
+    list_display = (
+        "name",
+        "start_time",
+        "duration",
+        "row_count",
+        "relation_size",
+        "origin",
+        "failed",
+    )
+    list_filter = ("maintained",)
+    search_fields = ("name",)
+    date_hierarchy = "start_time"
+
+    def relation_size(self, obj):
+        return filesizeformat(obj.size) if obj.size is not None else None
+
+    relation_size.short_description = "Size"
+    relation_size.admin_order_field = "size"
+
+    def origin(self, obj):
+        return obj.run.origin
+
+    origin.admin_order_field = "run__origin"
+
+    def failed(self, obj):
+        return obj.error is not None
+
+    failed.boolean = True
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related("run")
+
+    def has_add_permission(self, *_, **__):
+        return False
+
+    def has_change_permission(self, *_, **__):
+        return False
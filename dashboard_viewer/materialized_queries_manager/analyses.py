@@ -0,0 +1,115 @@
+import itertools
+import re
+
+from django.db import connections, router
+
+from .dependencies import column_dependents, dependency_graph, dependents
+from .incremental import query_levels
+from .models import MaintainedQuery, MaterializedQuery
+
+_ANALYSIS_ID_REFERENCE = re.compile(r"\banalysis_id\b", re.IGNORECASE)
+_ANALYSIS_ID_FILTER = re.compile(
+    r"\banalysis_id\s*(?:"
+    r"=\s*(\d+)\b"
+    r"|=\s*ANY\s*\(\s*ARRAY\[([^\]]*)\]\s*\)"
+    r"|IN\s*\(([\d\s,]*)\)"
+    r")",
+    re.IGNORECASE,
+)
+# the results data table on a FROM or JOIN clause, but not on a column reference
+_RESULTS_REFERENCE = re.compile(
+    r"(?:\bFROM|\bJOIN|,)\s*achilles_results\b(?!\s*\.)", re.IGNORECASE
+)
+_SET_OPERATION = re.compile(r"\b(?:UNION|INTERSECT|EXCEPT)\b", re.IGNORECASE)
+
+
+def _statements(definition):
+    for query in query_levels(definition):
+        yield from _SET_OPERATION.split(query)
+
+
+def referenced_analyses(definition):
+    """
+    Extracts the ids of the analyses a materialized view filters the results data by.
+    If the analysis_id column is used in any other way (e.g. joins or ranges), or if the
+     results data is selected without being filtered on some statement of the query
+     (e.g. a subquery or another branch of a union), it is not possible to know which
+     analyses the view uses, so None is returned.
+
+    :param definition: query of the materialized view
+    """
+    filters = _ANALYSIS_ID_FILTER.findall(definition)
+    if not filters or len(filters) != len(_ANALYSIS_ID_REFERENCE.findall(definition)):
+        return None
+
+    for statement in _statements(definition):
+        if len(_RESULTS_REFERENCE.findall(statement)) > len(
+            _ANALYSIS_ID_FILTER.findall(statement)
+        ):
+            return None
+
+    return {
+        int(analysis_id)
+        for groups in filters
+        for analysis_id in re.findall(r"\d+", "".join(groups))
+    }
+
+
+def affected_queries(analyses):
+    """
+    Finds the materialized views and maintained tables whose records might change if the
+     results data of the provided analyses changes. Besides the ones that filter by any of
+     the analyses, this includes the ones whose analyses can't be extracted and the ones
+     that select from other affected materialized views or maintained tables.
+
+    :param analyses: ids of the analyses whose results data changed
+    :return: names of the materialized views and maintained tables
+    """
+    affected = set()
+    for name, definition in itertools.chain(
+        MaterializedQuery.objects.values_list("matviewname", "definition"),
+        MaintainedQuery.objects.values_list("name", "definition"),
+    ):
+        referenced = referenced_analyses(definition)
+        if referenced is None or not referenced.isdisjoint(analyses):
+            affected.add(name)
+
+    return _with_dependents(affected)
+
+
+def queries_using_columns(table, columns):
+    """
+    Finds the materialized views and maintained tables whose records might change if the
+     provided columns of a table change. Maintained tables are regular tables, so their
+     columns are found by name on their definition. Also includes the ones that select
+     from other affected materialized views or maintained tables.
+
+    :param table: name of the table
+    :param columns: names of the columns that changed
+    :return: names of the materialized views and maintained tables
+    """
+    with connections[router.db_for_read(MaterializedQuery)].cursor() as cursor:
+        affected = column_dependents(cursor, table, columns)
+
+    table_reference = re.compile(rf"\b{table}\b", re.IGNORECASE)
+    column_reference = re.compile(
+        rf"\b({'|'.join(re.escape(column) for column in columns)})\b", re.IGNORECASE
+    )
+    for name, definition in MaintainedQuery.objects.values_list("name", "definition"):
+        if table_reference.search(definition) and column_reference.search(definition):
+            affected.add(name)
+
+    return _with_dependents(affected)
+
+
+def _with_dependents(affected):
+    with connections[router.db_for_read(MaterializedQuery)].cursor() as cursor:
+        graph = dependency_graph(cursor)
+
+    to_visit = list(affected)
+    while to_visit:
+        for dependent in dependents(graph, to_visit.pop()) - affected:
+            affected.add(dependent)
+            to_visit.append(dependent)
+
+    return affected
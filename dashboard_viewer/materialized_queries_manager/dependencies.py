@@ -0,0 +1,167 @@
+import collections
+import concurrent.futures
+import re
+
+from .models import MaintainedQuery
+
+_DEPENDENCIES_QUERY = """
+    SELECT DISTINCT dependent.relname, referenced.relname
+    FROM pg_depend AS depend
+    JOIN pg_rewrite AS rewrite ON rewrite.oid = depend.objid
+    JOIN pg_class AS dependent ON dependent.oid = rewrite.ev_class
+    JOIN pg_class AS referenced ON referenced.oid = depend.refobjid
+    WHERE depend.classid = 'pg_rewrite'::regclass
+        AND depend.refclassid = 'pg_class'::regclass
+        AND dependent.relkind = 'm'
+        AND referenced.relkind IN ('m', 'r')
+        AND dependent.oid <> referenced.oid
+        AND dependent.relnamespace = to_regnamespace(current_schema())
+"""
+
+
+# relation on a FROM or JOIN clause, or on a list of relations of a FROM clause
+_RELATION_REFERENCE = re.compile(
+    r"(?:\bFROM|\bJOIN|,)\s*(?:\w+\.)?(\w+)", re.IGNORECASE
+)
+
+
+def dependency_graph(cursor):
+    """
+    Builds the graph of dependencies between materialized views, maintained tables and
+     tables, from the rules postgres keeps for each materialized view. Maintained tables
+     are regular tables, so the relations they select from are found by name on
+     their definition.
+
+    :param cursor: cursor of a connection to the achilles database
+    :return: dictionary mapping the name of each materialized view and maintained table to
+     the names of the materialized views and tables it selects from
+    """
+    cursor.execute(_DEPENDENCIES_QUERY)
+
+    graph = collections.defaultdict(set)
+    for dependent, referenced in cursor.fetchall():
+        graph[dependent].add(referenced)
+
+    cursor.execute(
+        "SELECT relname FROM pg_class "
+        "WHERE relkind IN ('m', 'r', 'p') "
+        "AND relnamespace = to_regnamespace(current_schema())"
+    )
+    relations = {row[0] for row in cursor.fetchall()}
+
+    for name, definition in MaintainedQuery.objects.values_list("name", "definition"):
+        referenced = {
+            reference.lower() for reference in _RELATION_REFERENCE.findall(definition)
+        }
+        graph[name].update((referenced & relations) - {name})
+
+    return graph
+
+
+_COLUMN_DEPENDENCIES_QUERY = """
+    SELECT DISTINCT dependent.relname
+    FROM pg_depend AS depend
+    JOIN pg_rewrite AS rewrite ON rewrite.oid = depend.objid
+    JOIN pg_class AS dependent ON dependent.oid = rewrite.ev_class
+    LEFT JOIN pg_attribute AS attribute
+        ON attribute.attrelid = depend.refobjid AND attribute.attnum = depend.refobjsubid
+    WHERE depend.classid = 'pg_rewrite'::regclass
+        AND depend.refclassid = 'pg_class'::regclass
+        AND depend.refobjid = to_regclass(%s)
+        AND dependent.relkind = 'm'
+        AND (depend.refobjsubid = 0 OR attribute.attname = ANY(%s))
+"""
+
+
+def column_dependents(cursor, table, columns):
+    """
+    Finds the materialized views that select any of the provided columns of a table.
+     Views that reference whole rows of the table are also included.
+
+    :param cursor: cursor of a connection to the achilles database
+    :param table: name of the table
+    :param columns: names of the columns
+    :return: names of the materialized views
+    """
+    cursor.execute(_COLUMN_DEPENDENCIES_QUERY, (table, list(columns)))
+    return {row[0] for row in cursor.fetchall()}
+
+
+def dependents(graph, name):
+    """
+    :return: names of the materialized views and maintained tables that select from the
+     provided relation
+    """
+    return {dependent for dependent, referenced in graph.items() if name in referenced}
+
+
+def topological_order(dependencies):
+    """
+    Orders the relations so each one comes after the ones it depends on.
+     On ties, the provided order is kept.
+
+    :param dependencies: dictionary mapping each relation to the ones it depends on
+    """
+    order = []
+    visited = set()
+
+    def visit(name):
+        if name in visited:
+            return
+        visited.add(name)
+        for dependency in sorted(dependencies[name]):
+            visit(dependency)
+        order.append(name)
+
+    for name in dependencies:
+        visit(name)
+
+    return order
+
+
+def run_in_order(jobs, dependencies, parallelism, wrapper=lambda job: job()):
+    """
+    Runs jobs so each one only starts once the jobs it depends on finished. With more than one
+     thread, jobs that don't depend on each other run at the same time.
+
+    :param jobs: dictionary mapping a name to a function without arguments
+    :param dependencies: dictionary mapping the name of each job to the names of the jobs
+     it depends on. Dependencies that aren't jobs are ignored
+    :param parallelism: maximum number of jobs running at the same time
+    :param wrapper: function that receives and runs each job
+    """
+    dependencies = {
+        name: set(dependencies.get(name, ())) & jobs.keys() for name in jobs
+    }
+
+    if parallelism <= 1:
+        for name in topological_order(dependencies):
+            wrapper(jobs[name])
+        return
+
+    waiting_on = collections.defaultdict(set)
+    for name, names in dependencies.items():
+        for dependency in names:
+            waiting_on[dependency].add(name)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=parallelism) as executor:
+        running = {}
+
+        def submit_ready():
+            for name in [name for name, names in dependencies.items() if not names]:
+                del dependencies[name]
+                running[executor.submit(wrapper, jobs[name])] = name
+
+        submit_ready()
+        while running:
+            done, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                name = running.pop(future)
+                future.result()
+
+                for dependent in waiting_on[name]:
+                    dependencies[dependent].discard(name)
+
+            submit_ready()
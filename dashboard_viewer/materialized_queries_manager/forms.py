@@ -0,0 +1,46 @@
+import re
+
+from django import forms
+from django.db import connections, router
+
+from .models import MaterializedQuery
+from .utils import get_unique_key
+
+_COLUMN = re.compile(r"^[_0-9a-zA-Z]+$")
+
+
+class MaterializedQueryForm(forms.ModelForm):
+    unique_key = forms.CharField(
+        required=False,
+        help_text="Comma separated columns that identify each record of the view. "
+        "If provided, a unique index is created and the view can be read while it "
+        "is being refreshed.",
+    )
+
+    class Meta:
+        model = MaterializedQuery
+        fields = ("matviewname", "definition")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        if self.instance.matviewname:
+            with connections[router.db_for_read(MaterializedQuery)].cursor() as cursor:
+                unique_key = get_unique_key(cursor, self.instance.matviewname)
+            self.initial["unique_key"] = ", ".join(unique_key or ())
+
+    def clean_unique_key(self):
+        columns = [
+            column.strip()
+            for column in self.cleaned_data["unique_key"].split(",")
+            if column.strip()
+        ]
+
+        for column in columns:
+            if not _COLUMN.match(column):
+                raise forms.ValidationError(
+                    'Only alphanumeric characters and the character "_" are allowed '
+                    "on column names."
+                )
+
+        return columns
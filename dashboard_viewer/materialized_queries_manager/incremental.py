@@ -0,0 +1,234 @@
+import re
+
+from django.db import connections, router, transaction
+
+from .models import MaintainedQuery, MaterializedQuery
+
+DATA_SOURCE_COLUMN = "data_source_id"
+
+_WINDOW_FUNCTION = re.compile(r"\bOVER\b", re.IGNORECASE)
+_LIMIT = re.compile(r"\b(LIMIT|OFFSET|FETCH)\b", re.IGNORECASE)
+_GROUP_BY = re.compile(
+    r"\bGROUP\s+BY\b(.*?)(?:\bHAVING\b|\bORDER\s+BY\b|\bWINDOW\b|\bUNION\b|"
+    r"\bINTERSECT\b|\bEXCEPT\b|\)|;|$)",
+    re.IGNORECASE | re.DOTALL,
+)
+_DATA_SOURCE_REFERENCE = re.compile(r"\bdata_source(?:_id|\.id)\b", re.IGNORECASE)
+_SUBQUERY = re.compile(r"\(\s*SELECT\b", re.IGNORECASE)
+_AGGREGATE = re.compile(
+    r"\b(?:count|sum|avg|min|max|array_agg|string_agg|json_agg|jsonb_agg|bool_and|"
+    r"bool_or|every|stddev\w*|var_\w+|variance|percentile_\w+|mode)\s*\(",
+    re.IGNORECASE,
+)
+
+
+def query_levels(definition):
+    """
+    Splits a query into the text of each of its SELECT statements, the main one and each
+     subquery, leaving out of each one the text of the subqueries nested in it
+    """
+    levels = []
+    # text and number of open parentheses of the statements being read
+    stack = [([], 0)]
+
+    position = 0
+    while position < len(definition):
+        char = definition[position]
+        text, depth = stack[-1]
+
+        if char == "(" and _SUBQUERY.match(definition, position):
+            stack.append(([], 0))
+        elif char == ")" and depth == 0 and len(stack) > 1:
+            levels.append("".join(stack.pop()[0]))
+        else:
+            if char == "(":
+                depth += 1
+            elif char == ")":
+                depth -= 1
+            text.append(char)
+            stack[-1] = (text, depth)
+
+        position += 1
+
+    levels.extend("".join(text) for text, _ in reversed(stack))
+    return levels
+
+
+def _connection():
+    return connections[router.db_for_write(MaintainedQuery)]
+
+
+def _strip_definition(definition):
+    # definitions on pg_matviews end with a semicolon
+    return definition.strip().rstrip(";")
+
+
+def _columns(cursor, relation):
+    cursor.execute(
+        "SELECT attname FROM pg_attribute "
+        "WHERE attrelid = to_regclass(%s) AND attnum > 0 AND NOT attisdropped",
+        (relation,),
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _columns_by_relation(cursor, relations):
+    cursor.execute(
+        "SELECT relname, attname FROM pg_attribute "
+        "JOIN pg_class ON pg_class.oid = attrelid "
+        "WHERE relname = ANY(%s) AND relnamespace = to_regnamespace(current_schema()) "
+        "AND attnum > 0 AND NOT attisdropped",
+        (list(relations),),
+    )
+
+    columns = {relation: [] for relation in relations}
+    for relation, column in cursor.fetchall():
+        columns[relation].append(column)
+
+    return columns
+
+
+def _indexes(cursor, relation):
+    cursor.execute(
+        "SELECT indexname, indexdef FROM pg_indexes "
+        "WHERE tablename = %s AND schemaname = current_schema()",
+        (relation,),
+    )
+    return cursor.fetchall()
+
+
+def _data_source_index(name):
+    return f"{name}_{DATA_SOURCE_COLUMN}_maintained_idx"
+
+
+def incremental_qualification(materialized_query: MaterializedQuery, columns=None):
+    """
+    Checks if the records of a materialized view can be maintained per data source, meaning
+     that the records of a data source only depend on the results data of that data source.
+     This is approximated by checking if the view has a data_source_id column, if it groups
+     by data source, if none of its queries or subqueries aggregates without grouping and if
+     it doesn't use window functions or limits.
+
+    :param columns: columns of the materialized view. Fetched from the database if not provided
+    :return: None if the view qualifies, otherwise the reason why it doesn't
+    """
+    if columns is None:
+        with _connection().cursor() as cursor:
+            columns = _columns(cursor, materialized_query.matviewname)
+
+    if DATA_SOURCE_COLUMN not in columns:
+        return f"No {DATA_SOURCE_COLUMN} column"
+
+    definition = materialized_query.definition
+    if _WINDOW_FUNCTION.search(definition):
+        return "Uses window functions"
+    if _LIMIT.search(definition):
+        return "Limits the number of records"
+    if not _GROUP_BY.search(definition):
+        return "Doesn't group by data source"
+    for group_by in _GROUP_BY.finditer(definition):
+        if not _DATA_SOURCE_REFERENCE.search(group_by.group(1)):
+            return "Doesn't group by data source"
+    for query in query_levels(definition):
+        # e.g. a scalar subquery with the total of all data sources
+        if _AGGREGATE.search(query) and not _GROUP_BY.search(query):
+            return "Aggregates records of several data sources"
+
+    return None
+
+
+def incremental_qualifications(materialized_queries):
+    """
+    Same as incremental_qualification for several materialized views, fetching the columns
+     of all of them with a single query
+
+    :return: dictionary mapping the name of each materialized view to the reason why it
+     doesn't qualify or None
+    """
+    with _connection().cursor() as cursor:
+        columns = _columns_by_relation(
+            cursor, [query.matviewname for query in materialized_queries]
+        )
+
+    return {
+        query.matviewname: incremental_qualification(query, columns[query.matviewname])
+        for query in materialized_queries
+    }
+
+
+def convert_to_maintained(materialized_query: MaterializedQuery):
+    """
+    Replaces a materialized view by a regular table with the same name and records, so it
+     can be refreshed one data source at a time. Existing indexes are recreated and
+     an index on the data source column is added.
+    """
+    name = materialized_query.matviewname
+    tmp_name = f"{name}_maintained_tmp"
+
+    with transaction.atomic(
+        using=router.db_for_write(MaintainedQuery)
+    ), _connection().cursor() as cursor:
+        indexes = _indexes(cursor, name)
+
+        cursor.execute(f"CREATE TABLE {tmp_name} AS TABLE {name}")
+        cursor.execute(f"DROP MATERIALIZED VIEW {name}")
+        cursor.execute(f"ALTER TABLE {tmp_name} RENAME TO {name}")
+
+        for _, index in indexes:
+            cursor.execute(index)
+        cursor.execute(
+            f"CREATE INDEX {_data_source_index(name)} ON {name} ({DATA_SOURCE_COLUMN})"
+        )
+
+        MaintainedQuery.objects.create(
+            name=name, definition=_strip_definition(materialized_query.definition)
+        )
+
+
+def convert_to_materialized(maintained_query: MaintainedQuery):
+    """
+    Replaces a maintained table by a materialized view with its definition
+    """
+    name = maintained_query.name
+
+    with transaction.atomic(
+        using=router.db_for_write(MaintainedQuery)
+    ), _connection().cursor() as cursor:
+        indexes = _indexes(cursor, name)
+
+        cursor.execute(f"DROP TABLE {name}")
+        cursor.execute(
+            f"CREATE MATERIALIZED VIEW {name} AS {maintained_query.definition}"
+        )
+
+        for index_name, index in indexes:
+            if index_name != _data_source_index(name):
+                cursor.execute(index)
+
+        maintained_query.delete()
+
+
+def refresh_maintained(cursor, maintained_query: MaintainedQuery, db_ids=None):
+    """
+    Recomputes the records of a maintained table. If data sources are provided,
+     only their records are replaced. Should run inside a transaction, so readers
+     never see the table without the records of a data source.
+
+    :param cursor: cursor of a connection to the achilles database
+    :param maintained_query: maintained table to refresh
+    :param db_ids: ids of the data sources whose records changed
+    """
+    name = maintained_query.name
+    definition = maintained_query.definition
+
+    if db_ids is None:
+        cursor.execute(f"TRUNCATE {name}")
+        cursor.execute(f"INSERT INTO {name} {definition}")
+    else:
+        db_ids = ", ".join(str(int(db_id)) for db_id in db_ids)
+        cursor.execute(f"DELETE FROM {name} WHERE {DATA_SOURCE_COLUMN} IN ({db_ids})")
+        cursor.execute(
+            f"INSERT INTO {name} "
+            f"SELECT * FROM ({definition}) AS maintained "
+            f"WHERE {DATA_SOURCE_COLUMN} IN ({db_ids})"
+        )
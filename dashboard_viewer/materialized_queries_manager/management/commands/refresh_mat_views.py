@@ -1,7 +1,7 @@
 import logging
 
-from django.core.cache import caches
 from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
 
 from materialized_queries_manager.utils import refresh
 
@@ -9,11 +9,44 @@ logger = logging.getLogger(__name__)
 
 
 class Command(BaseCommand):
-    help = "Closes the specified poll for voting"
+    help = "Refreshes all materialized views and maintained tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--parallelism",
+            type=int,
+            help="Number of connections refreshing at the same time. "
+            "Defaults to the MATERIALIZED_QUERIES_REFRESH_PARALLELISM setting",
+        )
+        parser.add_argument(
+            "--slowest",
+            type=int,
+            default=10,
+            help="Number of the slowest refreshes to list on the summary",
+        )
 
     def handle(self, *args, **options):
-        if caches["workers_locks"].get("celery_workers_updating") == 0:
-            refresh(logger)
-            logger.info("Refresh done [command]")
-        else:
-            logger.info("Refresh in progress by another worker [command]")
+        # waits for workers updating results data or refreshing to finish
+        run = refresh(logger, parallelism=options["parallelism"])
+        logger.info("Refresh done [command]")
+
+        items = run.items.all()
+        failed = [item.name for item in items if item.error is not None]
+
+        self.stdout.write(
+            f"Refreshed {len(items) - len(failed)} of {len(items)} "
+            f"materialized queries in {run.end_time - run.start_time}"
+        )
+        if failed:
+            self.stdout.write(self.style.ERROR(f"Failed: {', '.join(failed)}"))
+
+        self.stdout.write("Slowest:")
+        for item in items[: options["slowest"]]:
+            self.stdout.write(
+                f"  {item.name}: {item.duration}"
+                + (
+                    f", {item.row_count} rows, {filesizeformat(item.size)}"
+                    if item.error is None
+                    else ", failed"
+                )
+            )
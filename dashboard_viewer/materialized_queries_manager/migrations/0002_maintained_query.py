@@ -0,0 +1,39 @@
+# Generated by Django 3.2.13 on 2026-10-18 16:30
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("materialized_queries_manager", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MaintainedQuery",
+            fields=[
+                (
+                    "name",
+                    models.CharField(
+                        help_text="Name of the table with the records of the query.",
+                        max_length=100,
+                        primary_key=True,
+                        serialize=False,
+                        validators=[
+                            django.core.validators.RegexValidator(
+                                "^[_0-9a-zA-Z]+$",
+                                'Only alphanumeric characters and the character "_" are allowed.',
+                            )
+                        ],
+                    ),
+                ),
+                ("definition", models.TextField()),
+            ],
+            options={
+                "verbose_name_plural": "maintained queries",
+                "db_table": "maintained_query",
+            },
+        ),
+    ]
@@ -0,0 +1,99 @@
+# Generated by Django 3.2.13 on 2026-10-18 16:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("materialized_queries_manager", "0002_maintained_query"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RefreshRun",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("start_time", models.DateTimeField(auto_now_add=True)),
+                ("end_time", models.DateTimeField(null=True)),
+                (
+                    "origin",
+                    models.CharField(
+                        help_text="What triggered the refresh. Same as on the logs.",
+                        max_length=255,
+                    ),
+                ),
+                (
+                    "data_sources",
+                    models.JSONField(
+                        help_text="Ids of the data sources whose results data changed. Null if the records of all data sources were refreshed.",
+                        null=True,
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "refresh_run",
+                "ordering": ("-start_time",),
+                "get_latest_by": "start_time",
+            },
+        ),
+        migrations.CreateModel(
+            name="RefreshRunItem",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=100)),
+                (
+                    "maintained",
+                    models.BooleanField(
+                        help_text="If it is a maintained table instead of a materialized view."
+                    ),
+                ),
+                ("start_time", models.DateTimeField()),
+                ("end_time", models.DateTimeField()),
+                ("duration", models.DurationField()),
+                (
+                    "row_count",
+                    models.BigIntegerField(
+                        help_text="Number of records after the refresh.", null=True
+                    ),
+                ),
+                (
+                    "size",
+                    models.BigIntegerField(
+                        help_text="Disk space in bytes used after the refresh, including indexes.",
+                        null=True,
+                    ),
+                ),
+                ("error", models.TextField(null=True)),
+                (
+                    "run",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="items",
+                        to="materialized_queries_manager.refreshrun",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "refresh_run_item",
+                "ordering": ("-duration",),
+            },
+        ),
+    ]
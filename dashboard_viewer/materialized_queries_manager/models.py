@@ -1,6 +1,11 @@
 from django.core.validators import RegexValidator
 from django.db import models
 
+_NAME_VALIDATOR = RegexValidator(
+    r"^[_0-9a-zA-Z]+$",
+    'Only alphanumeric characters and the character "_" are allowed.',
+)
+
 
 class MaterializedQuery(models.Model):
     class Meta:
@@ -10,12 +15,7 @@ class MaterializedQuery(models.Model):
     matviewname = models.CharField(
         primary_key=True,
         max_length=100,
-        validators=(
-            RegexValidator(
-                r"^[_0-9a-zA-Z]+$",
-                'Only alphanumeric characters and the character "_" are allowed.',
-            ),
-        ),
+        validators=(_NAME_VALIDATOR,),
         unique=True,
     )
     definition = models.TextField(
@@ -43,3 +43,89 @@ class MaterializedQuery(models.Model):
 
     def to_dict(self):
         return {field.name: getattr(self, field.name) for field in self._meta.fields}
+
+
+class MaintainedQuery(models.Model):
+    """
+    Materialized query stored on a regular table instead of a materialized view,
+     so the records of a single data source can be refreshed at a time
+    """
+
+    class Meta:
+        db_table = "maintained_query"
+        verbose_name_plural = "maintained queries"
+
+    name = models.CharField(
+        primary_key=True,
+        max_length=100,
+        validators=(_NAME_VALIDATOR,),
+        help_text="Name of the table with the records of the query.",
+    )
+    definition = models.TextField()
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return self.name
+
+
+class RefreshRun(models.Model):
+    """
+    Refresh of materialized views and maintained tables
+    """
+
+    class Meta:
+        db_table = "refresh_run"
+        get_latest_by = "start_time"
+        ordering = ("-start_time",)
+
+    start_time = models.DateTimeField(auto_now_add=True)
+    end_time = models.DateTimeField(null=True)
+    origin = models.CharField(
+        max_length=255, help_text="What triggered the refresh. Same as on the logs."
+    )
+    data_sources = models.JSONField(
+        null=True,
+        help_text="Ids of the data sources whose results data changed. "
+        "Null if the records of all data sources were refreshed.",
+    )
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return f"{self.origin} - {self.start_time}"
+
+
+class RefreshRunItem(models.Model):
+    """
+    Refresh of a single materialized view or maintained table during a refresh run
+    """
+
+    class Meta:
+        db_table = "refresh_run_item"
+        ordering = ("-duration",)
+
+    run = models.ForeignKey(RefreshRun, on_delete=models.CASCADE, related_name="items")
+    name = models.CharField(max_length=100)
+    maintained = models.BooleanField(
+        help_text="If it is a maintained table instead of a materialized view."
+    )
+    start_time = models.DateTimeField()
+    end_time = models.DateTimeField()
+    duration = models.DurationField()
+    row_count = models.BigIntegerField(
+        null=True, help_text="Number of records after the refresh."
+    )
+    size = models.BigIntegerField(
+        null=True,
+        help_text="Disk space in bytes used after the refresh, including indexes.",
+    )
+    error = models.TextField(null=True)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return f"{self.name} - {self.start_time}"
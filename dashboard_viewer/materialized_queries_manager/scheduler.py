@@ -0,0 +1,89 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+DATA_SOURCES_KEY = "refresh_scheduler_data_sources"
+QUERIES_KEY = "refresh_scheduler_queries"
+DIRTY_SINCE_KEY = "refresh_scheduler_dirty_since"
+DUE_KEY = "refresh_scheduler_due"
+
+# stored instead of a data source id or a query name when all have to be refreshed
+ALL = "*"
+
+
+def _client():
+    return caches["workers_locks"].client.get_client()
+
+
+def mark_dirty(db_id=None, names=None):
+    """
+    Records that the results data changed, so the next scheduled refresh covers it.
+     The refresh is due once no changes are recorded during the
+     MATERIALIZED_QUERIES_REFRESH_WINDOW setting, or once the first change not yet refreshed
+     is older than the MATERIALIZED_QUERIES_REFRESH_MAX_STALENESS setting.
+
+    :param db_id: id of the data source whose results data changed. If not provided,
+     the records of all data sources are refreshed
+    :param names: names of the materialized views and maintained tables to refresh.
+     If not provided, all are refreshed
+    :return: timestamp at which the refresh is due
+    """
+    client = _client()
+    now = time.time()
+
+    with client.pipeline() as pipeline:
+        pipeline.sadd(DATA_SOURCES_KEY, ALL if db_id is None else db_id)
+        pipeline.sadd(QUERIES_KEY, *([ALL] if names is None else names))
+        pipeline.set(DIRTY_SINCE_KEY, now, nx=True)
+        pipeline.get(DIRTY_SINCE_KEY)
+        dirty_since = float(pipeline.execute()[-1])
+
+    due = min(
+        now + settings.MATERIALIZED_QUERIES_REFRESH_WINDOW,
+        dirty_since + settings.MATERIALIZED_QUERIES_REFRESH_MAX_STALENESS,
+    )
+    client.set(DUE_KEY, due)
+
+    return due
+
+
+def pop_due_changes():
+    """
+    Takes the changes recorded so far, if their refresh is due, so the following
+     changes are recorded for the next refresh.
+
+    :return: None if the refresh is not due or there are no changes. Otherwise, the ids of
+     the data sources and the names of the queries to refresh, each being None if
+     all have to be refreshed
+    """
+
+    def take(pipeline):
+        due = pipeline.get(DUE_KEY)
+        if due is None or float(due) > time.time():
+            return None
+
+        data_sources = {value.decode() for value in pipeline.smembers(DATA_SOURCES_KEY)}
+        queries = {value.decode() for value in pipeline.smembers(QUERIES_KEY)}
+
+        pipeline.multi()
+        pipeline.delete(DATA_SOURCES_KEY, QUERIES_KEY, DIRTY_SINCE_KEY, DUE_KEY)
+
+        return data_sources, queries
+
+    changes = _client().transaction(
+        take,
+        DATA_SOURCES_KEY,
+        QUERIES_KEY,
+        DIRTY_SINCE_KEY,
+        DUE_KEY,
+        value_from_callable=True,
+    )
+    if changes is None or not all(changes):
+        return None
+
+    data_sources, queries = changes
+    return (
+        None if ALL in data_sources else sorted(int(db_id) for db_id in data_sources),
+        None if ALL in queries else sorted(queries),
+    )
@@ -1,5 +1,6 @@
 import random
 import string
+import time
 
 from celery import shared_task, states
 from celery.exceptions import Ignore
@@ -8,18 +9,42 @@ from django.contrib.admin.models import ADDITION, CHANGE, LogEntry
 from django.contrib.admin.options import get_content_type_for_model
 from django.core import serializers
 from django.core.cache import caches
-from django.db import connections, ProgrammingError, router, transaction
+from django.db import (
+    connections,
+    IntegrityError,
+    ProgrammingError,
+    router,
+    transaction,
+)
+from redis_rw_lock import RWLock
 
-from materialized_queries_manager.models import MaterializedQuery
-from materialized_queries_manager.utils import refresh
+from materialized_queries_manager.incremental import (
+    convert_to_maintained,
+    convert_to_materialized,
+)
+from materialized_queries_manager.models import (
+    MaintainedQuery,
+    MaterializedQuery,
+)
+from materialized_queries_manager.scheduler import mark_dirty, pop_due_changes
+from materialized_queries_manager.utils import (
+    get_unique_key,
+    refresh,
+    set_unique_key,
+    unique_key_index,
+)
 
 logger = get_task_logger(__name__)
 
 
 @shared_task(bind=True)
 def create_materialized_view(  # noqa
-    self, user_id, old_obj, new_obj, change_message: str
+    self, user_id, old_obj, new_obj, change_message: str, unique_key=None
 ):
+    """
+    :param unique_key: columns of the unique index of the view. If None, the unique
+     index is left as is, if empty, the unique index is removed
+    """
     new_obj: MaterializedQuery = next(serializers.deserialize("json", new_obj)).object
 
     self.update_state(
@@ -55,7 +80,15 @@ def create_materialized_view(  # noqa
                     cursor.execute(
                         f"ALTER MATERIALIZED VIEW {old_obj['matviewname']} RENAME TO {new_obj.matviewname}"
                     )
+                    cursor.execute(
+                        f"ALTER INDEX IF EXISTS {unique_key_index(old_obj['matviewname'])} "
+                        f"RENAME TO {unique_key_index(new_obj.matviewname)}"
+                    )
                 elif old_obj["definition"] != new_obj.definition:
+                    if unique_key is None:
+                        # keep the unique key of the previous definition
+                        unique_key = get_unique_key(cursor, old_obj["matviewname"])
+
                     # don't drop the old view yet. rename the view to a random name
                     #  just as a backup if there is something wrong with the new
                     #  query or name
@@ -85,7 +118,7 @@ def create_materialized_view(  # noqa
                         raise Ignore()
 
                     cursor.execute(f"DROP MATERIALIZED VIEW {tmp_name}")
-                else:
+                elif unique_key is None:
                     raise Ignore()
 
             else:
@@ -104,6 +137,20 @@ def create_materialized_view(  # noqa
                     )
                     raise Ignore()
 
+            if unique_key is not None:
+                try:
+                    set_unique_key(cursor, new_obj.matviewname, unique_key)
+                except (IntegrityError, ProgrammingError) as e:
+                    self.update_state(
+                        state=states.FAILURE,
+                        meta={
+                            "exc_type": type(e).__name__,
+                            "exc_message": f"Error while creating the unique key of the materialized view {new_obj.matviewname} in the underlying database.",
+                        },
+                        traceback=e,
+                    )
+                    raise Ignore()
+
         if add:
             self.update_state(
                 state=states.SUCCESS,
@@ -135,5 +182,85 @@ def create_materialized_view(  # noqa
 
 
 @shared_task
-def refresh_materialized_views_task(names):
-    refresh(logger, query_set=MaterializedQuery.objects.filter(matviewname__in=names))
+def refresh_materialized_views_task(names, parallelism=None, db_ids=None):
+    """
+    :param db_ids: ids of the data sources whose records should be refreshed on the
+     maintained tables. If not provided, all are refreshed
+    """
+    refresh(
+        logger,
+        db_ids,
+        query_set=MaterializedQuery.objects.filter(matviewname__in=names),
+        maintained_query_set=MaintainedQuery.objects.filter(name__in=names),
+        parallelism=parallelism,
+    )
+
+
+def schedule_refresh(db_id=None, names=None):
+    """
+    Records that the results data changed and schedules a refresh covering it.
+     Changes recorded close to each other are refreshed together. See the
+     mark_dirty function for the arguments.
+    """
+    due = mark_dirty(db_id, names)
+    scheduled_refresh_task.apply_async(countdown=max(due - time.time(), 0))
+
+
+@shared_task
+def scheduled_refresh_task():
+    # if more changes were recorded meanwhile, the task scheduled by the last one refreshes
+    #  all of them
+    changes = pop_due_changes()
+    if changes is None:
+        return
+
+    db_ids, names = changes
+    if names is None:
+        query_set = maintained_query_set = None
+    else:
+        query_set = MaterializedQuery.objects.filter(matviewname__in=names)
+        maintained_query_set = MaintainedQuery.objects.filter(name__in=names)
+
+    try:
+        refresh(
+            logger,
+            db_ids,
+            query_set=query_set,
+            maintained_query_set=maintained_query_set,
+        )
+    except Exception:
+        # the changes were already taken, so they are recorded again for a later refresh
+        for db_id in db_ids if db_ids is not None else [None]:
+            due = mark_dirty(db_id, names)
+        scheduled_refresh_task.apply_async(countdown=max(due - time.time(), 0))
+        raise
+
+
+@shared_task
+def convert_materialized_queries_task(names, maintained):
+    """
+    Converts materialized views into maintained tables or the other way around
+
+    :param names: names of the materialized views or maintained tables to convert
+    :param maintained: if the materialized views should be converted into maintained tables
+    """
+    cache = caches["workers_locks"]
+
+    # the tables are replaced, so nothing else can be refreshing them
+    with RWLock(
+        cache.client.get_client(), "celery_worker_updating", RWLock.WRITE, expire=None
+    ):
+        if maintained:
+            to_convert = MaterializedQuery.objects.filter(matviewname__in=names)
+            convert = convert_to_maintained
+        else:
+            to_convert = MaintainedQuery.objects.filter(name__in=names)
+            convert = convert_to_materialized
+
+        for query in to_convert:
+            try:
+                convert(query)
+            except:  # noqa
+                logger.exception(
+                    "Some unexpected error happen while converting %s.", query.pk
+                )
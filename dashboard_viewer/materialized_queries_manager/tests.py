@@ -1,12 +1,40 @@
-from unittest.mock import patch
+import io
+import logging
+import time
+from datetime import timedelta
+from unittest.mock import ANY, patch
 
 from django.contrib.auth.models import User
 from django.core import serializers
-from django.test import Client, TestCase, TransactionTestCase
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connections
+from django.db.backends.utils import CursorWrapper
+from django.test import (
+    Client,
+    override_settings,
+    TestCase,
+    TransactionTestCase,
+)
 from django_celery_results.models import TaskResult
 
-from .models import MaterializedQuery
-from .tasks import create_materialized_view
+from uploader.models import AchillesResults, DataSource
+from . import scheduler
+from .analyses import affected_queries
+from .dependencies import dependency_graph, dependents, topological_order
+from .incremental import (
+    convert_to_maintained,
+    incremental_qualification,
+    incremental_qualifications,
+)
+from .models import MaintainedQuery, MaterializedQuery, RefreshRunItem
+from .tasks import (
+    convert_materialized_queries_task,
+    create_materialized_view,
+    schedule_refresh,
+    scheduled_refresh_task,
+)
+from .utils import get_unique_key, refresh
 
 
 def _init(target):
@@ -112,6 +140,23 @@ class MaterializedQueryTestCase(TestCase):
             [{"changed": {"fields": ["Definition"]}}],
         )
 
+    @patch("materialized_queries_manager.tasks.create_materialized_view.delay")
+    def test_change_unique_key(self, create_task):
+        client = _login_admin(self)
+        client.post(
+            "/admin/%s/%s/outlier/change/"
+            % (MaterializedQuery._meta.app_label, MaterializedQuery._meta.model_name),
+            data={
+                "matviewname": "outlier",
+                "definition": MaterializedQuery.objects.get(
+                    matviewname="outlier"
+                ).definition,
+                "unique_key": "a, b",
+            },
+        )
+
+        self.assertEqual(["a", "b"], create_task.call_args.kwargs["unique_key"])
+
 
 class CeleryTasksTestCase(TransactionTestCase):
     databases = "__all__"
@@ -241,3 +286,533 @@ class CeleryTasksTestCase(TransactionTestCase):
             in task_results.result
         )
         self.assertEqual(3, MaterializedQuery.objects.count())
+
+
+class UniqueKeyTestCase(TransactionTestCase):
+    databases = "__all__"
+
+    setUp = _init
+
+    def tearDown(self):
+        with connections["achilles"].cursor() as cursor:
+            cursor.execute("DROP MATERIALIZED VIEW IF EXISTS keyed")
+
+    def _create(self, definition, unique_key):
+        return create_materialized_view.delay(
+            int(User.objects.get(username=self.admin_user).id),
+            None,
+            serializers.serialize(
+                "json", [MaterializedQuery(matviewname="keyed", definition=definition)]
+            ),
+            [{"added": {}}],
+            unique_key=unique_key,
+        )
+
+    def test_create_with_unique_key(self):
+        self._create("SELECT 1 AS id, 2 AS value", ["id"]).wait()
+
+        with connections["achilles"].cursor() as cursor:
+            self.assertEqual(["id"], get_unique_key(cursor, "keyed"))
+
+        with patch.object(
+            CursorWrapper,
+            "execute",
+            autospec=True,
+            side_effect=CursorWrapper.execute,
+        ) as execute:
+            refresh(
+                logging.getLogger(UniqueKeyTestCase.__name__),
+                query_set=MaterializedQuery.objects.filter(matviewname="keyed"),
+            )
+
+        self.assertIn(
+            "REFRESH MATERIALIZED VIEW CONCURRENTLY keyed",
+            [call.args[1] for call in execute.call_args_list],
+        )
+
+    def test_refresh_without_unique_key(self):
+        self._create("SELECT 1 AS id", []).wait()
+
+        with connections["achilles"].cursor() as cursor:
+            self.assertIsNone(get_unique_key(cursor, "keyed"))
+
+        refresh(
+            logging.getLogger(UniqueKeyTestCase.__name__),
+            query_set=MaterializedQuery.objects.filter(matviewname="keyed"),
+        )
+
+    def test_invalid_unique_key(self):
+        task = self._create("SELECT 1 AS id UNION ALL SELECT 1", ["id"])
+        task.wait()
+        task_results = TaskResult.objects.get(task_id=task.id)
+
+        self.assertEqual("FAILURE", task_results.status)
+        self.assertIn(
+            "Error while creating the unique key of the materialized view keyed",
+            task_results.result,
+        )
+        self.assertFalse(MaterializedQuery.objects.filter(matviewname="keyed").exists())
+
+
+class IncrementalMaintenanceTestCase(TransactionTestCase):
+    databases = "__all__"
+
+    fixtures = ("countries", "two_data_sources")
+
+    views = {
+        "per_data_source": "SELECT data_source_id, sum(count_value) AS total "
+        "FROM achilles_results GROUP BY data_source_id",
+        "no_data_source": "SELECT sum(count_value) AS total FROM achilles_results",
+        "per_analysis": "SELECT max(data_source_id) AS data_source_id, analysis_id "
+        "FROM achilles_results GROUP BY analysis_id",
+        "ranked": "SELECT data_source_id, rank() OVER (ORDER BY count_value) AS rank "
+        "FROM achilles_results",
+        "not_grouped": "SELECT data_source_id, count_value FROM achilles_results",
+        "share": "SELECT data_source_id, sum(count_value) / "
+        "(SELECT sum(count_value) FROM achilles_results) AS share "
+        "FROM achilles_results GROUP BY data_source_id",
+        "grouped_subquery": "SELECT data_source_id, total FROM "
+        "(SELECT data_source_id, sum(count_value) AS total "
+        "FROM achilles_results GROUP BY data_source_id) AS totals "
+        "WHERE total > 0 GROUP BY data_source_id, total",
+    }
+
+    def setUp(self):
+        self._logger = logging.getLogger(IncrementalMaintenanceTestCase.__name__)
+
+        for data_source in DataSource.objects.all():
+            AchillesResults.objects.create(
+                data_source=data_source, analysis_id=1, count_value=10
+            )
+
+        with connections["achilles"].cursor() as cursor:
+            for name, definition in self.views.items():
+                cursor.execute(f"CREATE MATERIALIZED VIEW {name} AS {definition}")
+
+    def tearDown(self):
+        with connections["achilles"].cursor() as cursor:
+            for name in self.views:
+                cursor.execute(f"DROP MATERIALIZED VIEW IF EXISTS {name}")
+                cursor.execute(f"DROP TABLE IF EXISTS {name}")
+
+    def _totals(self):
+        with connections["achilles"].cursor() as cursor:
+            cursor.execute("SELECT data_source_id, total FROM per_data_source")
+            return dict(cursor.fetchall())
+
+    def test_qualification(self):
+        self.assertIsNone(
+            incremental_qualification(
+                MaterializedQuery.objects.get(matviewname="per_data_source")
+            )
+        )
+        self.assertEqual(
+            "No data_source_id column",
+            incremental_qualification(
+                MaterializedQuery.objects.get(matviewname="no_data_source")
+            ),
+        )
+        self.assertEqual(
+            "Doesn't group by data source",
+            incremental_qualification(
+                MaterializedQuery.objects.get(matviewname="per_analysis")
+            ),
+        )
+        self.assertEqual(
+            "Uses window functions",
+            incremental_qualification(
+                MaterializedQuery.objects.get(matviewname="ranked")
+            ),
+        )
+        self.assertEqual(
+            "Doesn't group by data source",
+            incremental_qualification(
+                MaterializedQuery.objects.get(matviewname="not_grouped")
+            ),
+        )
+        self.assertEqual(
+            "Aggregates records of several data sources",
+            incremental_qualification(
+                MaterializedQuery.objects.get(matviewname="share")
+            ),
+        )
+        self.assertIsNone(
+            incremental_qualification(
+                MaterializedQuery.objects.get(matviewname="grouped_subquery")
+            )
+        )
+
+        # the same reasons are found when checking all views at once
+        materialized_queries = MaterializedQuery.objects.filter(
+            matviewname__in=self.views
+        )
+        self.assertEqual(
+            {
+                query.matviewname: incremental_qualification(query)
+                for query in materialized_queries
+            },
+            incremental_qualifications(materialized_queries),
+        )
+
+    def test_refresh_data_source_records(self):
+        convert_materialized_queries_task.delay(["per_data_source"], True).wait()
+
+        self.assertFalse(
+            MaterializedQuery.objects.filter(matviewname="per_data_source").exists()
+        )
+        self.assertTrue(MaintainedQuery.objects.filter(name="per_data_source").exists())
+        self.assertEqual({1: 10, 2: 10}, self._totals())
+
+        AchillesResults.objects.create(data_source_id=1, analysis_id=2, count_value=5)
+        AchillesResults.objects.create(data_source_id=2, analysis_id=2, count_value=5)
+
+        # only the records of the provided data source are recomputed
+        refresh(self._logger, [1])
+        self.assertEqual({1: 15, 2: 10}, self._totals())
+
+        refresh(self._logger)
+        self.assertEqual({1: 15, 2: 15}, self._totals())
+
+        convert_materialized_queries_task.delay(["per_data_source"], False).wait()
+
+        self.assertTrue(
+            MaterializedQuery.objects.filter(matviewname="per_data_source").exists()
+        )
+        self.assertFalse(MaintainedQuery.objects.exists())
+        self.assertEqual({1: 15, 2: 15}, self._totals())
+
+    def test_admin_shows_qualification(self):
+        _init(self)
+        client = _login_admin(self)
+
+        response = client.get(
+            "/admin/%s/%s/"
+            % (MaterializedQuery._meta.app_label, MaterializedQuery._meta.model_name)
+        )
+
+        self.assertContains(response, "Qualifies", count=2)
+        self.assertContains(response, "No: Uses window functions")
+
+
+class ParallelRefreshTestCase(TransactionTestCase):
+    databases = "__all__"
+
+    views = ("parallel1", "parallel2", "parallel3", "parallel_failing")
+
+    def setUp(self):
+        with connections["achilles"].cursor() as cursor:
+            cursor.execute("CREATE TABLE parallel_source (value integer)")
+            cursor.execute("INSERT INTO parallel_source VALUES (1)")
+            for name in self.views[:-1]:
+                cursor.execute(
+                    f"CREATE MATERIALIZED VIEW {name} AS "
+                    "SELECT count(*) AS total FROM parallel_source"
+                )
+            cursor.execute(
+                "CREATE MATERIALIZED VIEW parallel_failing AS "
+                "SELECT 1 / min(value) AS total FROM parallel_source"
+            )
+
+    def tearDown(self):
+        with connections["achilles"].cursor() as cursor:
+            cursor.execute("DROP TABLE parallel_source CASCADE")
+
+    def test_parallel_refresh(self):
+        with connections["achilles"].cursor() as cursor:
+            cursor.execute("INSERT INTO parallel_source VALUES (0)")
+
+        logger = logging.getLogger(ParallelRefreshTestCase.__name__)
+        with self.assertLogs(logger, "INFO") as logs:
+            refresh(
+                logger,
+                query_set=MaterializedQuery.objects.filter(matviewname__in=self.views),
+                parallelism=3,
+            )
+
+        # errors are still handled per view
+        self.assertEqual(
+            1, sum(record.levelno == logging.ERROR for record in logs.records)
+        )
+
+        with connections["achilles"].cursor() as cursor:
+            for name in self.views[:-1]:
+                cursor.execute(f"SELECT total FROM {name}")
+                self.assertEqual(2, cursor.fetchone()[0])
+
+
+class DependencyRefreshTestCase(TransactionTestCase):
+    databases = "__all__"
+
+    # named so the dependent view comes first when listed
+    views = ("dependency_a", "dependency_b")
+
+    def setUp(self):
+        with connections["achilles"].cursor() as cursor:
+            cursor.execute("CREATE TABLE dependency_source (value integer)")
+            cursor.execute("INSERT INTO dependency_source VALUES (1)")
+            cursor.execute(
+                "CREATE MATERIALIZED VIEW dependency_b AS "
+                "SELECT count(*) AS total FROM dependency_source"
+            )
+            cursor.execute(
+                "CREATE MATERIALIZED VIEW dependency_a AS "
+                "SELECT total * 10 AS total FROM dependency_b"
+            )
+
+    def tearDown(self):
+        with connections["achilles"].cursor() as cursor:
+            cursor.execute("DROP TABLE dependency_source CASCADE")
+
+    def _refresh_and_check(self, parallelism, expected):
+        with connections["achilles"].cursor() as cursor:
+            cursor.execute("INSERT INTO dependency_source VALUES (1)")
+
+        refresh(
+            logging.getLogger(DependencyRefreshTestCase.__name__),
+            query_set=MaterializedQuery.objects.filter(matviewname__in=self.views),
+            parallelism=parallelism,
+        )
+
+        # the dependent view already sees the refreshed records of the other one
+        with connections["achilles"].cursor() as cursor:
+            cursor.execute("SELECT total FROM dependency_a")
+            self.assertEqual(expected, cursor.fetchone()[0])
+
+    def test_dependency_graph(self):
+        with connections["achilles"].cursor() as cursor:
+            graph = dependency_graph(cursor)
+
+        self.assertEqual({"dependency_b"}, graph["dependency_a"])
+        self.assertEqual({"dependency_source"}, graph["dependency_b"])
+        self.assertEqual({"dependency_a"}, dependents(graph, "dependency_b"))
+
+    def test_maintained_dependency(self):
+        with connections["achilles"].cursor() as cursor:
+            cursor.execute(
+                "CREATE MATERIALIZED VIEW dependency_c AS "
+                "SELECT 1 AS data_source_id, total + 1 AS total FROM dependency_a"
+            )
+        convert_to_maintained(MaterializedQuery.objects.get(matviewname="dependency_c"))
+
+        try:
+            with connections["achilles"].cursor() as cursor:
+                graph = dependency_graph(cursor)
+            self.assertEqual({"dependency_a"}, graph["dependency_c"])
+            self.assertEqual({"dependency_c"}, dependents(graph, "dependency_a"))
+            self.assertIn("dependency_c", affected_queries({1}))
+
+            with connections["achilles"].cursor() as cursor:
+                cursor.execute("INSERT INTO dependency_source VALUES (1)")
+
+            # the maintained table is refreshed after the views it selects from
+            refresh(
+                logging.getLogger(DependencyRefreshTestCase.__name__),
+                query_set=MaterializedQuery.objects.filter(matviewname__in=self.views),
+                maintained_query_set=MaintainedQuery.objects.all(),
+            )
+            with connections["achilles"].cursor() as cursor:
+                cursor.execute("SELECT total FROM dependency_c")
+                self.assertEqual(21, cursor.fetchone()[0])
+        finally:
+            with connections["achilles"].cursor() as cursor:
+                cursor.execute("DROP TABLE dependency_c")
+            MaintainedQuery.objects.all().delete()
+
+    def test_topological_order(self):
+        self.assertEqual(
+            ["c", "b", "a", "d"],
+            topological_order({"a": {"b"}, "b": {"c"}, "c": set(), "d": {"c"}}),
+        )
+
+    def test_sequential_refresh(self):
+        self._refresh_and_check(1, 20)
+
+    def test_parallel_refresh(self):
+        self._refresh_and_check(3, 20)
+        self._refresh_and_check(3, 30)
+
+    def test_admin_shows_dependencies(self):
+        _init(self)
+        client = _login_admin(self)
+
+        response = client.get(
+            "/admin/%s/%s/"
+            % (MaterializedQuery._meta.app_label, MaterializedQuery._meta.model_name)
+        )
+
+        self.assertContains(response, '<td class="field-depends_on">dependency_b</td>')
+        self.assertContains(response, '<td class="field-required_by">dependency_a</td>')
+
+
+class RefreshSchedulerTestCase(TestCase):
+    def setUp(self):
+        caches["workers_locks"].client.get_client().delete(
+            scheduler.DATA_SOURCES_KEY,
+            scheduler.QUERIES_KEY,
+            scheduler.DIRTY_SINCE_KEY,
+            scheduler.DUE_KEY,
+        )
+
+    def _at(self, timestamp, function, *args):
+        with patch.object(scheduler, "time") as time:
+            time.time.return_value = timestamp
+            return function(*args)
+
+    @override_settings(
+        MATERIALIZED_QUERIES_REFRESH_WINDOW=60,
+        MATERIALIZED_QUERIES_REFRESH_MAX_STALENESS=900,
+    )
+    def test_coalesce_changes(self):
+        self.assertEqual(1060, self._at(1000, scheduler.mark_dirty, 1))
+        self.assertEqual(1090, self._at(1030, scheduler.mark_dirty, 2))
+
+        # the second change postponed the refresh
+        self.assertIsNone(self._at(1070, scheduler.pop_due_changes))
+        self.assertEqual(([1, 2], None), self._at(1090, scheduler.pop_due_changes))
+
+        # a single refresh covers both changes
+        self.assertIsNone(self._at(1090, scheduler.pop_due_changes))
+
+    @override_settings(
+        MATERIALIZED_QUERIES_REFRESH_WINDOW=60,
+        MATERIALIZED_QUERIES_REFRESH_MAX_STALENESS=100,
+    )
+    def test_max_staleness(self):
+        self._at(1000, scheduler.mark_dirty, 1, ["view1"])
+        self._at(1050, scheduler.mark_dirty, 2, ["view2"])
+        self.assertEqual(1100, self._at(1090, scheduler.mark_dirty, None, ["view1"]))
+
+        self.assertEqual(
+            (None, ["view1", "view2"]), self._at(1100, scheduler.pop_due_changes)
+        )
+
+        # following changes start a new wait
+        self.assertEqual(1160, self._at(1100, scheduler.mark_dirty, 3))
+
+    @override_settings(MATERIALIZED_QUERIES_REFRESH_WINDOW=0)
+    @patch("materialized_queries_manager.tasks.refresh")
+    def test_scheduled_refresh(self, refresh_mock):
+        schedule_refresh(1)
+
+        refresh_mock.assert_called_once_with(
+            ANY, [1], query_set=None, maintained_query_set=None
+        )
+
+    @override_settings(MATERIALIZED_QUERIES_REFRESH_WINDOW=0)
+    @patch("materialized_queries_manager.tasks.refresh", side_effect=RuntimeError)
+    def test_failed_refresh(self, _):
+        scheduler.mark_dirty(1, ["view1"])
+        scheduler.mark_dirty(2, ["view2"])
+
+        with patch.object(scheduled_refresh_task, "apply_async") as apply_async:
+            self.assertRaises(RuntimeError, scheduled_refresh_task)
+
+        # the changes are refreshed by a new scheduled refresh
+        apply_async.assert_called_once()
+        self.assertEqual(
+            ([1, 2], ["view1", "view2"]),
+            self._at(time.time() + 1, scheduler.pop_due_changes),
+        )
+
+
+class RefreshHistoryTestCase(TransactionTestCase):
+    databases = "__all__"
+
+    views = ("history_view", "history_failing")
+
+    def setUp(self):
+        with connections["achilles"].cursor() as cursor:
+            cursor.execute("CREATE TABLE history_source (value integer)")
+            cursor.execute("INSERT INTO history_source VALUES (1), (2)")
+            cursor.execute(
+                "CREATE MATERIALIZED VIEW history_view AS SELECT * FROM history_source"
+            )
+            cursor.execute(
+                "CREATE MATERIALIZED VIEW history_failing AS "
+                "SELECT 1 / min(value) AS total FROM history_source"
+            )
+
+    def tearDown(self):
+        with connections["achilles"].cursor() as cursor:
+            cursor.execute("DROP TABLE history_source CASCADE")
+
+    def _refresh(self):
+        with connections["achilles"].cursor() as cursor:
+            cursor.execute("INSERT INTO history_source VALUES (0)")
+
+        return refresh(
+            logging.getLogger(RefreshHistoryTestCase.__name__),
+            [1],
+            query_set=MaterializedQuery.objects.filter(matviewname__in=self.views),
+        )
+
+    def test_items(self):
+        run = self._refresh()
+
+        self.assertEqual("datasource 1", run.origin)
+        self.assertEqual([1], run.data_sources)
+        self.assertIsNotNone(run.end_time)
+
+        item = run.items.get(name="history_view")
+        self.assertFalse(item.maintained)
+        self.assertEqual(3, item.row_count)
+        self.assertGreater(item.size, 0)
+        self.assertEqual(item.end_time - item.start_time, item.duration)
+        self.assertIsNone(item.error)
+
+        item = run.items.get(name="history_failing")
+        self.assertIsNone(item.row_count)
+        self.assertIn("division by zero", item.error)
+
+    def test_command_summary(self):
+        with connections["achilles"].cursor() as cursor:
+            cursor.execute("INSERT INTO history_source VALUES (0)")
+
+        out = io.StringIO()
+        call_command("refresh_mat_views", stdout=out)
+
+        self.assertIn("Failed: history_failing", out.getvalue())
+        self.assertIn("history_view: ", out.getvalue())
+
+    def test_admin_sorted_by_slowest(self):
+        _init(self)
+        client = _login_admin(self)
+        run = self._refresh()
+        run.items.filter(name="history_view").update(duration=timedelta(hours=1))
+
+        response = client.get(
+            "/admin/%s/%s/"
+            % (RefreshRunItem._meta.app_label, RefreshRunItem._meta.model_name)
+        )
+
+        self.assertContains(response, "history_failing")
+        content = response.content.decode()
+        self.assertLess(content.index("history_view"), content.index("history_failing"))
+
+
+class AffectedQueriesTestCase(TransactionTestCase):
+    databases = "__all__"
+
+    views = {
+        "analysis_1": "SELECT analysis_id, count_value FROM achilles_results "
+        "WHERE analysis_id = 1",
+        "analysis_2": "SELECT count_value FROM achilles_results WHERE analysis_id = 2",
+        "any_analysis": "SELECT count_value FROM achilles_results",
+        "from_analysis_1": "SELECT count_value FROM analysis_1 WHERE analysis_id = 3",
+    }
+
+    def setUp(self):
+        with connections["achilles"].cursor() as cursor:
+            for name, definition in self.views.items():
+                cursor.execute(f"CREATE MATERIALIZED VIEW {name} AS {definition}")
+
+    def tearDown(self):
+        with connections["achilles"].cursor() as cursor:
+            for name in reversed(list(self.views)):
+                cursor.execute(f"DROP MATERIALIZED VIEW {name}")
+
+    def test_affected_queries(self):
+        affected = affected_queries({1}) & self.views.keys()
+
+        # from_analysis_1 selects from an affected view
+        self.assertEqual({"analysis_1", "any_analysis", "from_analysis_1"}, affected)
@@ -1,42 +1,266 @@
+import contextlib
+import functools
+import traceback
+
+from django.conf import settings
 from django.core.cache import caches
-from django.db import connections
+from django.db import connections, router, transaction
+from django.utils import timezone
 from redis_rw_lock import RWLock
 
-from materialized_queries_manager.models import MaterializedQuery
+from materialized_queries_manager.dependencies import (
+    dependency_graph,
+    run_in_order,
+    topological_order,
+)
+from materialized_queries_manager.incremental import refresh_maintained
+from materialized_queries_manager.models import (
+    MaintainedQuery,
+    MaterializedQuery,
+    RefreshRun,
+    RefreshRunItem,
+)
+
+
+def unique_key_index(matviewname):
+    return f"{matviewname}_unique_key"
+
+
+def get_unique_key(cursor, matviewname):
+    """
+    Gets the columns of a unique index of a materialized view that allows
+     refreshing it concurrently, meaning that it only has columns and covers all rows
+
+    :param cursor: cursor of a connection to the achilles database
+    :param matviewname: name of the materialized view
+    :return: list of column names or None if there is no such index
+    """
+    cursor.execute(
+        """
+        SELECT array_agg(attribute.attname ORDER BY key.position)
+        FROM pg_index AS index
+        CROSS JOIN unnest(index.indkey::int2[]) WITH ORDINALITY AS key(attnum, position)
+        JOIN pg_attribute AS attribute
+            ON attribute.attrelid = index.indrelid AND attribute.attnum = key.attnum
+        WHERE index.indrelid = to_regclass(%s)
+            AND index.indisunique
+            AND index.indpred IS NULL
+            AND index.indexprs IS NULL
+        GROUP BY index.indexrelid
+        ORDER BY index.indexrelid
+        LIMIT 1
+        """,
+        (matviewname,),
+    )
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def set_unique_key(cursor, matviewname, unique_key):
+    """
+    Replaces the unique index declared for a materialized view
+
+    :param cursor: cursor of a connection to the achilles database
+    :param matviewname: name of the materialized view
+    :param unique_key: list of columns of the new index. If empty, the index is just removed
+    """
+    index = unique_key_index(matviewname)
+
+    cursor.execute(f"DROP INDEX IF EXISTS {index}")
+    if unique_key:
+        cursor.execute(
+            f"CREATE UNIQUE INDEX {index} ON {matviewname} ({', '.join(unique_key)})"
+        )
+
+
+@contextlib.contextmanager
+def _record_refresh(run, name, maintained):
+    """
+    Stores on the refresh history how long the refresh of a relation took
+    """
+    item = RefreshRunItem(
+        run=run, name=name, maintained=maintained, start_time=timezone.now()
+    )
+    try:
+        yield
+    except:  # noqa
+        item.error = traceback.format_exc()
+        raise
+    finally:
+        item.end_time = timezone.now()
+        item.duration = item.end_time - item.start_time
+        item.save()
+
+
+def _record_sizes(run):
+    """
+    Stores on the refresh history the number of records and the size of the relations
+     refreshed successfully. Called once the refresh lock is released, since counting the
+     records of large relations would keep uploads waiting
+    """
+    with connections["achilles"].cursor() as cursor:
+        for item in run.items.filter(error__isnull=True):
+            cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (item.name,))
+            if not cursor.fetchone()[0]:
+                continue
+
+            cursor.execute(
+                f"SELECT count(*), pg_total_relation_size(%s) FROM {item.name}",
+                (item.name,),
+            )
+            item.row_count, item.size = cursor.fetchone()
+            item.save(update_fields=("row_count", "size"))
+
+
+def _refresh_materialized_view(
+    logger, run, materialized_query, position, total, origin
+):
+    try:
+        logger.info(
+            "Refreshing materialized view %s (%d/%d) [%s]",
+            materialized_query.matviewname,
+            position,
+            total,
+            origin,
+        )
+        with _record_refresh(run, materialized_query.matviewname, False), connections[
+            "achilles"
+        ].cursor() as cursor:
+            # with a unique index, the view can still be read while refreshing
+            concurrently = (
+                get_unique_key(cursor, materialized_query.matviewname) is not None
+            )
+            cursor.execute(
+                "REFRESH MATERIALIZED VIEW "
+                f"{'CONCURRENTLY ' if concurrently else ''}"
+                f"{materialized_query.matviewname}"
+            )
+    except:  # noqa
+        logger.exception(
+            "Some unexpected error happen while refreshing materialized query %s. [%s]",
+            materialized_query.matviewname,
+            origin,
+        )
+
+
+def _refresh_maintained_table(
+    logger, run, maintained_query, position, total, origin, db_ids
+):
+    try:
+        logger.info(
+            "Refreshing maintained table %s (%d/%d) [%s]",
+            maintained_query.name,
+            position,
+            total,
+            origin,
+        )
+        with _record_refresh(run, maintained_query.name, True), transaction.atomic(
+            using=router.db_for_write(MaintainedQuery)
+        ), connections["achilles"].cursor() as cursor:
+            refresh_maintained(cursor, maintained_query, db_ids)
+    except:  # noqa
+        logger.exception(
+            "Some unexpected error happen while refreshing maintained table %s. [%s]",
+            maintained_query.name,
+            origin,
+        )
+
 
+def _run_on_own_connection(job):
+    try:
+        job()
+    finally:
+        # each thread of the pool opens its own connections
+        connections.close_all()
 
-def refresh(logger, db_id=None, query_set=None):
+
+def refresh(
+    logger, db_ids=None, query_set=None, maintained_query_set=None, parallelism=None
+):
+    """
+    Refreshes materialized views and maintained tables. If none is provided, all are refreshed.
+
+    :param db_ids: ids of the data sources whose results data changed. If provided, only the
+     records of these data sources are refreshed on the maintained tables
+    :param query_set: materialized views to refresh
+    :param maintained_query_set: maintained tables to refresh
+    :param parallelism: number of connections refreshing at the same time. Defaults to
+     the MATERIALIZED_QUERIES_REFRESH_PARALLELISM setting
+    :return: record of the refresh on the refresh history
+    """
     cache = caches["workers_locks"]
 
+    if query_set is None and maintained_query_set is None:
+        query_set = MaterializedQuery.objects.all()
+        maintained_query_set = MaintainedQuery.objects.all()
+
+    if parallelism is None:
+        parallelism = settings.MATERIALIZED_QUERIES_REFRESH_PARALLELISM
+
+    origin = (
+        "command"
+        if not db_ids
+        else f"datasource {', '.join(str(db_id) for db_id in db_ids)}"
+    )
+
     # Only one worker can update the materialized views at the same time -> same as -> only one thread
     #  can write to a file at the same time
     with RWLock(
         cache.client.get_client(), "celery_worker_updating", RWLock.WRITE, expire=None
     ):
-        logger.info(
-            "Updating materialized views [%s]",
-            "command" if not db_id else f"datasource {db_id}",
+        logger.info("Updating materialized views [%s]", origin)
+
+        run = RefreshRun.objects.create(origin=origin, data_sources=db_ids)
+
+        to_refresh = {
+            materialized_query.matviewname: functools.partial(
+                _refresh_materialized_view, logger, run, materialized_query
+            )
+            for materialized_query in (query_set if query_set is not None else [])
+        }
+        to_refresh.update(
+            (
+                maintained_query.name,
+                functools.partial(
+                    _refresh_maintained_table,
+                    logger,
+                    run,
+                    maintained_query,
+                    db_ids=db_ids,
+                ),
+            )
+            for maintained_query in (
+                maintained_query_set if maintained_query_set is not None else []
+            )
         )
 
+        # views that select from other views are only refreshed after them
         with connections["achilles"].cursor() as cursor:
-            to_refresh = MaterializedQuery.objects.all() if not query_set else query_set
-            total = len(to_refresh)
-
-            for i, materialized_query in enumerate(to_refresh):
-                try:
-                    logger.info(
-                        "Refreshing materialized view %s (%d/%d) [%s]",
-                        materialized_query.matviewname,
-                        i + 1,
-                        total,
-                        "command" if not db_id else f"datasource {db_id}",
-                    )
-                    cursor.execute(
-                        f"REFRESH MATERIALIZED VIEW {materialized_query.matviewname}"
-                    )
-                except:  # noqa
-                    logger.exception(
-                        "Some unexpected error happen while refreshing materialized query %s. [%s]",
-                        materialized_query.name,
-                        "command" if not db_id else f"datasource {db_id}",
-                    )
+            dependencies = dependency_graph(cursor)
+
+        order = topological_order(
+            {
+                name: dependencies.get(name, set()) & to_refresh.keys()
+                for name in to_refresh
+            }
+        )
+        jobs = {
+            name: functools.partial(
+                to_refresh[name], position=i + 1, total=len(order), origin=origin
+            )
+            for i, name in enumerate(order)
+        }
+
+        run_in_order(
+            jobs,
+            dependencies,
+            parallelism,
+            _run_on_own_connection if parallelism > 1 else lambda job: job(),
+        )
+
+        run.end_time = timezone.now()
+        run.save()
+
+    _record_sizes(run)
+
+    return run
@@ -16,7 +16,7 @@ from .models import (
     PendingUpload,
     UploadHistory,
 )
-from .tasks import delete_datasource
+from .tasks import delete_datasource, rehydrate_archived_upload
 
 IS_POPUP_VAR = "_popup"
 
@@ -27,11 +27,29 @@ admin.site.register(DatabaseType)
 
 @admin.register(UploadHistory)
 class UploadHistoryAdmin(admin.ModelAdmin):
-    list_display = ("data_source", "upload_date")
+    list_display = ("data_source", "upload_date", "moved_to_file")
+
+    actions = ["rehydrate_selected"]
 
     def has_add_permission(self, *_, **__):
         return False
 
+    @admin.display(boolean=True, description="Archived records on file")
+    def moved_to_file(self, obj):
+        return bool(obj.archive_file)
+
+    @admin.action(description="Restore archived records from their files")
+    def rehydrate_selected(self, request, queryset):
+        uploads = queryset.exclude(archive_file="").exclude(archive_file__isnull=True)
+        for upload_history in uploads:
+            rehydrate_archived_upload.delay(upload_history.id)
+
+        self.message_user(
+            request,
+            f"The archived records of {len(uploads)} uploads are being restored on background.",
+            messages.SUCCESS,
+        )
+
 
 @admin.register(PendingUpload)
 class PendingUploadAdmin(admin.ModelAdmin):
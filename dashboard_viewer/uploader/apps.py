@@ -1,5 +1,11 @@
 from django.apps import AppConfig
+from django.db.models.signals import pre_migrate
 
 
 class UploaderConfig(AppConfig):
     name = "uploader"
+
+    def ready(self):
+        from .versions import refuse_versioned_migrations
+
+        pre_migrate.connect(refuse_versioned_migrations, sender=self)
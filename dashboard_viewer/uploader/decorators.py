@@ -3,6 +3,7 @@ from functools import wraps
 from django.conf import settings
 from django.http import HttpResponseForbidden
 from django.views.decorators.csrf import csrf_exempt
+from rest_framework.permissions import BasePermission
 
 
 def uploader_decorator(view_func):
@@ -23,3 +24,15 @@ def uploader_decorator(view_func):
         wrapped_view = wraps(wrapped_view)(check_host)
 
     return wrapped_view
+
+
+class FromMainApplication(BasePermission):
+    """
+    Same verification as the uploader_decorator, for DRF views
+    """
+
+    def has_permission(self, request, view):
+        return (
+            settings.SINGLE_APPLICATION_MODE
+            or request.get_host() == settings.MAIN_APPLICATION_HOST
+        )
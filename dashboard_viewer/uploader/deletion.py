@@ -0,0 +1,85 @@
+from django.db import connections, router, transaction
+
+from . import partitions, versions
+from .models import (
+    AchillesResults,
+    AchillesResultsArchive,
+    DataSource,
+    PendingUpload,
+    UploadHistory,
+    UploadSession,
+)
+
+
+def _delete_results_records(cursor, data_source_id, upload_ids):
+    results = AchillesResults._meta.db_table
+    archive = AchillesResultsArchive._meta.db_table
+
+    if versions.is_versioned(cursor):
+        # the records of all uploads, current or archived, are on the same table
+        cursor.execute(
+            f"DELETE FROM {versions.VERSIONS_TABLE} WHERE data_source_id = %s",
+            (data_source_id,),
+        )
+        return
+
+    if partitions.is_partitioned(cursor):
+        partitions.drop_partition(cursor, data_source_id)
+    else:
+        cursor.execute(
+            f"DELETE FROM {results} WHERE data_source_id = %s", (data_source_id,)
+        )
+
+    if partitions.is_archive_partitioned(cursor):
+        for upload_id in upload_ids:
+            partitions.drop_archive_partition(cursor, upload_id)
+    else:
+        cursor.execute(
+            f"DELETE FROM {archive} WHERE data_source_id = %s", (data_source_id,)
+        )
+
+
+def delete_data_source(data_source_id):
+    """
+    Deletes a data source and all its records with one statement per table, or by dropping
+     partitions, instead of loading every related record as django's deletion cascade does.
+     Tables are emptied in dependency order: results data first, then uploads and upload
+     sessions, then the data source. Since no delete signals are sent, the stored files of the
+     uploads are not deleted here, but by the sweep function of the storage module.
+
+    :param data_source_id: id of the data source
+    :return: True if the data source existed
+    """
+    using = router.db_for_write(DataSource)
+
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        cursor.execute(
+            f"SELECT id FROM {DataSource._meta.db_table} WHERE id = %s FOR UPDATE",
+            (data_source_id,),
+        )
+        if cursor.fetchone() is None:
+            return False
+
+        cursor.execute(
+            f"SELECT id FROM {UploadHistory._meta.db_table} WHERE data_source_id = %s",
+            (data_source_id,),
+        )
+        upload_ids = [row[0] for row in cursor.fetchall()]
+
+        _delete_results_records(cursor, data_source_id, upload_ids)
+
+        cursor.execute(
+            f"UPDATE {DataSource._meta.db_table} SET active_upload_id = NULL WHERE id = %s",
+            (data_source_id,),
+        )
+        for model in (PendingUpload, UploadSession, UploadHistory):
+            cursor.execute(
+                f"DELETE FROM {model._meta.db_table} WHERE data_source_id = %s",
+                (data_source_id,),
+            )
+        cursor.execute(
+            f"DELETE FROM {DataSource._meta.db_table} WHERE id = %s",
+            (data_source_id,),
+        )
+
+    return True
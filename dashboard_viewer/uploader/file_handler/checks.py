@@ -1,17 +1,36 @@
+import concurrent.futures
+import contextlib
 import csv
-import hashlib
 import io
-import os
+import itertools
+import re
+import threading
 
 import numpy
 import pandas
+import psycopg2
+import psycopg2.errors
+import pyarrow
+import pyarrow.compute
 from django.conf import settings
-from django.core.cache import caches
-from django.db import connections, transaction, utils
-from redis_rw_lock import RWLock
-
-from materialized_queries_manager.models import MaterializedQuery
-from uploader.models import AchillesResults, DataSource, UploadHistory
+from django.db import connections
+
+from materialized_queries_manager.analyses import referenced_analyses
+from materialized_queries_manager.models import (
+    MaintainedQuery,
+    MaterializedQuery,
+)
+from uploader.models import AchillesResults, compute_file_hash, UploadHistory
+from .compression import DecompressionError, open_results_file
+from .loaders import (
+    cast_columnar_table,
+    columnar_format,
+    columnar_schema,
+    copy_results_file,
+    read_columnar_file,
+    read_csv_with_arrow,
+    SpillWriter,
+)
 
 
 class FileChecksException(Exception):
@@ -41,15 +60,15 @@ class MissingFieldValue(FileChecksException):
 class EqualFileAlreadyUploaded(FileChecksException):
     pass
 
+
 class FileDataCorrupted(FileChecksException):
     pass
 
 
-def _generate_file_reader(uploaded_file):
+def _columns_for_field_count(field_count):
     """
-    Receives a python file pointer and returns a pandas csv file reader, along with the columns
-     present in the file
-    :param uploaded_file: python file pointer of the uploaded file
+    Columns present in a results file with the given number of fields,
+     or None if the number is invalid
     """
     columns = [
         "analysis_id",
@@ -61,6 +80,32 @@ def _generate_file_reader(uploaded_file):
         "count_value",
     ]
 
+    if field_count == 16:
+        columns.extend(
+            (
+                "min_value",
+                "max_value",
+                "avg_value",
+                "stdev_value",
+                "median_value",
+                "p10_value",
+                "p25_value",
+                "p75_value",
+                "p90_value",
+            )
+        )
+    elif field_count != 7:
+        return None
+
+    return columns
+
+
+def _get_file_columns(uploaded_file):
+    """
+    Receives a python file pointer and returns the columns present in the file,
+     based on the number of fields of its first row
+    :param uploaded_file: python file pointer of the uploaded file
+    """
     wrapper = io.TextIOWrapper(uploaded_file)
     csv_reader = csv.reader(wrapper)
 
@@ -75,21 +120,8 @@ def _generate_file_reader(uploaded_file):
 
     wrapper.detach()
 
-    if len(first_row) == 16:
-        columns.extend(
-            (
-                "min_value",
-                "max_value",
-                "avg_value",
-                "stdev_value",
-                "median_value",
-                "p10_value",
-                "p25_value",
-                "p75_value",
-                "p90_value",
-            )
-        )
-    elif len(first_row) != 7:
+    columns = _columns_for_field_count(len(first_row))
+    if columns is None:
         raise InvalidFileFormat(
             "The provided file has an invalid number of columns. "
             "Make sure you uploaded a valid comma-separated values (CSV) file."
@@ -97,6 +129,17 @@ def _generate_file_reader(uploaded_file):
 
     uploaded_file.seek(0)
 
+    return columns
+
+
+def _generate_file_reader(uploaded_file):
+    """
+    Receives a python file pointer and returns a pandas csv file reader, along with the columns
+     present in the file
+    :param uploaded_file: python file pointer of the uploaded file
+    """
+    columns = _get_file_columns(uploaded_file)
+
     try:
         file_reader = pandas.read_csv(
             uploaded_file,
@@ -153,9 +196,90 @@ def _check_correct(names, values, check, transform=None):
     return transformed_elements
 
 
-def extract_data_from_uploaded_file(uploaded_file):
-    file_reader, columns = _generate_file_reader(uploaded_file)
+class _MetadataAccumulator:
+    """
+    Keeps, while the uploaded file is read chunk by chunk, the first row and the number of
+     rows of each metadata analysis (0 and 5000), so only a constant amount of data is kept
+     in memory. The ids of all analyses present in the file are also collected.
+
+    If the file is sorted by analysis_id, once an analysis id above 5000 is reached there
+     can't be more metadata rows, so the following chunks are only checked to still be sorted
+     instead of being searched for metadata rows.
+    """
+
+    ANALYSES = (0, 5000)
+
+    def __init__(self):
+        self._counts = dict.fromkeys(self.ANALYSES, 0)
+        self._rows = {}
+        self._sorted = True
+        self._last_analysis_id = None
+        self.analyses = set()
+
+    def update(self, chunk):
+        analysis_ids = chunk.analysis_id
+        if analysis_ids.empty:
+            return
+
+        self.analyses.update(analysis_ids.unique().tolist())
+
+        if self._sorted:
+            self._sorted = analysis_ids.is_monotonic_increasing and (
+                self._last_analysis_id is None
+                or self._last_analysis_id <= analysis_ids.iloc[0]
+            )
+            passed_metadata = (
+                self._sorted
+                and self._last_analysis_id is not None
+                and self._last_analysis_id > self.ANALYSES[-1]
+            )
+            self._last_analysis_id = analysis_ids.iloc[-1]
+
+            if passed_metadata:
+                return
+
+        metadata_rows = chunk[analysis_ids.isin(self.ANALYSES)]
+        if metadata_rows.empty:
+            return
+
+        for analysis_id in self.ANALYSES:
+            rows = metadata_rows[metadata_rows.analysis_id == analysis_id]
+            if not rows.empty:
+                self._counts[analysis_id] += len(rows)
+                self._rows.setdefault(analysis_id, rows.iloc[0])
+
+        output = _check_correct(
+            [str(analysis_id) for analysis_id in self.ANALYSES],
+            [self._counts[analysis_id] for analysis_id in self.ANALYSES],
+            lambda count: count <= 1,
+        )
+        if isinstance(output, str):
+            raise DuplicatedMetadataRow(
+                f"Analysis id{output} duplicated on multiple rows. Try (re)running the plugin "
+                "<a href='https://github.com/EHDEN/CatalogueExport'>CatalogueExport</a>"
+                " on your database."
+            )
+
+    def found(self, analysis_id):
+        return analysis_id in self._rows
+
+    def get(self, analysis_id, stratum):
+        """
+        Value of a column of the metadata row of the given analysis,
+         or None if there is no such row or the value is null
+        """
+        row = self._rows.get(analysis_id)
+        if row is None:
+            return None
+
+        value = row[stratum]
+
+        if pandas.isna(value):
+            return None
+        return value
 
+
+def _get_columns_types(columns):
     types = {
         "analysis_id": numpy.int64,
         "stratum_1": "string",
@@ -180,237 +304,382 @@ def extract_data_from_uploaded_file(uploaded_file):
             },
         )
 
-    metadata = None
+    return types
 
-    while True:
-        try:
-            chunk = next(file_reader)
-        except ValueError:
-            raise InvalidFileFormat(
-                "The provided file has an invalid csv format. Make sure is a text file separated"
-                " by <b>commas</b> and you either have 7 (regular results file) or 13 (results file"
-                " with dist columns) columns."
-            )
-        except StopIteration:
-            break
-        except:  # noqa
-            raise InvalidCSVFile(
-                "There was an error parsing the provided file. "
-                "Uploaded files must be comma-separated values (CSV) files. "
-                "If you think this is an error, please contact the system administrator."
-            )
 
-        if chunk[["analysis_id", "count_value"]].isna().values.any():
-            raise InvalidFieldValue(
-                'Some rows have null values either on the column "analysis_id" or "count_value".'
-            )
+def _validate_with_pandas(uploaded_file, spill_path):
+    """
+    Validates the uploaded file reading it in small chunks with pandas
 
-        try:
-            chunk = chunk.astype(types)
-        except ValueError:
-            raise InvalidFieldValue(
-                'The provided file has invalid values on some columns. Remember that only the "stratum_*" columns'
-                " accept strings, all the other fields expect numeric types."
-            )
+    :return: the columns present in the file, their types and the metadata rows found
+    """
+    file_reader, columns = _generate_file_reader(uploaded_file)
+    types = _get_columns_types(columns)
 
-        metadata_rows = chunk[chunk.analysis_id.isin((0, 5000))]
+    metadata = _MetadataAccumulator()
 
-        if metadata is None:
-            metadata = metadata_rows
-        else:
-            metadata = pandas.concat(
-                (metadata, metadata_rows), ignore_index=True, copy=False
-            )
+    if spill_path:
+        spill_writer = SpillWriter(spill_path, columns)
+    else:
+        spill_writer = contextlib.nullcontext()
 
-        output = _check_correct(
-            ["0", "5000"],
-            (
-                metadata[metadata.analysis_id == 0],
-                metadata[metadata.analysis_id == 5000],
-            ),
-            lambda e: len(e) <= 1,
-        )
-        if isinstance(output, str):
-            raise DuplicatedMetadataRow(
-                f"Analysis id{output} duplicated on multiple rows. Try (re)running the plugin "
-                "<a href='https://github.com/EHDEN/CatalogueExport'>CatalogueExport</a>"
-                " on your database."
+    with spill_writer:
+        while True:
+            try:
+                chunk = next(file_reader)
+            except ValueError:
+                raise InvalidFileFormat(
+                    "The provided file has an invalid csv format. Make sure is a text file separated"
+                    " by <b>commas</b> and you either have 7 (regular results file) or 13 (results file"
+                    " with dist columns) columns."
+                )
+            except StopIteration:
+                break
+            except:  # noqa
+                raise InvalidCSVFile(
+                    "There was an error parsing the provided file. "
+                    "Uploaded files must be comma-separated values (CSV) files. "
+                    "If you think this is an error, please contact the system administrator."
+                )
+
+            if chunk[["analysis_id", "count_value"]].isna().values.any():
+                raise InvalidFieldValue(
+                    'Some rows have null values either on the column "analysis_id" or "count_value".'
+                )
+
+            try:
+                chunk = chunk.astype(types)
+            except ValueError:
+                raise InvalidFieldValue(
+                    'The provided file has invalid values on some columns. Remember that only the "stratum_*" columns'
+                    " accept strings, all the other fields expect numeric types."
+                )
+
+            metadata.update(chunk)
+
+            if spill_path:
+                spill_writer.write(chunk)
+
+    return columns, types, metadata
+
+
+def _update_metadata_from_table(metadata, table):
+    # only the metadata rows are converted to pandas
+    metadata.update(
+        table.filter(
+            pyarrow.compute.is_in(
+                table["analysis_id"],
+                value_set=pyarrow.array(_MetadataAccumulator.ANALYSES),
             )
+        ).to_pandas()
+    )
+    metadata.analyses.update(pyarrow.compute.unique(table["analysis_id"]).to_pylist())
 
-    analysis_0 = metadata[metadata.analysis_id == 0]
-    if analysis_0.empty:
-        raise MissingFieldValue(
-            "Analysis id 0 is missing. Try (re)running the plugin "
-            "<a href='https://github.com/EHDEN/CatalogueExport'>CatalogueExport</a>"
-            " on your database."
-        )
 
-    analysis_0 = analysis_0.reset_index()
-    analysis_5000 = metadata[metadata.analysis_id == 5000].reset_index()
+def _validate_with_arrow(uploaded_file, spill_path):
+    """
+    Validates the uploaded file parsing it, block by block, with pyarrow's CSV reader.
+     Since the pandas engine is the reference for the errors reported to the user,
+     any problem found here is raised as an ArrowException so the file is validated
+     again with the pandas engine, which also rewrites the spill file.
 
-    return {"columns": columns, "types": types}, {
-        "generation_date": _get_upload_attr(analysis_0, "stratum_3"),
-        "source_release_date": _get_upload_attr(analysis_5000, "stratum_2"),
-        "cdm_release_date": _get_upload_attr(analysis_5000, "stratum_3"),
-        "cdm_version": _get_upload_attr(analysis_5000, "stratum_4"),
-        "r_package_version": _get_upload_attr(analysis_0, "stratum_2"),
-        "vocabulary_version": _get_upload_attr(analysis_5000, "stratum_5"),
-    }
+    :return: the columns present in the file, their types and the metadata rows found
+    """
+    columns = _get_file_columns(uploaded_file)
 
+    metadata = _MetadataAccumulator()
 
-def _get_upload_attr(analysis, stratum):
-    if analysis.empty:
-        return None
+    if spill_path:
+        spill_writer = SpillWriter(spill_path, columns)
+    else:
+        spill_writer = contextlib.nullcontext()
 
-    value = analysis.loc[0, stratum]
+    with spill_writer:
+        for table in read_csv_with_arrow(uploaded_file, columns):
+            if table["analysis_id"].null_count or table["count_value"].null_count:
+                raise pyarrow.ArrowInvalid("null values on mandatory columns")
 
-    if pandas.isna(value):
-        return None
-    return value
+            _update_metadata_from_table(metadata, table)
 
+            if spill_path:
+                spill_writer.write_table(table)
 
-def check_for_duplicated_files(uploaded_file, data_source_id):
-    try:
-        # Upload History only stores the succeded files
+    return columns, _get_columns_types(columns), metadata
 
-        pd = UploadHistory.objects.filter(data_source_id=data_source_id).latest()
 
-        data_source_hash = (
-            DataSource.objects.filter(id=data_source_id)
-            .values_list("hash", flat=True)
-            .first()
-        )
+def _unreadable_file(file_format):
+    return InvalidFileFormat(
+        f"There was an error reading the provided {'Parquet' if file_format == 'parquet' else 'Arrow'} file. "
+        "If you think this is an error, please contact the system administrator."
+    )
 
-        if data_source_hash is not None and bool(pd.uploaded_file):
-            # Go to the path where success files are stored
 
-            latest_file_path = os.path.join(settings.MEDIA_ROOT, pd.uploaded_file.path)
+def _validate_columnar(uploaded_file, file_format, spill_path):
+    """
+    Validates a Parquet or Arrow IPC file, one row group at a time. Since its columns are
+     already typed, no parsing is involved, only the conversion of the columns to the
+     types they will have on the database.
 
-            if os.path.exists(latest_file_path) and os.path.exists(uploaded_file.path):
-                with open(latest_file_path, "rb") as previous_upload_file:
-                    try:
-                        checksum_previous = hashlib.sha256(
-                            previous_upload_file.read()
-                        ).hexdigest()
+    :return: the columns present in the file, their types and the metadata rows found
+    """
+    try:
+        columns = _columns_for_field_count(
+            len(columnar_schema(uploaded_file, file_format))
+        )
+    except (pyarrow.ArrowException, OSError):
+        raise _unreadable_file(file_format)
+    if columns is None:
+        raise InvalidFileFormat(
+            "The provided file has an invalid number of columns. "
+            "Make sure it has either 7 (regular results file) or 16 (results file with dist columns) columns."
+        )
 
-                    except IOError:
-                        checksum_previous = None
+    metadata = _MetadataAccumulator()
 
-                with open(uploaded_file.path, "rb") as new_upload_file:
-                    try:
-                        checksum_new = hashlib.sha256(
-                            new_upload_file.read()
-                        ).hexdigest()
+    if spill_path:
+        spill_writer = SpillWriter(spill_path, columns)
+    else:
+        spill_writer = contextlib.nullcontext()
 
-                    except IOError:
-                        checksum_new = None
+    with spill_writer:
+        tables = read_columnar_file(uploaded_file, file_format)
+        while True:
+            try:
+                table = next(tables)
+            except StopIteration:
+                break
+            except (pyarrow.ArrowException, OSError):
+                raise _unreadable_file(file_format)
 
-                if (
-                    checksum_previous is not None
-                    and checksum_new is not None
-                    and checksum_previous == checksum_new
-                ):
-                    raise EqualFileAlreadyUploaded("File is already in the database")
+            try:
+                table = cast_columnar_table(table, columns)
+            except (pyarrow.ArrowInvalid, pyarrow.ArrowNotImplementedError):
+                raise InvalidFieldValue(
+                    'The provided file has invalid values on some columns. Remember that only the "stratum_*" columns'
+                    " accept strings, all the other fields expect numeric types."
+                )
 
-    except UploadHistory.DoesNotExist:
-        pass
+            if table["analysis_id"].null_count or table["count_value"].null_count:
+                raise InvalidFieldValue(
+                    'Some rows have null values either on the column "analysis_id" or "count_value".'
+                )
 
+            _update_metadata_from_table(metadata, table)
 
-def upload_data_to_tmp_table(data_source_id, file_metadata, pending_upload):
+            if spill_path:
+                spill_writer.write_table(table)
 
-    cache = caches["workers_locks"]
+    return columns, _get_columns_types(columns), metadata
 
-    with RWLock(
-        cache.client.get_client(), "celery_worker_updating", RWLock.WRITE, expire=None
-        ):
-    
-        # Upload New Data to a "temporary" table
-        pending_upload.uploaded_file.seek(0)
 
-        reader = pandas.read_csv(
-            pending_upload.uploaded_file,
-            header=0,
-            dtype=file_metadata["types"],
-            skip_blank_lines=False,
-            index_col=False,
-            names=file_metadata["columns"],
-            chunksize=500,
+def extract_data_from_uploaded_file(uploaded_file, spill_path=None):
+    """
+    Validates the uploaded file and extracts the data of the metadata rows (analyses 0 and 5000).
+     The engine used to parse CSV files is selected by the UPLOADER_VALIDATION_ENGINE setting.
+
+    :param uploaded_file: python file pointer of the uploaded file. Can be a CSV file, optionally
+     compressed with gzip or zstd, or a Parquet or Arrow IPC file
+    :param spill_path: if provided, the validated chunks are written to an Arrow IPC file on
+     this path, which is then used by the following stages of the upload process
+     instead of parsing the CSV file again
+    :return: the information required to read the file, and the data of the metadata rows
+    """
+    file_format = columnar_format(uploaded_file)
+    if file_format is None:
+        uploaded_file = open_results_file(uploaded_file)
+
+    if file_format is not None:
+        columns, types, metadata = _validate_columnar(
+            uploaded_file, file_format, spill_path
         )
+    elif settings.UPLOADER_VALIDATION_ENGINE == "arrow":
+        try:
+            columns, types, metadata = _validate_with_arrow(uploaded_file, spill_path)
+        except (pyarrow.ArrowException, FileChecksException, DecompressionError):
+            uploaded_file.seek(0)
+            columns, types, metadata = _validate_with_pandas(uploaded_file, spill_path)
+    else:
+        columns, types, metadata = _validate_with_pandas(uploaded_file, spill_path)
 
-        all_mat_views = MaterializedQuery.objects.exclude(matviewname__contains="tmp")
+    if not metadata.found(0):
+        raise MissingFieldValue(
+            "Analysis id 0 is missing. Try (re)running the plugin "
+            "<a href='https://github.com/EHDEN/CatalogueExport'>CatalogueExport</a>"
+            " on your database."
+        )
 
-        mat_views = {}
+    file_metadata = {
+        "columns": columns,
+        "types": types,
+        "analyses": metadata.analyses,
+    }
+    if file_format is not None:
+        file_metadata["format"] = file_format
+    if spill_path:
+        file_metadata["spill_path"] = spill_path
+
+    return file_metadata, {
+        "generation_date": metadata.get(0, "stratum_3"),
+        "source_release_date": metadata.get(5000, "stratum_2"),
+        "cdm_release_date": metadata.get(5000, "stratum_3"),
+        "cdm_version": metadata.get(5000, "stratum_4"),
+        "r_package_version": metadata.get(0, "stratum_2"),
+        "vocabulary_version": metadata.get(5000, "stratum_5"),
+    }
 
-        for mat_view in all_mat_views:
-            tmp_mat_view_name = mat_view.to_dict()["matviewname"] + "_tmp"
 
-            # To run the mat views (with data) against the "temporary table"
-            # To run for all mat views, as the data source can become with draft equal to true
+def check_for_duplicated_files(pending_upload):
+    """
+    Checks if the uploaded file is equal to one of the files successfully uploaded before
+     to the same data source, by comparing the digests calculated when the files were stored.
+
+    :param pending_upload: PendingUpload record of the uploaded file
+    """
+    content_hash = pending_upload.content_hash
+    if content_hash is None:
+        content_hash = compute_file_hash(pending_upload.uploaded_file)
+
+    if UploadHistory.objects.filter(
+        data_source_id=pending_upload.data_source_id, content_hash=content_hash
+    ).exists():
+        raise EqualFileAlreadyUploaded("File is already in the database")
+
+
+def _dry_run_query(definition, running, stop):
+    # definitions on pg_matviews end with a semicolon
+    definition = definition.strip().rstrip(";")
 
-            tmp_definition = mat_view.to_dict()["definition"].replace(
-                "achilles_results", "achilles_results_tmp"
+    connection = settings.ACHILLES_DB_SQLALCHEMY_ENGINE.raw_connection()
+    running.add(connection)
+    try:
+        if stop.is_set():  # another query already failed
+            return
+
+        with connection.cursor() as cursor:
+            # the whole row is referenced so postgres can't skip the computation of unused columns
+            cursor.execute(f"SELECT count(dry_run.*) FROM ({definition}) AS dry_run")
+    finally:
+        running.discard(connection)
+        connection.close()
+
+
+def _dry_run_materialized_views(definitions):
+    """
+    Runs the queries of materialized views, spread over a pool of connections, stopping
+     as soon as one of them fails. The queries still running are then cancelled.
+
+    :param definitions: queries of the materialized views
+    """
+    running = set()
+    stop = threading.Event()
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=settings.UPLOADER_VALIDATION_CONNECTIONS
+    ) as executor:
+        futures = [
+            executor.submit(_dry_run_query, definition, running, stop)
+            for definition in definitions
+        ]
+
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+        except psycopg2.DataError:
+            raise FileDataCorrupted("Uploaded file is not valid")
+        except psycopg2.errors.QueryCanceled:
+            raise FileChecksException(
+                "The validation of the uploaded data took too long"
+            )
+        except psycopg2.Error:
+            raise FileChecksException(
+                "The queries of the materialized views failed on the uploaded data"
             )
+        finally:
+            stop.set()
+            for future in futures:
+                future.cancel()
+            for connection in list(running):
+                connection.cancel()
 
-            mat_views[tmp_mat_view_name] = [
-                tmp_definition,
-            ]
 
-            # since draft can change with time, we must run the queries for all types of draft, namely with draft = true and draft = false
-            if "draft = false" in tmp_definition:
-                mat_views[tmp_mat_view_name].append(
-                    tmp_definition.replace("draft = false", "draft = true")
-                )
+def _staging_table_name(pending_upload):
+    return f"{AchillesResults._meta.db_table}_tmp_{pending_upload.id}"
+
+
+def upload_data_to_tmp_table(data_source_id, file_metadata, pending_upload):
+    """
+    Loads the uploaded file into a staging table and runs the definitions of the
+     materialized views against it, to check if the uploaded data doesn't break them.
+    Each pending upload has its own unlogged staging table, so several uploads can be
+     validated at the same time without blocking the workers updating results data.
+
+    :param data_source_id: id of the data source of the uploaded file
+    :param file_metadata: first element returned by the extract_data_from_uploaded_file function
+    :param pending_upload: PendingUpload record of the uploaded file
+    """
+    staging_table = _staging_table_name(pending_upload)
+
+    # To run the mat views (with data) against the staging table, the references
+    #  to the achilles_results table on their definitions are replaced
+    table_reference = re.compile(rf"\b{AchillesResults._meta.db_table}\b")
+
+    definitions = []
+
+    for definition in itertools.chain(
+        MaterializedQuery.objects.exclude(matviewname__contains="tmp").values_list(
+            "definition", flat=True
+        ),
+        MaintainedQuery.objects.values_list("definition", flat=True),
+    ):
+        analyses = referenced_analyses(definition)
+        if analyses is not None and analyses.isdisjoint(file_metadata["analyses"]):
+            # none of the records the view uses are on the uploaded file
+            continue
+
+        tmp_definition = table_reference.sub(staging_table, definition)
+
+        definitions.append(tmp_definition)
 
-        # Create "Temporary Upload" table, to store the data being uploaded
-        # Refresh of Materialized views does not allow the refresh in Temporary Tables
+        # since draft can change with time, we must run the queries for all types of draft, namely with draft = true and draft = false
+        if "draft = false" in tmp_definition:
+            definitions.append(tmp_definition.replace("draft = false", "draft = true"))
 
-        with transaction.atomic(), connections[
+    # Upload New Data to the staging table
+    pending_upload.uploaded_file.seek(0)
+
+    try:
+        # Not a temporary table since the queries of the views run on other connections
+        with connections[
             "achilles"
-        ].cursor() as cursor, settings.ACHILLES_DB_SQLALCHEMY_ENGINE.connect() as pandas_connection, pandas_connection.begin():
+        ].cursor() as cursor, settings.ACHILLES_DB_SQLALCHEMY_ENGINE.connect() as pandas_connection:
             try:
-                cursor.execute("DROP TABLE IF EXISTS achilles_results_tmp CASCADE")
+                cursor.execute(f"DROP TABLE IF EXISTS {staging_table} CASCADE")
                 cursor.execute(
-                    "CREATE TABLE IF NOT EXISTS achilles_results_tmp AS SELECT * FROM "
-                    + AchillesResults._meta.db_table
-                    + " WHERE FALSE"
+                    f"CREATE UNLOGGED TABLE {staging_table} "
+                    f"(LIKE {AchillesResults._meta.db_table})"
                 )
-                cursor.execute("CREATE SEQUENCE IF NOT EXISTS achilles_results_tmp_seq_id")
+                # not null is not copied if achilles_results is a view
                 cursor.execute(
-                    "ALTER TABLE achilles_results_tmp ALTER COLUMN id SET DEFAULT nextval('achilles_results_tmp_seq_id')"
+                    f"ALTER TABLE {staging_table} ALTER COLUMN id SET NOT NULL"
                 )
                 cursor.execute(
-                    "ALTER TABLE achilles_results_tmp ALTER COLUMN id SET NOT NULL"
+                    f"ALTER TABLE {staging_table} "
+                    "ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY"
                 )
 
-                # Upload data into "Temporary Table", similar structure to the actual upload process
-                for chunk in reader:
-                    chunk = chunk[chunk["stratum_1"].isin(["0"]) == False]
-                    chunk = chunk.assign(data_source_id=data_source_id)
-                    chunk.to_sql(
-                        "achilles_results_tmp",
-                        pandas_connection,
-                        if_exists="append",
-                        index=False,
-                    )
+                # Upload data into the staging table, similar structure to the actual upload process
+                copy_results_file(
+                    pandas_connection,
+                    staging_table,
+                    pending_upload.uploaded_file,
+                    file_metadata,
+                    data_source_id,
+                )
             except Exception:
                 raise InvalidCSVFile("Error processing the file")
 
-        # Fetch Materialized Views
-        # The option here is to change the definitions of the original mat views and replace
-        # the achilles_results references to achilles_results_tmp
-
-        with transaction.atomic(), connections["achilles"].cursor() as cursor:
-            try:
-                for tmp_mat_view_name in mat_views:  # noqa
-                    for tmp_definition in mat_views[tmp_mat_view_name]:
-                        cursor.execute(
-                            f"CREATE MATERIALIZED VIEW {tmp_mat_view_name} AS {tmp_definition}"
-                        )
-                        cursor.execute(f"DROP MATERIALIZED VIEW {tmp_mat_view_name}")
-            except utils.DataError:
-                cursor.execute("DROP TABLE IF EXISTS achilles_results_tmp CASCADE")
-                raise FileDataCorrupted("Uploaded file is not valid")
-
-        # Delete Temprary Upload data and its dependent (Materialzied Views)
-        with transaction.atomic(), connections["achilles"].cursor() as cursor:
-            cursor.execute("DROP TABLE IF EXISTS achilles_results_tmp CASCADE")
\ No newline at end of file
+        _dry_run_materialized_views(definitions)
+    finally:
+        # Delete the staging table
+        with connections["achilles"].cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {staging_table} CASCADE")
@@ -0,0 +1,120 @@
+import gzip
+import io
+import zlib
+
+import zstandard
+
+# extensions of compressed or archived files whose format isn't supported by the uploader
+UNSUPPORTED_EXTENSIONS = (".zip", ".bz2", ".xz", ".7z", ".rar", ".tar", ".tgz")
+
+
+class DecompressionError(Exception):
+    pass
+
+
+def _open_gzip(file):
+    return gzip.GzipFile(fileobj=file, mode="rb")
+
+
+def _open_zstd(file):
+    return zstandard.ZstdDecompressor().stream_reader(
+        file, read_across_frames=True, closefd=False
+    )
+
+
+# first bytes of a file of each compression format
+_DECOMPRESSORS = (
+    (b"\x1f\x8b", _open_gzip),
+    (b"\x28\xb5\x2f\xfd", _open_zstd),
+)
+
+
+class _DecompressedStream(io.RawIOBase):
+    """
+    Read-only file-like object over the decompressed contents of a file. Since a compressed
+     stream can't be read backwards, seeking to a previous position starts decompressing
+     the file from its beginning again.
+    """
+
+    def __init__(self, file, open_decompressor):
+        self._file = file
+        self._open_decompressor = open_decompressor
+        self._decompressor = None
+        self._position = 0
+        self.seek(0)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        try:
+            data = self._decompressor.read(len(buffer))
+        except (OSError, EOFError, zlib.error, zstandard.ZstdError) as e:
+            raise DecompressionError(f"The compressed file is corrupted: {e}") from e
+        buffer[: len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation(
+                "Can't seek from the end of a compressed stream"
+            )
+
+        if self._decompressor is None or offset < self._position:
+            if self._decompressor is not None:
+                self._decompressor.close()
+            self._file.seek(0)
+            self._decompressor = self._open_decompressor(self._file)
+            self._position = 0
+
+        while self._position < offset:
+            data = self._decompressor.read(
+                min(offset - self._position, io.DEFAULT_BUFFER_SIZE)
+            )
+            if not data:
+                break
+            self._position += len(data)
+
+        return self._position
+
+    def close(self):
+        # the underlying file is left open, as it belongs to the caller
+        if self._decompressor is not None:
+            self._decompressor.close()
+        super().close()
+
+
+def open_results_file(uploaded_file):
+    """
+    Provides the contents of an uploaded file, decompressing gzip and zstd files as they
+     are read, so they are never inflated to disk. The compression is detected from
+     the first bytes of the file, regardless of its name.
+
+    :param uploaded_file: python file pointer of the uploaded file
+    :return: the provided file, if it isn't compressed, otherwise a binary file-like object
+     with its decompressed contents
+    """
+    uploaded_file.seek(0)
+    magic = uploaded_file.read(4)
+    uploaded_file.seek(0)
+
+    # files opened in text mode are never compressed
+    if isinstance(magic, str):
+        return uploaded_file
+
+    for magic_bytes, open_decompressor in _DECOMPRESSORS:
+        if magic.startswith(magic_bytes):
+            return io.BufferedReader(
+                _DecompressedStream(uploaded_file, open_decompressor)
+            )
+
+    return uploaded_file
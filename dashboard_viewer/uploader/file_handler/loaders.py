@@ -0,0 +1,326 @@
+import contextlib
+import io
+
+import pandas
+import pyarrow
+import pyarrow.csv
+import pyarrow.ipc
+import pyarrow.parquet
+
+from .compression import open_results_file
+
+
+class _CSVChunksStream(io.TextIOBase):
+    """
+    File-like object that serializes, on demand, the chunks of results data into
+     CSV text so they can be streamed through a COPY FROM STDIN statement without
+     having the whole file in memory.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = ""
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return "".join(iter(lambda: self.read(io.DEFAULT_BUFFER_SIZE), ""))
+
+        while self._position >= len(self._buffer):
+            try:
+                chunk = next(self._chunks)
+            except StopIteration:
+                return ""
+            self._buffer = chunk.to_csv(header=False, index=False)
+            self._position = 0
+
+        data = self._buffer[self._position : self._position + size]
+        self._position += len(data)
+        return data
+
+
+def _prepare_chunk(chunk, data_source_id, upload_info_id):
+    chunk = chunk[chunk["stratum_1"].isin(["0"]) == False]  # noqa
+    chunk = chunk.assign(data_source_id=data_source_id)
+    if upload_info_id is not None:
+        chunk = chunk.assign(upload_info_id=upload_info_id)
+    return chunk
+
+
+def results_schema(columns):
+    """
+    :param columns: results data columns
+    :return: arrow schema with the type each column has on the database
+    """
+    fields = []
+    for column in columns:
+        if column.startswith("stratum_"):
+            arrow_type = pyarrow.string()
+        elif column in ("analysis_id", "count_value"):
+            arrow_type = pyarrow.int64()
+        else:
+            arrow_type = pyarrow.float64()
+
+        fields.append((column, arrow_type))
+
+    return pyarrow.schema(fields)
+
+
+class SpillWriter:
+    """
+    Writes the chunks that passed the validations of the uploaded file into
+     an Arrow IPC file (feather v2), so the following stages of the upload
+     process don't have to parse the CSV file again.
+    """
+
+    def __init__(self, path, columns):
+        self.path = path
+        self._schema = results_schema(columns)
+        self._writer = pyarrow.ipc.new_file(path, self._schema)
+
+    def write(self, chunk):
+        self._writer.write_batch(
+            pyarrow.RecordBatch.from_pandas(
+                chunk, schema=self._schema, preserve_index=False
+            )
+        )
+
+    def write_table(self, table):
+        self._writer.write_table(table)
+
+    def close(self):
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def read_csv_with_arrow(uploaded_file, columns):
+    """
+    Parses the uploaded file using pyarrow's streaming CSV reader, one block at a time so
+     the whole file is never in memory, converting each column to the type it will have on
+     the database. As on the pandas engine, blank lines are not skipped, so they make the
+     parsing fail.
+
+    :param uploaded_file: python file pointer of the uploaded file
+    :param columns: columns present in the file
+    :return: generator of arrow tables, one per parsed block
+    """
+    reader = pyarrow.csv.open_csv(
+        uploaded_file,
+        read_options=pyarrow.csv.ReadOptions(
+            use_threads=True, skip_rows=1, column_names=columns
+        ),
+        parse_options=pyarrow.csv.ParseOptions(ignore_empty_lines=False),
+        convert_options=pyarrow.csv.ConvertOptions(
+            column_types=results_schema(columns), strings_can_be_null=True
+        ),
+    )
+
+    for batch in reader:
+        yield pyarrow.Table.from_batches([batch])
+
+
+# first bytes of the files of each columnar format
+_COLUMNAR_FORMATS = (
+    (b"PAR1", "parquet"),
+    (b"ARROW1", "arrow"),
+    (b"\xff\xff\xff\xff", "arrow_stream"),
+)
+
+
+def columnar_format(uploaded_file):
+    """
+    Detects, from its first bytes, if the uploaded file is a Parquet or an Arrow IPC file
+
+    :param uploaded_file: python file pointer of the uploaded file
+    :return: name of the format or None if the file is not in a columnar format
+    """
+    uploaded_file.seek(0)
+    magic = uploaded_file.read(6)
+    uploaded_file.seek(0)
+
+    if isinstance(magic, bytes):
+        for magic_bytes, file_format in _COLUMNAR_FORMATS:
+            if magic.startswith(magic_bytes):
+                return file_format
+
+    return None
+
+
+def columnar_schema(uploaded_file, file_format):
+    """
+    :param uploaded_file: python file pointer of the uploaded file
+    :param file_format: format returned by the columnar_format function
+    :return: arrow schema of a Parquet or Arrow IPC file
+    """
+    uploaded_file.seek(0)
+
+    if file_format == "parquet":
+        return pyarrow.parquet.ParquetFile(uploaded_file).schema_arrow
+    if file_format == "arrow":
+        return pyarrow.ipc.open_file(uploaded_file).schema
+    return pyarrow.ipc.open_stream(uploaded_file).schema
+
+
+def read_columnar_file(uploaded_file, file_format):
+    """
+    Reads a Parquet or Arrow IPC file one row group (or record batch) at a time,
+     so the whole file is never loaded into memory
+
+    :param uploaded_file: python file pointer of the uploaded file
+    :param file_format: format returned by the columnar_format function
+    :return: generator of arrow tables
+    """
+    uploaded_file.seek(0)
+
+    if file_format == "parquet":
+        parquet_file = pyarrow.parquet.ParquetFile(uploaded_file)
+        for i in range(parquet_file.num_row_groups):
+            # the columns of the row group are decoded in parallel
+            yield parquet_file.read_row_group(i, use_threads=True)
+    elif file_format == "arrow":
+        reader = pyarrow.ipc.open_file(uploaded_file)
+        for i in range(reader.num_record_batches):
+            yield pyarrow.Table.from_batches([reader.get_batch(i)])
+    else:
+        for batch in pyarrow.ipc.open_stream(uploaded_file):
+            yield pyarrow.Table.from_batches([batch])
+
+
+def cast_columnar_table(table, columns):
+    """
+    As on the CSV files, the columns of Parquet and Arrow IPC files are identified by
+     their position and not by their name. Each one is converted to the type it will
+     have on the database.
+
+    :param table: arrow table returned by the read_columnar_file function
+    :param columns: columns present in the file
+    """
+    return table.rename_columns(columns).cast(results_schema(columns))
+
+
+def _read_spill_file(path, chunksize):
+    with pyarrow.memory_map(path) as source:
+        table = pyarrow.ipc.open_file(source).read_all()
+
+        for offset in range(0, table.num_rows, chunksize):
+            yield table.slice(offset, chunksize).to_pandas()
+
+
+def _read_columnar_chunks(uploaded_file, file_metadata, chunksize):
+    for table in read_columnar_file(uploaded_file, file_metadata["format"]):
+        table = cast_columnar_table(table, file_metadata["columns"])
+
+        for offset in range(0, table.num_rows, chunksize):
+            yield table.slice(offset, chunksize).to_pandas()
+
+
+def read_results_file(uploaded_file, file_metadata, chunksize=10000):
+    """
+    Creates a reader over an uploaded file that was already validated by
+     the extract_data_from_uploaded_file function. If the validation stage
+     created a spill file, the chunks are read from it instead of parsing the CSV file.
+     Parquet and Arrow IPC files are read one row group at a time.
+
+    :param uploaded_file: python file pointer of the uploaded file. Can be compressed with
+     gzip or zstd
+    :param file_metadata: first element returned by the extract_data_from_uploaded_file function
+    :param chunksize: number of rows of each chunk
+    """
+    if file_metadata.get("spill_path"):
+        return _read_spill_file(file_metadata["spill_path"], chunksize)
+
+    if file_metadata.get("format"):
+        return _read_columnar_chunks(uploaded_file, file_metadata, chunksize)
+
+    return pandas.read_csv(
+        open_results_file(uploaded_file),
+        header=0,
+        dtype=file_metadata["types"],
+        skip_blank_lines=False,
+        index_col=False,
+        names=file_metadata["columns"],
+        chunksize=chunksize,
+    )
+
+
+def copy_results_chunks(
+    cursor, table, chunks, columns, data_source_id, upload_info_id=None
+):
+    """
+    Inserts the rows of several chunks of results data into the provided table using
+     a single COPY FROM STDIN statement. Rows with the value "0" on the stratum_1 column
+     are discarded and the data_source_id column is added while the rows are streamed.
+     The CSV format is used since pandas serializes each chunk into it at once, while the
+     text format would require escaping each value and the binary format packing each one.
+
+    :param cursor: psycopg2 cursor. Can either be a raw cursor of a SQLAlchemy connection or
+     a django cursor
+    :param table: name of the table to insert the records into
+    :param chunks: iterable of pandas DataFrames with the results data
+    :param columns: names of the columns present on each chunk
+    :param data_source_id: id of the data source to associate the records with
+    :param upload_info_id: id of the UploadHistory record to associate the records with.
+     Only used if the table has an upload_info_id column
+    """
+    columns = [*columns, "data_source_id"]
+    if upload_info_id is not None:
+        columns.append("upload_info_id")
+
+    cursor.copy_expert(
+        f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+        _CSVChunksStream(
+            _prepare_chunk(chunk, data_source_id, upload_info_id) for chunk in chunks
+        ),
+    )
+
+
+@contextlib.contextmanager
+def raw_cursor(pandas_connection):
+    """
+    Provides a psycopg2 cursor of the DBAPI connection underlying a SQLAlchemy connection.
+     Since the cursor uses the same connection, what is executed is part of any
+     transaction started on it. If there is none, a transaction is started and
+     committed once the context exits.
+
+    :param pandas_connection: SQLAlchemy connection
+    """
+    with contextlib.ExitStack() as stack:
+        if not pandas_connection.in_transaction():
+            stack.enter_context(pandas_connection.begin())
+
+        yield stack.enter_context(
+            contextlib.closing(pandas_connection.connection.cursor())
+        )
+
+
+def copy_results_file(
+    pandas_connection, table, uploaded_file, file_metadata, data_source_id
+):
+    """
+    Loads the records of an uploaded file into the provided table through the DBAPI connection
+     underlying a SQLAlchemy connection. Since the COPY is performed over the same connection,
+     it is part of any transaction started on it. If there is none, the rows are committed
+     once the COPY finishes, as pandas' to_sql would do.
+
+    :param pandas_connection: SQLAlchemy connection
+    :param table: name of the table to insert the records into
+    :param uploaded_file: python file pointer of the uploaded file
+    :param file_metadata: first element returned by the extract_data_from_uploaded_file function
+    :param data_source_id: id of the data source to associate the records with
+    """
+    with raw_cursor(pandas_connection) as cursor:
+        copy_results_chunks(
+            cursor,
+            table,
+            read_results_file(uploaded_file, file_metadata),
+            file_metadata["columns"],
+            data_source_id,
+        )
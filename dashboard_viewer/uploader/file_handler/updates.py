@@ -1,6 +1,7 @@
-import pandas
-from django.db import connections
+from django.conf import settings
+from django.db import connections, transaction
 
+from uploader import partitions, versions
 from uploader.models import (
     AchillesResults,
     AchillesResultsArchive,
@@ -8,6 +9,43 @@ from uploader.models import (
     PendingUpload,
     UploadHistory,
 )
+from .loaders import (
+    copy_results_chunks,
+    copy_results_file,
+    raw_cursor,
+    read_results_file,
+)
+
+
+def current_upload_id(db_id, exclude_id=None):
+    """
+    Finds the upload the current results data of a data source came from. That is its active
+     upload or, for records loaded before the active upload was tracked, its latest upload.
+
+    :param db_id: id of the data source
+    :param exclude_id: id of an UploadHistory record to ignore, e.g. of an upload whose records
+     are not loaded yet
+    :return: id of the UploadHistory record or None if the data source has no uploads
+    """
+    try:
+        active_upload_id = DataSource.objects.values_list(
+            "active_upload", flat=True
+        ).get(id=db_id)
+    except DataSource.DoesNotExist:
+        raise ValueError("No datasource with the provided id")
+
+    if active_upload_id is not None:
+        return active_upload_id
+
+    try:
+        return (
+            UploadHistory.objects.filter(data_source_id=db_id)
+            .exclude(id=exclude_id)
+            .latest()
+            .id
+        )
+    except UploadHistory.DoesNotExist:
+        return None
 
 
 def update_achilles_results_data(
@@ -15,6 +53,57 @@ def update_achilles_results_data(
     pending_upload: PendingUpload,
     file_metadata,
     pandas_connection,
+    upload_history: UploadHistory = None,
+    previous_upload_id=None,
+):
+    """
+    Replaces the results data of a data source by the records of an uploaded file,
+     archiving the previous ones. If the UPLOADER_DELTA_INGESTION setting is enabled and the
+     achilles_results table is not versioned, only the records that changed are replaced.
+
+    :param upload_history: UploadHistory record of the upload, which becomes the active upload
+     of the data source. Required if the achilles_results table is versioned
+    :param previous_upload_id: id of the UploadHistory record the current records came from,
+     which they are associated with once archived. Found with current_upload_id if not provided
+    """
+    data_source = pending_upload.data_source
+
+    if previous_upload_id is None:
+        previous_upload_id = current_upload_id(
+            data_source.id, upload_history.id if upload_history is not None else None
+        )
+
+    with connections["achilles"].cursor() as cursor:
+        partitioned = partitions.is_partitioned(cursor)
+        versioned = versions.is_versioned(cursor)
+
+    analyses = None
+    if versioned:
+        _add_upload_version(logger, pending_upload, file_metadata, upload_history)
+    elif settings.UPLOADER_DELTA_INGESTION:
+        analyses = _apply_data_source_delta(
+            logger, pending_upload, file_metadata, pandas_connection, previous_upload_id
+        )
+    elif partitioned:
+        _replace_data_source_partition(
+            logger, pending_upload, file_metadata, pandas_connection, previous_upload_id
+        )
+    else:
+        _replace_data_source_records(
+            logger, pending_upload, file_metadata, pandas_connection, previous_upload_id
+        )
+
+    if upload_history is not None:
+        data_source.active_upload = upload_history
+        data_source.save(update_fields=("active_upload",))
+
+        if analyses is not None:
+            upload_history.changed_analyses = sorted(analyses)
+            upload_history.save(update_fields=("changed_analyses",))
+
+
+def _replace_data_source_records(
+    logger, pending_upload, file_metadata, pandas_connection, previous_upload_id
 ):
     data_source_id = pending_upload.data_source.id
 
@@ -29,38 +118,279 @@ def update_achilles_results_data(
             AchillesResults,
             AchillesResultsArchive,
             data_source_id,
+            previous_upload_id,
         )
 
-    reader = pandas.read_csv(
+    logger.info(
+        "Inserting new results records [datasource %d, pending upload %d]",
+        data_source_id,
+        pending_upload.id,
+    )
+
+    copy_results_file(
+        pandas_connection,
+        AchillesResults._meta.db_table,
         pending_upload.uploaded_file,
-        header=0,
-        dtype=file_metadata["types"],
-        skip_blank_lines=False,
-        index_col=False,
-        names=file_metadata["columns"],
-        chunksize=500,
+        file_metadata,
+        data_source_id,
     )
 
+
+# columns identifying a record of the results data
+_KEY_COLUMNS = (
+    "analysis_id",
+    "stratum_1",
+    "stratum_2",
+    "stratum_3",
+    "stratum_4",
+    "stratum_5",
+)
+
+
+def _apply_data_source_delta(
+    logger, pending_upload, file_metadata, pandas_connection, previous_upload_id
+):
+    """
+    Used when the UPLOADER_DELTA_INGESTION setting is enabled. The uploaded records are
+     loaded into a temporary table and each record, on it and on the current records of the
+     data source, is hashed on its key (analysis_id and strata) and on its values. Only the
+     records whose hashes don't match are deleted or inserted, so the records of the data
+     source that didn't change are not rewritten. All previous records are still archived,
+     copied on the server, so the archived records of an upload are its whole results data.
+
+    :return: ids of the analyses whose records changed
+    """
+    data_source_id = pending_upload.data_source.id
+
+    table = AchillesResults._meta.db_table
+    columns = [
+        field.column
+        for field in AchillesResults._meta.concrete_fields
+        if field.column not in ("id", "data_source_id")
+    ]
+    key = ", ".join(_KEY_COLUMNS)
+    values = ", ".join(column for column in columns if column not in _KEY_COLUMNS)
+
+    def hashed(relation):
+        # identical records are numbered so each one is matched at most once
+        return f"""
+            SELECT *, row_number() OVER (PARTITION BY key_hash, value_hash) AS copy
+            FROM (
+                SELECT
+                    *,
+                    md5(ROW({key})::text) AS key_hash,
+                    md5(ROW({values})::text) AS value_hash
+                FROM {relation}
+            ) AS hashed
+        """
+
+    with raw_cursor(pandas_connection) as cursor:
+        logger.info(
+            "Loading records into a temporary table [datasource %d, pending upload %d]",
+            data_source_id,
+            pending_upload.id,
+        )
+        cursor.execute(
+            "CREATE TEMPORARY TABLE delta_uploaded ON COMMIT DROP AS "
+            f"SELECT {', '.join(columns)}, data_source_id FROM {table} WITH NO DATA"
+        )
+        copy_results_chunks(
+            cursor,
+            "delta_uploaded",
+            read_results_file(pending_upload.uploaded_file, file_metadata),
+            file_metadata["columns"],
+            data_source_id,
+        )
+
+        logger.info(
+            "Comparing records with the current ones [datasource %d, pending upload %d]",
+            data_source_id,
+            pending_upload.id,
+        )
+        cursor.execute(
+            "CREATE TEMPORARY TABLE delta_new ON COMMIT DROP AS "
+            + hashed("delta_uploaded")
+        )
+        cursor.execute(
+            "CREATE TEMPORARY TABLE delta_current ON COMMIT DROP AS "
+            + hashed(
+                f"(SELECT * FROM {table} WHERE data_source_id = %s) AS current_records"
+            ),
+            (data_source_id,),
+        )
+        cursor.execute(
+            """
+            CREATE TEMPORARY TABLE delta_removed ON COMMIT DROP AS
+            SELECT delta_current.id, delta_current.analysis_id, delta_current.key_hash
+            FROM delta_current
+            LEFT JOIN delta_new USING (key_hash, value_hash, copy)
+            WHERE delta_new.key_hash IS NULL
+            """
+        )
+        cursor.execute(
+            """
+            CREATE TEMPORARY TABLE delta_added ON COMMIT DROP AS
+            SELECT delta_new.*
+            FROM delta_new
+            LEFT JOIN delta_current USING (key_hash, value_hash, copy)
+            WHERE delta_current.key_hash IS NULL
+            """
+        )
+
+        cursor.execute(
+            """
+            SELECT
+                count(*) FILTER (WHERE removed AND NOT added),
+                count(*) FILTER (WHERE removed AND added),
+                count(*) FILTER (WHERE added AND NOT removed)
+            FROM (
+                SELECT key_hash, bool_or(removed) AS removed, bool_or(NOT removed) AS added
+                FROM (
+                    SELECT key_hash, true AS removed FROM delta_removed
+                    UNION ALL
+                    SELECT key_hash, false FROM delta_added
+                ) AS changes
+                GROUP BY key_hash
+            ) AS changed_keys
+            """
+        )
+        deleted, updated, inserted = cursor.fetchone()
+        logger.info(
+            "%d records to delete, %d to update and %d to insert [datasource %d, pending upload %d]",
+            deleted,
+            updated,
+            inserted,
+            data_source_id,
+            pending_upload.id,
+        )
+
+        logger.info(
+            "Moving old records to the AchillesResultsArchive table [datasource %d, pending upload %d]",
+            data_source_id,
+            pending_upload.id,
+        )
+        move_achilles_results_records(
+            cursor,
+            AchillesResults,
+            AchillesResultsArchive,
+            data_source_id,
+            previous_upload_id,
+            delete_origin=False,
+        )
+        cursor.execute(
+            f"DELETE FROM {table} "
+            "WHERE data_source_id = %s AND id IN (SELECT id FROM delta_removed)",
+            (data_source_id,),
+        )
+        cursor.execute(
+            f"INSERT INTO {table} ({', '.join(columns)}, data_source_id) "
+            f"SELECT {', '.join(columns)}, data_source_id FROM delta_added"
+        )
+
+        cursor.execute(
+            "SELECT analysis_id FROM delta_removed "
+            "UNION SELECT analysis_id FROM delta_added"
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+
+def _add_upload_version(logger, pending_upload, file_metadata, upload_history):
+    """
+    Used when the achilles_results table is versioned. The new records are stored next to the
+     ones of the previous uploads, associated with the new upload, so the previous records
+     are archived once the new upload becomes the active one of the data source.
+     The records are loaded through the django connection, since they reference
+     the UploadHistory record, which was created on its transaction.
+    """
+    if upload_history is None:
+        raise ValueError(
+            "An UploadHistory record is required to store the records of a new upload"
+        )
+
+    data_source_id = pending_upload.data_source.id
+
     logger.info(
         "Inserting new results records [datasource %d, pending upload %d]",
         data_source_id,
         pending_upload.id,
     )
+    with connections["achilles"].cursor() as cursor:
+        copy_results_chunks(
+            cursor,
+            versions.VERSIONS_TABLE,
+            read_results_file(pending_upload.uploaded_file, file_metadata),
+            file_metadata["columns"],
+            data_source_id,
+            upload_history.id,
+        )
+
 
-    for chunk in reader:
-        chunk = chunk[chunk["stratum_1"].isin(["0"]) == False]  # noqa
-        chunk = chunk.assign(data_source_id=data_source_id)
-        chunk.to_sql(
-            AchillesResults._meta.db_table,
+def _replace_data_source_partition(
+    logger, pending_upload, file_metadata, pandas_connection, previous_upload_id
+):
+    """
+    Used when the achilles_results table is partitioned by data source. The new records
+     are loaded into a new table, which then replaces the partition of the data source,
+     instead of deleting the old records. The records are archived and loaded over the same
+     connection, since the new table is only visible inside its transaction until it is
+     committed. The partitions are swapped once the transaction of the achilles database
+     commits, so the achilles_results table is not locked while it is open. As on the upload
+     task, a transaction of the pandas connection must commit before that one.
+    """
+    data_source_id = pending_upload.data_source.id
+
+    with raw_cursor(pandas_connection) as cursor:
+        logger.info(
+            "Moving old records to the AchillesResultsArchive table [datasource %d, pending upload %d]",
+            data_source_id,
+            pending_upload.id,
+        )
+        move_achilles_results_records(
+            cursor,
+            AchillesResults,
+            AchillesResultsArchive,
+            data_source_id,
+            previous_upload_id,
+            delete_origin=False,
+        )
+
+        logger.info(
+            "Inserting new results records [datasource %d, pending upload %d]",
+            data_source_id,
+            pending_upload.id,
+        )
+        replacement = partitions.create_partition_replacement(cursor, data_source_id)
+
+        copy_results_file(
             pandas_connection,
-            if_exists="append",
-            index=False,
+            replacement,
+            pending_upload.uploaded_file,
+            file_metadata,
+            data_source_id,
         )
 
+    def swap():
+        with connections["achilles"].cursor() as cursor:
+            partitions.swap_partition(cursor, data_source_id, replacement)
+
+    transaction.on_commit(swap, using="achilles")
+
 
 def move_achilles_results_records(
-    cursor, origin_model, destination_model, db_id, last_upload_id=None
+    cursor,
+    origin_model,
+    destination_model,
+    db_id,
+    last_upload_id=None,
+    delete_origin=True,
 ):
+    """
+    Copies the records of a data source from achilles_results to achilles_results_archive,
+     associating them with the upload they came from
+
+    :param last_upload_id: id of the UploadHistory record the records came from. If not
+     provided, the active upload of the data source is used
+    """
     allowed_models = (AchillesResults, AchillesResultsArchive)
 
     if origin_model not in allowed_models or destination_model not in allowed_models:
@@ -73,21 +403,28 @@ def move_achilles_results_records(
         )
     if origin_model == destination_model:
         raise ValueError("Origin and destination models can't be the same")
-    if not DataSource.objects.filter(id=db_id).exists():
+    try:
+        active_upload_id = DataSource.objects.values_list(
+            "active_upload", flat=True
+        ).get(id=db_id)
+    except DataSource.DoesNotExist:
         raise ValueError("No datasource with the provided id")
 
     if last_upload_id is None:
-        try:
-            last_upload_id = (
-                UploadHistory.objects.filter(data_source_id=db_id).latest().id
-            )
-        except UploadHistory.DoesNotExist:
-            return  # nothing to move
+        last_upload_id = active_upload_id
+
+    if last_upload_id is None:
+        return  # nothing to move
     elif not UploadHistory.objects.filter(
         id=last_upload_id, data_source_id=db_id
     ).exists():
         raise ValueError("There is no UploadHistory with the provided id")
 
+    # created by the connection that archives the records, since creating a partition
+    #  locks the whole archive table until the end of the transaction
+    if partitions.is_archive_partitioned(cursor):
+        partitions.create_archive_partition(cursor, last_upload_id)
+
     cursor.execute(
         f"""
         INSERT INTO {destination_model._meta.db_table} (
@@ -135,4 +472,43 @@ def move_achilles_results_records(
         (last_upload_id, db_id),
     )
 
-    origin_model.objects.filter(data_source_id=db_id).delete()
+    if delete_origin:
+        origin_model.objects.filter(data_source_id=db_id).delete()
+
+
+def changed_analyses(cursor, db_id, previous_upload_id):
+    """
+    Compares the current results data of a data source with the records of a previous
+     upload, which were archived, to find which analyses have different records
+
+    :param cursor: cursor of a connection to the achilles database
+    :param db_id: id of the data source
+    :param previous_upload_id: id of the UploadHistory record of the previous upload.
+     If None, all analyses of the current records are considered changed
+    :return: set of analysis ids
+    """
+    columns = ", ".join(
+        field.column
+        for field in AchillesResults._meta.concrete_fields
+        if field.column not in ("id", "data_source_id", "upload_info_id")
+    )
+    current = (
+        f"SELECT {columns} FROM {AchillesResults._meta.db_table} "
+        "WHERE data_source_id = %(db_id)s"
+    )
+    previous = (
+        f"SELECT {columns} FROM {AchillesResultsArchive._meta.db_table} "
+        "WHERE data_source_id = %(db_id)s AND upload_info_id = %(upload_id)s"
+    )
+
+    cursor.execute(
+        f"""
+        SELECT DISTINCT analysis_id FROM (
+            ({current} EXCEPT ALL {previous})
+            UNION ALL
+            ({previous} EXCEPT ALL {current})
+        ) AS changed
+        """,
+        {"db_id": db_id, "upload_id": previous_upload_id},
+    )
+    return {row[0] for row in cursor.fetchall()}
@@ -1,8 +1,11 @@
+import pathlib
+
 import constance
 from bootstrap_datepicker_plus import DatePickerInput
 from django import forms
 
 from .fields import CoordinatesField
+from .file_handler.compression import UNSUPPORTED_EXTENSIONS
 from .models import DatabaseType, DataSource
 from .widgets import ListTextWidget
 
@@ -33,4 +36,17 @@ class EditSourceForm(SourceForm):
 
 
 class AchillesResultsForm(forms.Form):
-    results_file = forms.FileField()
+    results_file = forms.FileField(
+        help_text="CSV file, which can be compressed with gzip (.csv.gz) or zstd (.csv.zst), "
+        "or Parquet/Arrow IPC file"
+    )
+
+    def clean_results_file(self):
+        results_file = self.cleaned_data["results_file"]
+
+        if pathlib.Path(results_file.name).suffix.lower() in UNSUPPORTED_EXTENSIONS:
+            raise forms.ValidationError(
+                "Compressed results files are only supported with gzip (.csv.gz) or zstd (.csv.zst)."
+            )
+
+        return results_file
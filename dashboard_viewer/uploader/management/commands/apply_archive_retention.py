@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from uploader.models import DataSource
+from uploader.retention import apply_retention
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves the archived records of the uploads that exceed the retention policy of "
+        "each data source from the database to Parquet files"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "acronyms",
+            nargs="*",
+            help="Acronyms of the data sources. If none is provided, all data sources are processed",
+        )
+
+    def handle(self, *args, **options):
+        data_sources = DataSource.objects.all()
+        if options["acronyms"]:
+            data_sources = data_sources.filter(acronym__in=options["acronyms"])
+
+            missing = set(options["acronyms"]) - {
+                data_source.acronym for data_source in data_sources
+            }
+            if missing:
+                raise CommandError(
+                    f"No data sources with the acronyms {', '.join(sorted(missing))}"
+                )
+
+        for data_source in data_sources:
+            for upload_history in apply_retention(data_source):
+                self.stdout.write(
+                    f"{data_source.acronym}: records of the upload of "
+                    f"{upload_history.upload_date} moved to {upload_history.archive_file.name}"
+                )
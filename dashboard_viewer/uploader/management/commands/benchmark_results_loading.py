@@ -0,0 +1,151 @@
+import os
+import tempfile
+import time
+
+import numpy
+import pandas
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from uploader.file_handler.checks import extract_data_from_uploaded_file
+from uploader.file_handler.loaders import copy_results_file, read_results_file
+from uploader.models import AchillesResults
+
+BENCHMARK_TABLE = "achilles_results_benchmark"
+
+
+def _generate_file(destination, rows, dist_columns):
+    random = numpy.random.default_rng(0)
+
+    data = {
+        "analysis_id": random.integers(1, 2000, rows),
+        "stratum_1": random.integers(0, 50000, rows).astype(str),
+        "stratum_2": random.integers(0, 100, rows).astype(str),
+        "stratum_3": numpy.where(random.random(rows) < 0.5, "", "F"),
+        "stratum_4": "",
+        "stratum_5": "",
+        "count_value": random.integers(0, 1000000, rows),
+    }
+    if dist_columns:
+        for column in (
+            "min_value",
+            "max_value",
+            "avg_value",
+            "stdev_value",
+            "median_value",
+            "p10_value",
+            "p25_value",
+            "p75_value",
+            "p90_value",
+        ):
+            data[column] = random.random(rows) * 100
+
+    data["analysis_id"][0] = 0  # required metadata row
+
+    pandas.DataFrame(data).to_csv(destination, index=False)
+
+
+def _load_to_sql(pandas_connection, uploaded_file, file_metadata):
+    # loading process used before the COPY based loader
+    for chunk in read_results_file(uploaded_file, file_metadata, chunksize=500):
+        chunk = chunk[chunk["stratum_1"].isin(["0"]) == False]  # noqa
+        chunk = chunk.assign(data_source_id=0)
+        chunk.to_sql(
+            BENCHMARK_TABLE, pandas_connection, if_exists="append", index=False
+        )
+
+
+def _load_copy(pandas_connection, uploaded_file, file_metadata):
+    # as on the upload task, the records are read from the spill file of the validation stage
+    copy_results_file(
+        pandas_connection, BENCHMARK_TABLE, uploaded_file, file_metadata, 0
+    )
+
+
+def _serialization_time(uploaded_file, file_metadata):
+    # part of the COPY based loader spent converting the chunks into CSV text
+    elapsed = 0
+    chunks = 0
+    for chunk in read_results_file(uploaded_file, file_metadata):
+        start = time.perf_counter()
+        chunk.to_csv(header=False, index=False)
+        elapsed += time.perf_counter() - start
+        chunks += 1
+
+    return elapsed, chunks
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the time it takes to load a results file into the database using "
+        "pandas' to_sql and the COPY based loader used by the upload task, and how much of "
+        "the latter is spent converting the records into CSV text"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rows",
+            type=int,
+            default=1000000,
+            help="Number of rows of the generated results file",
+        )
+        parser.add_argument(
+            "--dist-columns",
+            action="store_true",
+            help="Generate a results file with 16 columns instead of 7",
+        )
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryFile() as uploaded_file, tempfile.TemporaryDirectory() as spill_dir:
+            self.stdout.write(f"Generating a results file with {options['rows']} rows")
+            _generate_file(uploaded_file, options["rows"], options["dist_columns"])
+
+            uploaded_file.seek(0)
+            file_metadata, _ = extract_data_from_uploaded_file(
+                uploaded_file, os.path.join(spill_dir, "results.arrow")
+            )
+            csv_metadata = {
+                key: value
+                for key, value in file_metadata.items()
+                if key != "spill_path"
+            }
+
+            for name, loader, metadata in (
+                ("to_sql", _load_to_sql, csv_metadata),
+                ("COPY", _load_copy, file_metadata),
+            ):
+                uploaded_file.seek(0)
+
+                with settings.ACHILLES_DB_SQLALCHEMY_ENGINE.connect() as pandas_connection:
+                    try:
+                        pandas_connection.execute(
+                            f"CREATE TABLE {BENCHMARK_TABLE} "
+                            f"(LIKE {AchillesResults._meta.db_table} INCLUDING INDEXES)"
+                        )
+                        pandas_connection.execute(
+                            f"ALTER TABLE {BENCHMARK_TABLE} ALTER COLUMN id SET NOT NULL"
+                        )
+                        pandas_connection.execute(
+                            f"ALTER TABLE {BENCHMARK_TABLE} "
+                            "ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY"
+                        )
+
+                        with pandas_connection.begin():
+                            start = time.perf_counter()
+                            loader(pandas_connection, uploaded_file, metadata)
+                        elapsed = time.perf_counter() - start
+                    finally:
+                        pandas_connection.execute(
+                            f"DROP TABLE IF EXISTS {BENCHMARK_TABLE}"
+                        )
+
+                self.stdout.write(
+                    f"{name}: {elapsed:.2f}s ({options['rows'] / elapsed:.0f} rows/s)"
+                )
+
+            serialization, chunks = _serialization_time(uploaded_file, file_metadata)
+            self.stdout.write(
+                f"COPY CSV serialization: {serialization:.2f}s "
+                f"({serialization / elapsed:.0%} of COPY, "
+                f"{serialization / chunks * 1000:.1f}ms per chunk)"
+            )
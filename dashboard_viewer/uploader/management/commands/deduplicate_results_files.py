@@ -0,0 +1,53 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from uploader.models import PendingUpload, UploadHistory
+from uploader.storage import FILES_DIRECTORY, results_files_storage
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves the results files stored before the content-addressed storage into it, "
+        "so identical files are stored only once"
+    )
+
+    def handle(self, *args, **options):
+        files_directory = os.path.join(
+            settings.ACHILLES_RESULTS_STORAGE_PATH, FILES_DIRECTORY, ""
+        )
+
+        old_names = set()
+        for model in (PendingUpload, UploadHistory):
+            old_names.update(
+                model.objects.exclude(
+                    Q(uploaded_file="")
+                    | Q(uploaded_file__isnull=True)
+                    | Q(uploaded_file__startswith=files_directory)
+                ).values_list("uploaded_file", flat=True)
+            )
+
+        moved = 0
+        new_names = set()
+        for old_name in sorted(old_names):
+            if not results_files_storage.exists(old_name):
+                self.stderr.write(f"Stored file {old_name} is missing")
+                continue
+
+            with results_files_storage.open(old_name) as file:
+                new_name = results_files_storage.save(old_name, file)
+
+            for model in (PendingUpload, UploadHistory):
+                model.objects.filter(uploaded_file=old_name).update(
+                    uploaded_file=new_name
+                )
+            results_files_storage.delete(old_name)
+
+            moved += 1
+            new_names.add(new_name)
+
+        self.stdout.write(
+            f"Moved {moved} files " f"into {len(new_names)} content-addressed files"
+        )
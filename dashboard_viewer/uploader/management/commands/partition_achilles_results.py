@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router, transaction
+
+from uploader import partitions, versions
+from uploader.models import AchillesResults
+
+
+class Command(BaseCommand):
+    help = (
+        "Converts the achilles_results table into a table partitioned by data source, "
+        "with one partition per data source. Materialized views are recreated."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--undo",
+            action="store_true",
+            help="Convert a partitioned achilles_results table back into a regular table",
+        )
+        parser.add_argument(
+            "--archive",
+            action="store_true",
+            help="Partition the achilles_results_archive table by upload instead, "
+            "with one partition per upload",
+        )
+
+    def handle(self, *args, **options):
+        db = router.db_for_write(AchillesResults)
+        connection = connections[db]
+
+        if options["archive"]:
+            table = "achilles_results_archive"
+            key = "upload"
+            is_partitioned = partitions.is_archive_partitioned
+            partition_table = partitions.partition_archive_table
+            unpartition_table = partitions.unpartition_archive_table
+        else:
+            table = "achilles_results"
+            key = "data source"
+            is_partitioned = partitions.is_partitioned
+            partition_table = partitions.partition_table
+            unpartition_table = partitions.unpartition_table
+
+        with transaction.atomic(using=db), connection.cursor() as cursor:
+            partitioned = is_partitioned(cursor)
+
+            if options["undo"]:
+                if not partitioned:
+                    raise CommandError(f"The {table} table is not partitioned")
+
+                unpartition_table(cursor)
+                self.stdout.write(f"{table} is no longer partitioned")
+            else:
+                if partitioned:
+                    raise CommandError(f"The {table} table is already partitioned")
+                if versions.is_versioned(cursor):
+                    raise CommandError(
+                        "The achilles_results table is versioned. "
+                        "Run version_achilles_results --undo first"
+                    )
+                if connection.pg_version < 110000:
+                    raise CommandError("Partitioning requires postgres 11 or later")
+
+                partition_table(cursor)
+                self.stdout.write(f"{table} partitioned by {key}")
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from uploader.models import UploadHistory
+from uploader.retention import rehydrate_upload
+
+
+class Command(BaseCommand):
+    help = (
+        "Inserts the archived records of an upload, moved to a Parquet file by the "
+        "retention policy, back into the database. They are removed again the next "
+        "time the retention policy is applied"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("upload_history_id", type=int)
+
+    def handle(self, *args, **options):
+        try:
+            upload_history = UploadHistory.objects.get(id=options["upload_history_id"])
+        except UploadHistory.DoesNotExist:
+            raise CommandError("No upload with the provided id")
+
+        try:
+            count = rehydrate_upload(upload_history)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(f"{count} archived records restored")
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from uploader.resumable import expire_sessions
+from uploader.storage import sweep
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes the stored results files, archive files and upload session files "
+        "that are no longer referenced by any record, after deleting the expired "
+        "upload sessions"
+    )
+
+    def handle(self, *args, **options):
+        expired = expire_sessions()
+        self.stdout.write(f"Deleted {expired} expired upload sessions")
+
+        deleted = sweep()
+        for name in deleted:
+            self.stdout.write(f"Deleted {name}")
+
+        self.stdout.write(f"Deleted {len(deleted)} files")
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router
+
+from uploader import partitions, versions
+from uploader.models import AchillesResults
+
+
+class Command(BaseCommand):
+    help = (
+        "Stores the records of all uploads on a single table, replacing the achilles_results "
+        "and achilles_results_archive tables by views over it. Materialized views are recreated. "
+        "Migrations of the uploader app are refused until this is undone."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--undo",
+            action="store_true",
+            help="Move the records of the active uploads back to a regular achilles_results table",
+        )
+
+    def handle(self, *args, **options):
+        connection = connections[router.db_for_write(AchillesResults)]
+
+        with connection.schema_editor() as schema_editor:
+            with connection.cursor() as cursor:
+                versioned = versions.is_versioned(cursor)
+                partitioned = partitions.is_partitioned(cursor)
+                archive_partitioned = partitions.is_archive_partitioned(cursor)
+
+            if options["undo"]:
+                if not versioned:
+                    raise CommandError("The achilles_results table is not versioned")
+
+                versions.unversion_table(schema_editor)
+                self.stdout.write("achilles_results is no longer versioned")
+            else:
+                if versioned:
+                    raise CommandError(
+                        "The achilles_results table is already versioned"
+                    )
+                if partitioned:
+                    raise CommandError(
+                        "The achilles_results table is partitioned. "
+                        "Run partition_achilles_results --undo first"
+                    )
+
+                if archive_partitioned:
+                    raise CommandError(
+                        "The achilles_results_archive table is partitioned. "
+                        "Run partition_achilles_results --archive --undo first"
+                    )
+
+                versions.version_table(schema_editor)
+                self.stdout.write("achilles_results versioned by upload")
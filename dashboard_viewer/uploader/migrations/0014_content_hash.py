@@ -0,0 +1,71 @@
+# Generated by Django 3.2.13 on 2026-10-18 16:06
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def compute_content_hashes(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+
+    for model_name in ("PendingUpload", "UploadHistory"):
+        model = apps.get_model("uploader", model_name)
+
+        for record in model.objects.using(db_alias).exclude(uploaded_file=""):
+            if not record.uploaded_file:
+                continue
+
+            digest = hashlib.sha256()
+            try:
+                for chunk in record.uploaded_file.chunks():
+                    digest.update(chunk)
+            except OSError:  # file no longer available
+                continue
+            finally:
+                record.uploaded_file.close()
+
+            record.content_hash = digest.hexdigest()
+            record.save(update_fields=["content_hash"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("uploader", "0013_auto_20210721_1715"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="pendingupload",
+            name="content_hash",
+            field=models.CharField(
+                help_text="SHA-256 digest of the uploaded file.",
+                max_length=64,
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="uploadhistory",
+            name="content_hash",
+            field=models.CharField(
+                help_text="SHA-256 digest of the uploaded file. Used to detect uploads of files already uploaded.",
+                max_length=64,
+                null=True,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="pendingupload",
+            index=models.Index(
+                fields=["data_source", "content_hash"],
+                name="uploader_pe_data_so_03490a_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="uploadhistory",
+            index=models.Index(
+                fields=["data_source", "content_hash"],
+                name="upload_hist_data_so_b1cc0f_idx",
+            ),
+        ),
+        migrations.RunPython(compute_content_hashes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 3.2.13 on 2026-10-18 16:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def set_active_uploads(apps, schema_editor):
+    """
+    Points each data source to its latest upload. A data source that has results data
+     but no uploads gets an empty upload record, so its records can be associated with one.
+    """
+    db_alias = schema_editor.connection.alias
+
+    AchillesResults = apps.get_model("uploader", "AchillesResults")
+    DataSource = apps.get_model("uploader", "DataSource")
+    UploadHistory = apps.get_model("uploader", "UploadHistory")
+
+    for data_source in DataSource.objects.using(db_alias).filter(
+        active_upload__isnull=True
+    ):
+        upload = (
+            UploadHistory.objects.using(db_alias)
+            .filter(data_source=data_source)
+            .order_by("-upload_date")
+            .first()
+        )
+        if upload is None:
+            if (
+                not AchillesResults.objects.using(db_alias)
+                .filter(data_source=data_source)
+                .exists()
+            ):
+                continue
+            upload = UploadHistory.objects.using(db_alias).create(
+                data_source=data_source
+            )
+
+        data_source.active_upload = upload
+        data_source.save(update_fields=["active_upload"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("uploader", "0014_content_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="datasource",
+            name="active_upload",
+            field=models.ForeignKey(
+                editable=False,
+                help_text="Upload whose records are the current results data of this data source.",
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="uploader.uploadhistory",
+            ),
+        ),
+        migrations.RunPython(set_active_uploads, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 3.2.13 on 2026-10-18 16:54
+
+import uuid
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("uploader", "0015_active_upload"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UploadSession",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("file_name", models.CharField(max_length=255)),
+                (
+                    "size",
+                    models.BigIntegerField(
+                        help_text="Total number of bytes of the file."
+                    ),
+                ),
+                (
+                    "offset",
+                    models.BigIntegerField(
+                        default=0,
+                        help_text="Number of bytes of the file received so far.",
+                    ),
+                ),
+                ("created_date", models.DateTimeField(auto_now_add=True)),
+                ("updated_date", models.DateTimeField(auto_now=True)),
+                (
+                    "data_source",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="uploader.datasource",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "upload_session",
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.13 on 2026-10-18 17:04
+
+from django.db import migrations, models
+
+import uploader.models
+import uploader.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("uploader", "0016_upload_session"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="pendingupload",
+            name="uploaded_file",
+            field=models.FileField(
+                storage=uploader.storage.ContentAddressedStorage(),
+                upload_to=uploader.models.failure_data_source_directory,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="uploadhistory",
+            name="uploaded_file",
+            field=models.FileField(
+                null=True,
+                storage=uploader.storage.ContentAddressedStorage(),
+                upload_to=uploader.models.success_data_source_directory,
+            ),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.13 on 2026-10-18 17:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("uploader", "0017_content_addressed_storage"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="uploadhistory",
+            name="changed_analyses",
+            field=models.JSONField(
+                help_text="Ids of the analyses whose records changed with this upload.",
+                null=True,
+            ),
+        ),
+    ]
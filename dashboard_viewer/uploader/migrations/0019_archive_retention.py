@@ -0,0 +1,41 @@
+# Generated by Django 3.2.13 on 2026-10-18 17:14
+
+from django.db import migrations, models
+import uploader.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("uploader", "0018_upload_changed_analyses"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="datasource",
+            name="archive_keep_days",
+            field=models.PositiveIntegerField(
+                blank=True,
+                help_text="Number of days the records of an upload are kept on the database. Records of older uploads are moved to files. If empty, the UPLOADER_ARCHIVE_KEEP_DAYS setting is used.",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="datasource",
+            name="archive_keep_uploads",
+            field=models.PositiveIntegerField(
+                blank=True,
+                help_text="Number of most recent uploads whose records are kept on the database. Records of older uploads are moved to files. If empty, the UPLOADER_ARCHIVE_KEEP_UPLOADS setting is used.",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="uploadhistory",
+            name="archive_file",
+            field=models.FileField(
+                help_text="Parquet file with the archived records of this upload, once they are removed from the database.",
+                null=True,
+                upload_to=uploader.models.archive_data_source_directory,
+            ),
+        ),
+    ]
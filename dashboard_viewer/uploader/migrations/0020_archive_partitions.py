@@ -0,0 +1,24 @@
+# Generated by Django 3.2.13 on 2026-10-18 17:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("uploader", "0019_archive_retention"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="achillesresultsarchive",
+            name="achilles_re_data_so_4baf12_idx",
+        ),
+        migrations.AddIndex(
+            model_name="achillesresultsarchive",
+            index=models.Index(
+                fields=["data_source", "upload_info", "analysis_id"],
+                name="achilles_re_data_so_a2fbb2_idx",
+            ),
+        ),
+    ]
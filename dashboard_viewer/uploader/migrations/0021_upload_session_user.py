@@ -0,0 +1,22 @@
+# Generated by Django 3.2.13 on 2026-10-18 17:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("uploader", "0020_archive_partitions"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="uploadsession",
+            name="user_id",
+            field=models.IntegerField(
+                editable=False,
+                help_text="Id of the user that started the upload through the API.",
+                null=True,
+            ),
+        ),
+    ]
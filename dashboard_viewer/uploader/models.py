@@ -1,13 +1,17 @@
 import datetime
+import hashlib
 import json
 import os
 import pathlib
 import uuid
 
 from django.conf import settings
-from django.db import models
+from django.db import connections, models, router, transaction
+from django.db.models.signals import post_delete, pre_delete
 from django_celery_results.models import TaskResult
 
+from .storage import release_file, results_files_storage, stored_digest
+
 
 class Country(models.Model):
     class Meta:
@@ -85,6 +89,28 @@ class DataSource(models.Model):
     longitude = models.FloatField()
     link = models.URLField(help_text="Link to home page of the data source", blank=True)
     draft = models.BooleanField(default=True)
+    active_upload = models.ForeignKey(
+        "UploadHistory",
+        null=True,
+        editable=False,
+        on_delete=models.SET_NULL,
+        related_name="+",
+        help_text="Upload whose records are the current results data of this data source.",
+    )
+    archive_keep_uploads = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Number of most recent uploads whose records are kept on the database. "
+        "Records of older uploads are moved to files. If empty, the UPLOADER_ARCHIVE_KEEP_UPLOADS "
+        "setting is used.",
+    )
+    archive_keep_days = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Number of days the records of an upload are kept on the database. "
+        "Records of older uploads are moved to files. If empty, the UPLOADER_ARCHIVE_KEEP_DAYS "
+        "setting is used.",
+    )
 
     def save(
         self, force_insert=False, force_update=False, using=None, update_fields=None
@@ -93,8 +119,31 @@ class DataSource(models.Model):
             db_type = DatabaseType(type=self.database_type)
             db_type.save()
 
+        adding = self._state.adding
+
         super().save(force_insert, force_update, using, update_fields)
 
+        if adding:
+            from uploader import partitions  # noqa
+
+            with connections[router.db_for_write(AchillesResults)].cursor() as cursor:
+                if partitions.is_partitioned(cursor):
+                    partitions.create_partition(cursor, self.id)
+
+    def delete(self, using=None, keep_parents=False):
+        from uploader import partitions  # noqa
+
+        using = using or router.db_for_write(self.__class__, instance=self)
+
+        with transaction.atomic(using=using), connections[
+            router.db_for_write(AchillesResults)
+        ].cursor() as cursor:
+            # dropping the partition is faster than deleting its records one by one
+            if partitions.is_partitioned(cursor):
+                partitions.drop_partition(cursor, self.id)
+
+            return super().delete(using, keep_parents)
+
     def __str__(self):
         return self.name
 
@@ -102,6 +151,20 @@ class DataSource(models.Model):
         return self.__str__()
 
 
+def compute_file_hash(file):
+    """
+    Calculates the SHA-256 digest of the bytes of a file, reading it in chunks so the
+     whole file is never loaded into memory
+
+    :param file: django File object
+    """
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+
+    return digest.hexdigest()
+
+
 def failure_data_source_directory(instance, filename):
     file_path = os.path.join(
         settings.ACHILLES_RESULTS_STORAGE_PATH,
@@ -128,12 +191,38 @@ class PendingUpload(models.Model):
 
     class Meta:
         ordering = ("-upload_date",)
+        indexes = [
+            models.Index(fields=("data_source", "content_hash")),
+        ]
 
     data_source = models.ForeignKey(DataSource, on_delete=models.CASCADE)
     upload_date = models.DateTimeField(auto_now_add=True)
     status = models.IntegerField(choices=STATES, default=STATE_PENDING)
-    uploaded_file = models.FileField(upload_to=failure_data_source_directory)
+    uploaded_file = models.FileField(
+        upload_to=failure_data_source_directory, storage=results_files_storage
+    )
     task_id = models.CharField(max_length=255, null=True)
+    content_hash = models.CharField(
+        max_length=64,
+        null=True,
+        help_text="SHA-256 digest of the uploaded file.",
+    )
+
+    def save(
+        self, force_insert=False, force_update=False, using=None, update_fields=None
+    ):
+        if self.content_hash is None and self.uploaded_file:
+            if not self.uploaded_file._committed:
+                # stored first, since the digest of the file is its name on the storage
+                self.uploaded_file.save(
+                    self.uploaded_file.name, self.uploaded_file.file, save=False
+                )
+
+            self.content_hash = stored_digest(
+                self.uploaded_file.name
+            ) or compute_file_hash(self.uploaded_file)
+
+        super().save(force_insert, force_update, using, update_fields)
 
     def get_status(self):
         for status_id, name in self.STATES:
@@ -176,6 +265,15 @@ def success_data_source_directory(instance, filename):
     return datetime.datetime.now().strftime(file_path)
 
 
+def archive_data_source_directory(instance, filename):
+    return os.path.join(
+        settings.ACHILLES_RESULTS_STORAGE_PATH,
+        instance.data_source.hash,
+        "archive",
+        filename,
+    )
+
+
 class UploadHistory(models.Model):
     """
     Successful uploads only
@@ -185,6 +283,9 @@ class UploadHistory(models.Model):
         get_latest_by = "upload_date"
         ordering = ("-upload_date",)
         db_table = "upload_history"
+        indexes = [
+            models.Index(fields=("data_source", "content_hash")),
+        ]
 
     data_source = models.ForeignKey(DataSource, on_delete=models.CASCADE)
     upload_date = models.DateTimeField(auto_now_add=True)
@@ -194,14 +295,31 @@ class UploadHistory(models.Model):
     cdm_version = models.CharField(max_length=50, null=True)
     vocabulary_version = models.CharField(max_length=50, null=True)
     uploaded_file = models.FileField(
-        null=True, upload_to=success_data_source_directory
+        null=True,
+        upload_to=success_data_source_directory,
+        storage=results_files_storage,
     )  # For backwards compatibility its easier to make this null=True
     pending_upload_id = models.IntegerField(
         null=True,
-        help_text="The id of the PendingUpload record that originated this successful upload."
+        help_text="The id of the PendingUpload record that originated this successful upload.",
         # aspedrosa: A foreign key is not used here since a PendingUpload record is erased once is successful. This
         #  is field is then only used to get the result data of pending upload through the get_upload_task_status view
     )
+    content_hash = models.CharField(
+        max_length=64,
+        null=True,
+        help_text="SHA-256 digest of the uploaded file. Used to detect uploads of files already uploaded.",
+    )
+    changed_analyses = models.JSONField(
+        null=True,
+        help_text="Ids of the analyses whose records changed with this upload.",
+    )
+    archive_file = models.FileField(
+        null=True,
+        upload_to=archive_data_source_directory,
+        help_text="Parquet file with the archived records of this upload, "
+        "once they are removed from the database.",
+    )
 
     def __repr__(self):
         return self.__str__()
@@ -213,6 +331,91 @@ class UploadHistory(models.Model):
         return "Done"
 
 
+def drop_archive_partition(sender, instance, **_):
+    """
+    pre_delete receiver of the UploadHistory model. If the achilles_results_archive table
+     is partitioned, dropping the partition of the upload is faster than deleting its
+     records one by one, which happens afterwards on the deletion cascade.
+    """
+    from uploader import partitions  # noqa
+
+    with connections[router.db_for_write(AchillesResultsArchive)].cursor() as cursor:
+        if partitions.is_archive_partitioned(cursor):
+            partitions.drop_archive_partition(cursor, instance.id)
+
+
+def delete_archive_file(sender, instance, **_):
+    """
+    post_delete receiver of the UploadHistory model. The file with its archived records
+     is deleted once the deletion is committed.
+    """
+    if not instance.archive_file:
+        return
+
+    archive_file = instance.archive_file
+    transaction.on_commit(
+        lambda: archive_file.delete(save=False),
+        using=router.db_for_write(sender),
+    )
+
+
+# stored files shared by several uploads are only deleted with their last reference
+post_delete.connect(release_file, sender=PendingUpload)
+post_delete.connect(release_file, sender=UploadHistory)
+post_delete.connect(delete_archive_file, sender=UploadHistory)
+pre_delete.connect(drop_archive_partition, sender=UploadHistory)
+
+
+class UploadSession(models.Model):
+    """
+    Results file being uploaded in several chunks, so the upload can resume after a
+     network failure. Once all chunks are received, a PendingUpload is created with it.
+    """
+
+    class Meta:
+        db_table = "upload_session"
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    data_source = models.ForeignKey(DataSource, on_delete=models.CASCADE)
+    file_name = models.CharField(max_length=255)
+    size = models.BigIntegerField(help_text="Total number of bytes of the file.")
+    offset = models.BigIntegerField(
+        default=0, help_text="Number of bytes of the file received so far."
+    )
+    # users are stored on a different database, so there can't be a foreign key to them
+    user_id = models.IntegerField(
+        null=True,
+        editable=False,
+        help_text="Id of the user that started the upload through the API.",
+    )
+    created_date = models.DateTimeField(auto_now_add=True)
+    updated_date = models.DateTimeField(auto_now=True)
+
+    @property
+    def path(self):
+        """
+        File where the received chunks are stored
+        """
+        return os.path.join(
+            settings.MEDIA_ROOT,
+            settings.ACHILLES_RESULTS_STORAGE_PATH,
+            "sessions",
+            f"{self.id}.part",
+        )
+
+    def delete(self, using=None, keep_parents=False):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+        return super().delete(using, keep_parents)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return f"{self.data_source.name} - {self.file_name}"
+
+
 class AchillesResults(models.Model):
     class Meta:
         db_table = "achilles_results"
@@ -244,7 +447,7 @@ class AchillesResultsArchive(models.Model):
     class Meta:
         db_table = "achilles_results_archive"
         indexes = [
-            models.Index(fields=("data_source",)),
+            models.Index(fields=("data_source", "upload_info", "analysis_id")),
             models.Index(fields=("analysis_id",)),
         ]
 
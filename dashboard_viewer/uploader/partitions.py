@@ -0,0 +1,299 @@
+from .models import (
+    AchillesResults,
+    AchillesResultsArchive,
+    DataSource,
+    UploadHistory,
+)
+
+PARTITION_CHECK_CONSTRAINT = "data_source_partition_check"
+
+
+def _table():
+    return AchillesResults._meta.db_table
+
+
+def _archive_table():
+    return AchillesResultsArchive._meta.db_table
+
+
+def partition_name(data_source_id):
+    return f"{_table()}_ds_{int(data_source_id)}"
+
+
+def archive_partition_name(upload_info_id):
+    return f"{_archive_table()}_up_{int(upload_info_id)}"
+
+
+def _is_partitioned(cursor, table):
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+    row = cursor.fetchone()
+    return row is not None and row[0] == "p"
+
+
+def is_partitioned(cursor):
+    """
+    Checks if the achilles_results table is declaratively partitioned by data source
+
+    :param cursor: cursor of a connection to the achilles database
+    """
+    return _is_partitioned(cursor, _table())
+
+
+def is_archive_partitioned(cursor):
+    """
+    Checks if the achilles_results_archive table is declaratively partitioned by upload
+
+    :param cursor: cursor of a connection to the achilles database
+    """
+    return _is_partitioned(cursor, _archive_table())
+
+
+def create_partition(cursor, data_source_id):
+    cursor.execute(
+        f"CREATE TABLE IF NOT EXISTS {partition_name(data_source_id)} "
+        f"PARTITION OF {_table()} FOR VALUES IN ({int(data_source_id)})"
+    )
+
+
+def drop_partition(cursor, data_source_id):
+    cursor.execute(f"DROP TABLE IF EXISTS {partition_name(data_source_id)}")
+
+
+def archive_partition_exists(cursor, upload_info_id):
+    cursor.execute(
+        "SELECT to_regclass(%s) IS NOT NULL", (archive_partition_name(upload_info_id),)
+    )
+    return cursor.fetchone()[0]
+
+
+def create_archive_partition(cursor, upload_info_id):
+    cursor.execute(
+        f"CREATE TABLE IF NOT EXISTS {archive_partition_name(upload_info_id)} "
+        f"PARTITION OF {_archive_table()} FOR VALUES IN ({int(upload_info_id)})"
+    )
+
+
+def drop_archive_partition(cursor, upload_info_id):
+    cursor.execute(f"DROP TABLE IF EXISTS {archive_partition_name(upload_info_id)}")
+
+
+def create_partition_replacement(cursor, data_source_id):
+    """
+    Creates an empty table, not yet attached to the achilles_results table, to
+     load the new records of a data source into. It has the indexes of the partitions,
+     so they don't have to be built while attaching it, and a check constraint that
+     allows postgres to attach it without having to validate the partition bounds.
+
+    :param cursor: cursor of a connection to the achilles database
+    :param data_source_id: id of the data source
+    :return: name of the created table
+    """
+    replacement = f"{partition_name(data_source_id)}_new"
+
+    cursor.execute(f"DROP TABLE IF EXISTS {replacement}")
+    cursor.execute(
+        f"CREATE TABLE {replacement} ("
+        f"LIKE {_table()} INCLUDING DEFAULTS INCLUDING INDEXES, "
+        f"CONSTRAINT {PARTITION_CHECK_CONSTRAINT} "
+        f"CHECK (data_source_id IS NOT NULL AND data_source_id = {int(data_source_id)})"
+        ")"
+    )
+
+    return replacement
+
+
+def swap_partition(cursor, data_source_id, replacement):
+    """
+    Replaces the partition of a data source by the table created with the
+     create_partition_replacement function. Should run outside a transaction, once the
+     records loaded into the replacement table are committed. The old partition is detached
+     concurrently (postgres 14 or later), so queries on other data sources are not blocked,
+     and only dropped once detached. Until the replacement is attached, the data source
+     has no records.
+
+    :param cursor: cursor of a connection to the achilles database
+    :param data_source_id: id of the data source
+    :param replacement: name of the table returned by create_partition_replacement
+    """
+    partition = partition_name(data_source_id)
+    detached = f"{partition}_old"
+
+    cursor.execute("SHOW server_version_num")
+    concurrently = " CONCURRENTLY" if int(cursor.fetchone()[0]) >= 140000 else ""
+
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (partition,))
+    if cursor.fetchone()[0]:
+        cursor.execute(
+            f"ALTER TABLE {_table()} DETACH PARTITION {partition}{concurrently}"
+        )
+        cursor.execute(f"DROP TABLE IF EXISTS {detached}")
+        cursor.execute(f"ALTER TABLE {partition} RENAME TO {detached}")
+
+    cursor.execute(f"ALTER TABLE {replacement} RENAME TO {partition}")
+    cursor.execute(
+        f"ALTER TABLE {_table()} ATTACH PARTITION {partition} "
+        f"FOR VALUES IN ({int(data_source_id)})"
+    )
+    cursor.execute(f"DROP TABLE IF EXISTS {detached}")
+
+
+def _drop_materialized_views(cursor):
+    """
+    Drops all materialized views, since they reference the achilles_results table by oid.
+
+    :return: name, definition and index definitions of each dropped view, ordered by creation
+    """
+    cursor.execute(
+        "SELECT matviewname, definition "
+        "FROM pg_matviews JOIN pg_class ON pg_class.relname = pg_matviews.matviewname "
+        "WHERE pg_class.relkind = 'm' AND schemaname = current_schema() "
+        "ORDER BY pg_class.oid"
+    )
+    views = cursor.fetchall()
+
+    dropped = []
+    for name, definition in views:
+        cursor.execute(
+            "SELECT indexdef FROM pg_indexes "
+            "WHERE tablename = %s AND schemaname = current_schema()",
+            (name,),
+        )
+        dropped.append((name, definition, [row[0] for row in cursor.fetchall()]))
+
+    for name, _, _ in reversed(dropped):
+        cursor.execute(f"DROP MATERIALIZED VIEW {name}")
+
+    return dropped
+
+
+def _create_materialized_views(cursor, views):
+    for name, definition, indexes in views:
+        cursor.execute(f"CREATE MATERIALIZED VIEW {name} AS {definition}")
+        for index in indexes:
+            cursor.execute(index)
+
+
+# column each table is partitioned by, the model whose ids get a partition and the function
+#  that creates the partition of one of them. Without a model, only the values present on
+#  the table get a partition
+_PARTITIONING = {
+    AchillesResults: ("data_source_id", DataSource, create_partition),
+    AchillesResultsArchive: ("upload_info_id", None, create_archive_partition),
+}
+
+
+def _rebuild_table(cursor, model, partitioned):
+    table = model._meta.db_table
+    old_table = f"{table}_old"
+    key, key_model, create = _PARTITIONING[model]
+
+    cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", (table,))
+    sequence = cursor.fetchone()[0]
+
+    cursor.execute(
+        "SELECT indexdef FROM pg_indexes "
+        "WHERE tablename = %s AND schemaname = current_schema() AND indexname <> %s",
+        (table, f"{table}_pkey"),
+    )
+    indexes = [row[0] for row in cursor.fetchall()]
+
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = to_regclass(%s) AND contype = 'f'",
+        (table,),
+    )
+    foreign_keys = cursor.fetchall()
+
+    views = _drop_materialized_views(cursor)
+
+    cursor.execute(f"ALTER TABLE {table} RENAME TO {old_table}")
+    cursor.execute(
+        f"CREATE TABLE {table} (LIKE {old_table} INCLUDING DEFAULTS)"
+        + (f" PARTITION BY LIST ({key})" if partitioned else "")
+    )
+    if sequence:
+        cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id")
+
+    if partitioned:
+        if key_model is None:
+            cursor.execute(f"SELECT DISTINCT {key} FROM {old_table}")
+        else:
+            cursor.execute(f"SELECT id FROM {key_model._meta.db_table}")
+        for (key_id,) in cursor.fetchall():
+            create(cursor, key_id)
+
+    cursor.execute(f"INSERT INTO {table} SELECT * FROM {old_table}")
+    cursor.execute(f"DROP TABLE {old_table}")
+
+    if partitioned:
+        # a unique constraint of a partitioned table must include the partitioning column.
+        #  the foreign keys are not kept, since each partition only exists while the
+        #  record it belongs to exists
+        cursor.execute(
+            f"ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id, {key})"
+        )
+    else:
+        cursor.execute(
+            f"ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id)"
+        )
+        foreign_keys = foreign_keys or [
+            (
+                f"{table}_{field.column}_fk_{field.related_model._meta.db_table}_id",
+                f"FOREIGN KEY ({field.column}) "
+                f"REFERENCES {field.related_model._meta.db_table}(id) "
+                "DEFERRABLE INITIALLY DEFERRED",
+            )
+            for field in model._meta.concrete_fields
+            if field.is_relation
+        ]
+        for name, definition in foreign_keys:
+            cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}")
+
+    for index in indexes:
+        cursor.execute(index)
+
+    _create_materialized_views(cursor, views)
+
+
+def partition_table(cursor):
+    """
+    Converts the achilles_results table into a table partitioned by list of data source ids,
+     with a partition for each data source. Requires postgres 11 or later.
+     Should run inside a transaction.
+
+    :param cursor: cursor of a connection to the achilles database
+    """
+    _rebuild_table(cursor, AchillesResults, True)
+
+
+def unpartition_table(cursor):
+    """
+    Converts a partitioned achilles_results table back into a regular table.
+     Should run inside a transaction.
+
+    :param cursor: cursor of a connection to the achilles database
+    """
+    _rebuild_table(cursor, AchillesResults, False)
+
+
+def partition_archive_table(cursor):
+    """
+    Converts the achilles_results_archive table into a table partitioned by list of upload
+     ids, with a partition for each upload with archived records, so the archived records of
+     an upload are deleted by dropping its partition. Partitions are created as records are
+     archived. Requires postgres 11 or later.
+     Should run inside a transaction.
+
+    :param cursor: cursor of a connection to the achilles database
+    """
+    _rebuild_table(cursor, AchillesResultsArchive, True)
+
+
+def unpartition_archive_table(cursor):
+    """
+    Converts a partitioned achilles_results_archive table back into a regular table.
+     Should run inside a transaction.
+
+    :param cursor: cursor of a connection to the achilles database
+    """
+    _rebuild_table(cursor, AchillesResultsArchive, False)
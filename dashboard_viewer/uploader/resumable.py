@@ -0,0 +1,129 @@
+import datetime
+import os
+import re
+
+from django.conf import settings
+from django.core.files import File
+from django.db import router, transaction
+from django.utils import timezone
+
+from .models import PendingUpload, UploadSession
+
+_CONTENT_RANGE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+# bytes read from the request at a time
+_BUFFER_SIZE = 1024 * 1024
+
+
+class InvalidChunk(Exception):
+    pass
+
+
+class OffsetMismatch(Exception):
+    """
+    The chunk doesn't start where the bytes received so far end. The client should send
+     the chunk that starts at the offset of the upload session.
+    """
+
+    def __init__(self, offset):
+        super().__init__(f"Expected a chunk starting at byte {offset}")
+        self.offset = offset
+
+
+def _parse_content_range(content_range, size):
+    match = _CONTENT_RANGE.match(content_range or "")
+    if match is None:
+        raise InvalidChunk(
+            'The Content-Range header should have the format "bytes start-end/size"'
+        )
+
+    start, end, total = map(int, match.groups())
+    if total != size:
+        raise InvalidChunk(f"The size of the file being uploaded is {size} bytes")
+    if start > end or end >= size:
+        raise InvalidChunk("Invalid range of bytes")
+
+    return start, end
+
+
+def append_chunk(session_id, content_range, stream):
+    """
+    Stores the next chunk of a file being uploaded. Once the last chunk is received,
+     the whole file becomes a PendingUpload and the upload session is deleted.
+
+    :param session_id: id of the UploadSession
+    :param content_range: value of the Content-Range header of the request, with the
+     position of the chunk on the file
+    :param stream: file-like object with the bytes of the chunk
+    :return: the upload session and the created PendingUpload or None if there are chunks
+     missing
+    """
+    with transaction.atomic(using=router.db_for_write(UploadSession)):
+        # chunks of the same upload are stored one at a time
+        session = UploadSession.objects.select_for_update().get(id=session_id)
+
+        start, end = _parse_content_range(content_range, session.size)
+        if start != session.offset:
+            raise OffsetMismatch(session.offset)
+
+        os.makedirs(os.path.dirname(session.path), exist_ok=True)
+        with open(session.path, "ab") as file:
+            # discard the bytes of a previous chunk that didn't arrive complete
+            file.truncate(start)
+
+            remaining = end - start + 1
+            while remaining > 0:
+                data = stream.read(min(remaining, _BUFFER_SIZE))
+                if not data:
+                    raise InvalidChunk("The chunk is smaller than its range of bytes")
+                file.write(data)
+                remaining -= len(data)
+
+        session.offset = end + 1
+        session.save()
+
+    if session.offset < session.size:
+        return session, None
+
+    # the final offset is committed before the received file is hashed and copied into
+    #  the storage, so the lock of the upload session isn't held meanwhile. Further chunks
+    #  are refused, since none can start at the end of the file
+    try:
+        with open(session.path, "rb") as file:
+            pending_upload = PendingUpload.objects.create(
+                data_source=session.data_source,
+                uploaded_file=File(file, name=session.file_name),
+            )
+    except Exception:
+        # the client can send the last chunk again
+        UploadSession.objects.filter(id=session.id, offset=session.size).update(
+            offset=start
+        )
+        raise
+
+    session.delete()
+
+    return session, pending_upload
+
+
+def expire_sessions():
+    """
+    Deletes the upload sessions that didn't receive any chunk during the last
+     UPLOADER_RESUMABLE_SESSION_EXPIRY_DAYS days, along with their received chunks
+
+    :return: number of deleted upload sessions
+    """
+    limit = timezone.now() - datetime.timedelta(
+        days=settings.UPLOADER_RESUMABLE_SESSION_EXPIRY_DAYS
+    )
+
+    deleted = 0
+    with transaction.atomic(using=router.db_for_write(UploadSession)):
+        # sessions receiving a chunk right now are skipped
+        for session in UploadSession.objects.select_for_update(skip_locked=True).filter(
+            updated_date__lt=limit
+        ):
+            session.delete()
+            deleted += 1
+
+    return deleted
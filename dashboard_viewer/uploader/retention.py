@@ -0,0 +1,226 @@
+import datetime
+import tempfile
+
+import pyarrow
+import pyarrow.parquet
+from django.conf import settings
+from django.core.files import File
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from . import partitions, versions
+from .file_handler.loaders import copy_results_chunks, results_schema
+from .models import AchillesResultsArchive, UploadHistory
+
+# results data columns stored on the archive files. The data source and the upload of the
+#  records are the ones of the UploadHistory record the file belongs to
+COLUMNS = [
+    field.column
+    for field in AchillesResultsArchive._meta.concrete_fields
+    if field.column not in ("id", "data_source_id", "upload_info_id")
+]
+
+# rows fetched from the database and written to an archive file at a time
+_BATCH_SIZE = 100000
+
+
+def _connection():
+    return connections[router.db_for_write(AchillesResultsArchive)]
+
+
+def _archive_table(cursor):
+    # COPY can't insert through the achilles_results_archive view of a versioned table.
+    #  The records of the active uploads are also there, but those are never archived
+    if versions.is_versioned(cursor):
+        return versions.VERSIONS_TABLE
+    return AchillesResultsArchive._meta.db_table
+
+
+def retention_policy(data_source):
+    """
+    :return: number of most recent uploads and number of days the archived records of
+     a data source are kept on the database. Each can be None if not limited
+    """
+    keep_uploads = data_source.archive_keep_uploads
+    if keep_uploads is None:
+        keep_uploads = settings.UPLOADER_ARCHIVE_KEEP_UPLOADS
+
+    keep_days = data_source.archive_keep_days
+    if keep_days is None:
+        keep_days = settings.UPLOADER_ARCHIVE_KEEP_DAYS
+
+    return keep_uploads, keep_days
+
+
+def expired_uploads(data_source):
+    """
+    Finds the uploads of a data source whose records shouldn't be kept on the database
+     anymore. The records of an upload are kept if it is one of the most recent uploads
+     or if it is younger than the number of days of the retention policy. The active
+     upload of the data source never expires.
+
+    :return: list of UploadHistory records
+    """
+    keep_uploads, keep_days = retention_policy(data_source)
+    if keep_uploads is None and keep_days is None:
+        return []
+
+    uploads = list(
+        UploadHistory.objects.filter(data_source=data_source)
+        .exclude(id=data_source.active_upload_id)
+        .order_by("-upload_date")
+    )
+    if keep_uploads is not None:
+        if data_source.active_upload_id is not None:
+            # the active upload is one of the uploads kept
+            keep_uploads = max(keep_uploads - 1, 0)
+        uploads = uploads[keep_uploads:]
+
+    if keep_days is not None:
+        limit = timezone.now() - datetime.timedelta(days=keep_days)
+        uploads = [upload for upload in uploads if upload.upload_date <= limit]
+
+    return uploads
+
+
+def _write_archive_file(file, upload_history):
+    schema = results_schema(COLUMNS)
+
+    with _connection().cursor() as cursor:
+        table = _archive_table(cursor)
+
+    # server-side cursor, so the records are never all in memory
+    with _connection().chunked_cursor() as cursor, pyarrow.parquet.ParquetWriter(
+        file, schema, compression="zstd"
+    ) as writer:
+        cursor.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM {table} "
+            "WHERE upload_info_id = %s ORDER BY analysis_id",
+            (upload_history.id,),
+        )
+
+        while True:
+            rows = cursor.fetchmany(_BATCH_SIZE)
+            if not rows:
+                break
+
+            writer.write_table(
+                pyarrow.Table.from_arrays(
+                    [
+                        pyarrow.array(values, type=field.type)
+                        for values, field in zip(zip(*rows), schema)
+                    ],
+                    schema=schema,
+                )
+            )
+
+
+def _truncate_partition(cursor, upload_history):
+    if not partitions.archive_partition_exists(cursor, upload_history.id):
+        return 0
+
+    partition = partitions.archive_partition_name(upload_history.id)
+    cursor.execute(f"SELECT count(*) FROM {partition}")
+    count = cursor.fetchone()[0]
+    cursor.execute(f"TRUNCATE {partition}")
+
+    return count
+
+
+def export_upload(upload_history):
+    """
+    Moves the archived records of an upload to a zstd compressed Parquet file on the media
+     storage, which becomes the archive_file of the upload, and deletes them from the database.
+     If the upload already has a file, because its records were rehydrated, the records are
+     only deleted. Should not be called for the active upload of a data source.
+
+    :return: number of records deleted from the database
+    """
+    using = router.db_for_write(AchillesResultsArchive)
+
+    with transaction.atomic(using=using):
+        exported = None
+        if not upload_history.archive_file:
+            with tempfile.TemporaryFile() as file:
+                _write_archive_file(file, upload_history)
+
+                file.seek(0)
+                upload_history.archive_file.save(
+                    f"{upload_history.id}.parquet", File(file), save=False
+                )
+            exported = upload_history.archive_file
+
+        try:
+            upload_history.save(update_fields=("archive_file",))
+
+            with _connection().cursor() as cursor:
+                if partitions.is_archive_partitioned(cursor):
+                    return _truncate_partition(cursor, upload_history)
+
+                cursor.execute(
+                    f"DELETE FROM {_archive_table(cursor)} WHERE upload_info_id = %s",
+                    (upload_history.id,),
+                )
+                return cursor.rowcount
+        except Exception:
+            if exported is not None:
+                exported.delete(save=False)
+            raise
+
+
+def rehydrate_upload(upload_history):
+    """
+    Inserts the records of an upload stored on its archive file back into the archive table.
+     The file is kept, so if the upload is still expired, the next time the retention policy
+     is applied the records are deleted again without having to export them.
+
+    :return: number of records inserted or 0 if the records are already on the database
+    """
+    if not upload_history.archive_file:
+        raise ValueError("The records of this upload were not moved to a file")
+
+    with transaction.atomic(
+        using=router.db_for_write(AchillesResultsArchive)
+    ), _connection().cursor() as cursor:
+        table = _archive_table(cursor)
+
+        cursor.execute(
+            f"SELECT EXISTS (SELECT 1 FROM {table} WHERE upload_info_id = %s)",
+            (upload_history.id,),
+        )
+        if cursor.fetchone()[0]:
+            return 0
+
+        if partitions.is_archive_partitioned(cursor):
+            partitions.create_archive_partition(cursor, upload_history.id)
+
+        with upload_history.archive_file.open("rb") as file:
+            parquet_file = pyarrow.parquet.ParquetFile(file)
+
+            copy_results_chunks(
+                cursor,
+                table,
+                (
+                    parquet_file.read_row_group(i).to_pandas()
+                    for i in range(parquet_file.num_row_groups)
+                ),
+                COLUMNS,
+                upload_history.data_source_id,
+                upload_history.id,
+            )
+
+            return parquet_file.metadata.num_rows
+
+
+def apply_retention(data_source):
+    """
+    Moves the records of the expired uploads of a data source to files
+
+    :return: list of the UploadHistory records whose records were removed from the database
+    """
+    exported = []
+    for upload_history in expired_uploads(data_source):
+        if export_upload(upload_history) > 0:
+            exported.append(upload_history)
+
+    return exported
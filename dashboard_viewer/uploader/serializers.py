@@ -1,9 +1,52 @@
+import pathlib
+
 from rest_framework import serializers
 
-from .models import DataSource
+from .file_handler.compression import UNSUPPORTED_EXTENSIONS
+from .models import DataSource, UploadSession
 
 
 class DataSourceSerializer(serializers.ModelSerializer):
     class Meta:
         model = DataSource
         exclude = ("hash",)
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadSession
+        fields = ("id", "file_name", "size", "offset")
+        read_only_fields = ("offset",)
+
+    def validate_file_name(self, value):
+        if pathlib.Path(value).suffix.lower() in UNSUPPORTED_EXTENSIONS:
+            raise serializers.ValidationError(
+                "Compressed results files are only supported with gzip (.csv.gz) or zstd (.csv.zst)."
+            )
+        return value
+
+    def validate_size(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("The file can't be empty")
+        return value
+
+
+def uploadable_data_sources(user):
+    """
+    :return: data sources the user can upload results files of through the API
+    """
+    if user.has_perm("uploader.add_uploadsession"):
+        return DataSource.objects.all()
+    return DataSource.objects.none()
+
+
+class UploadableDataSourceField(serializers.SlugRelatedField):
+    def get_queryset(self):
+        return uploadable_data_sources(self.context["request"].user)
+
+
+class APIUploadSessionSerializer(UploadSessionSerializer):
+    data_source = UploadableDataSourceField(slug_field="hash")
+
+    class Meta(UploadSessionSerializer.Meta):
+        fields = UploadSessionSerializer.Meta.fields + ("data_source",)
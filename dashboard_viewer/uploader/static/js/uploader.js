@@ -16,9 +16,78 @@ function add_failure_message_popup(td, message) {
     })
 }
 
+const MAX_CHUNK_RETRIES = 5;
+
+async function resumable_upload(file, url, chunk_size) {
+    let response = await fetch(url, {
+        method: "POST",
+        headers: {"Content-Type": "application/json"},
+        body: JSON.stringify({file_name: file.name, size: file.size}),
+    });
+    if (!response.ok) {
+        throw new Error((await response.json()).detail || "Failed to start the upload");
+    }
+
+    const session_url = `${url}${(await response.json()).id}/`;
+
+    let offset = 0;
+    let retries = 0;
+    while (offset < file.size) {
+        const end = Math.min(offset + chunk_size, file.size);
+
+        try {
+            response = await fetch(session_url, {
+                method: "PUT",
+                headers: {"Content-Range": `bytes ${offset}-${end - 1}/${file.size}`},
+                body: file.slice(offset, end),
+            });
+        }
+        catch (error) {  // network failure
+            response = null;
+        }
+
+        if (response !== null && (response.ok || response.status === 409)) {
+            // on a conflict, the server tells from where to continue
+            offset = (await response.json()).offset;
+            retries = 0;
+        }
+        else if (response !== null && response.status < 500) {
+            throw new Error((await response.json()).detail);
+        }
+        else {
+            retries++;
+            if (retries > MAX_CHUNK_RETRIES) {
+                throw new Error("The connection to the server failed too many times");
+            }
+            await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** retries));
+
+            // part of the chunk might have been stored
+            try {
+                offset = (await (await fetch(session_url)).json()).offset;
+            }
+            catch (error) {}
+        }
+    }
+}
+
 document.addEventListener("DOMContentLoaded", () => {
-    document.getElementById("uploadForm").onsubmit = () => {
+    const form = document.getElementById("uploadForm");
+    form.onsubmit = (event) => {
         $("#pageloader").show();
+
+        const file_input = form.querySelector("input[type=file]");
+        if (form.dataset.uploadUrl && file_input && file_input.files.length === 1) {
+            event.preventDefault();
+
+            resumable_upload(
+                file_input.files[0], form.dataset.uploadUrl, parseInt(form.dataset.chunkSize)
+            )
+                .then(() => window.location.reload())
+                .catch(error => {
+                    $("#pageloader").hide();
+                    alert(`Upload failed: ${error.message}`);
+                });
+        }
     }
 
     const tbodys = document.getElementsByTagName("tbody");
@@ -0,0 +1,200 @@
+import hashlib
+import os
+import time
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import router, transaction
+from django.utils.deconstruct import deconstructible
+
+# directory, inside ACHILLES_RESULTS_STORAGE_PATH, of the content-addressed files
+FILES_DIRECTORY = "files"
+
+# seconds a file without references is kept, since a record that is about to reference
+#  it might not be inserted yet
+GC_GRACE_PERIOD = 60
+
+# seconds a spill file is kept. Spill files are deleted once their upload is processed,
+#  so older ones were left behind by workers that were killed
+SPILL_FILE_MAX_AGE = 24 * 60 * 60
+
+
+def content_address(digest):
+    """
+    :param digest: SHA-256 digest of the bytes of a file
+    :return: name of the file with such contents on the content-addressed storage
+    """
+    return os.path.join(
+        settings.ACHILLES_RESULTS_STORAGE_PATH, FILES_DIRECTORY, digest[:2], digest
+    )
+
+
+def stored_digest(name):
+    """
+    :param name: name of a stored file
+    :return: SHA-256 digest of the bytes of the file, if it is stored by content, or None
+    """
+    digest = os.path.basename(name)
+    return digest if name == content_address(digest) else None
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores each results file under the SHA-256 digest of its bytes, so identical files
+     uploaded several times, to the same or to different data sources, are stored once
+     and shared by all the records referencing them. The name proposed by the upload_to
+     function of the field is ignored.
+    """
+
+    def save(self, name, content, max_length=None):
+        if not hasattr(content, "chunks"):
+            content = File(content, name)
+
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+
+        name = content_address(digest.hexdigest())
+        if self.exists(name):
+            try:
+                # the file is about to be referenced again, so the garbage collection
+                #  must not take it as an unreferenced file during the grace period
+                os.utime(self.path(name))
+                return name
+            except FileNotFoundError:  # collected meanwhile
+                pass
+
+        return super().save(name, content, max_length)
+
+    def _save(self, name, content):
+        try:
+            return super()._save(name, content)
+        except FileNotFoundError:
+            # the directory was removed by a concurrent sweep before the file was created
+            return super()._save(name, content)
+
+
+def references(name):
+    """
+    :return: number of PendingUpload and UploadHistory records referencing a stored file
+    """
+    from .models import PendingUpload, UploadHistory
+
+    return (
+        PendingUpload.objects.filter(uploaded_file=name).count()
+        + UploadHistory.objects.filter(uploaded_file=name).count()
+    )
+
+
+results_files_storage = ContentAddressedStorage()
+
+
+def _recently_modified(name):
+    return (
+        os.path.getmtime(results_files_storage.path(name))
+        > time.time() - GC_GRACE_PERIOD
+    )
+
+
+def collect(name):
+    """
+    Deletes a stored file if no record references it anymore. Files stored or reused during
+     the last GC_GRACE_PERIOD seconds are kept, since the records referencing them might not
+     be inserted yet.
+
+    :return: True if the file was deleted
+    """
+    if (
+        references(name) > 0
+        or not results_files_storage.exists(name)
+        or _recently_modified(name)
+    ):
+        return False
+
+    results_files_storage.delete(name)
+    return True
+
+
+def release_file(sender, instance, **_):
+    """
+    post_delete receiver of the models referencing stored files. Once the deletion is
+     committed, the file is collected if that was its last reference.
+    """
+    from .tasks import collect_results_file
+
+    if not instance.uploaded_file:
+        return
+
+    name = instance.uploaded_file.name
+    transaction.on_commit(
+        lambda: collect_results_file.apply_async((name,), countdown=GC_GRACE_PERIOD),
+        using=router.db_for_write(sender),
+    )
+
+
+def _referenced_names():
+    from .models import PendingUpload, UploadHistory, UploadSession
+
+    names = set(PendingUpload.objects.values_list("uploaded_file", flat=True))
+    names.update(UploadHistory.objects.values_list("uploaded_file", flat=True))
+    names.update(UploadHistory.objects.values_list("archive_file", flat=True))
+    names.update(
+        os.path.relpath(session.path, settings.MEDIA_ROOT)
+        for session in UploadSession.objects.all()
+    )
+
+    return names
+
+
+def sweep():
+    """
+    Deletes the files under ACHILLES_RESULTS_STORAGE_PATH that no record references: results
+     files, Parquet files with archived records and the received chunks of upload sessions.
+     Covers the files left behind when records are deleted without delete signals, like on
+     the deletion of a data source, or by interrupted uploads. Files modified during the last
+     GC_GRACE_PERIOD seconds are kept, since the records referencing them might not be
+     inserted yet, as are the spill files modified during the last SPILL_FILE_MAX_AGE
+     seconds, which might belong to uploads being processed. Empty directories are also
+     removed.
+
+    :return: names of the deleted files
+    """
+    root = results_files_storage.path(settings.ACHILLES_RESULTS_STORAGE_PATH)
+    if not os.path.isdir(root):
+        return []
+
+    referenced = _referenced_names()
+    limit = time.time() - GC_GRACE_PERIOD
+    spill_limit = time.time() - SPILL_FILE_MAX_AGE
+
+    deleted = []
+    for directory, subdirectories, files in os.walk(root, topdown=False):
+        for file in files:
+            path = os.path.join(directory, file)
+            name = os.path.relpath(path, settings.MEDIA_ROOT)
+
+            try:
+                if name in referenced or os.path.getmtime(path) > (
+                    spill_limit if file.endswith(".arrow") else limit
+                ):
+                    continue
+
+                os.remove(path)
+            except FileNotFoundError:  # deleted meanwhile
+                continue
+            deleted.append(name)
+
+        try:
+            if (
+                directory != root
+                and not os.listdir(directory)
+                and os.path.getmtime(directory) <= limit
+            ):
+                os.rmdir(directory)
+        except OSError:
+            # a file was stored on it meanwhile, or it was already removed
+            pass
+
+    return deleted
@@ -1,19 +1,30 @@
+import os
+
 from celery import shared_task
 from celery.utils.log import get_task_logger
 from django.conf import settings
 from django.core import serializers
 from django.core.cache import caches
-from django.db import router, transaction
+from django.db import connections, router, transaction
 from redis_rw_lock import RWLock
 
-from materialized_queries_manager.utils import refresh
+from materialized_queries_manager.analyses import affected_queries
+from materialized_queries_manager.tasks import schedule_refresh
+from .deletion import delete_data_source
 from .file_handler.checks import (
     check_for_duplicated_files,
     extract_data_from_uploaded_file,
     upload_data_to_tmp_table,
 )
-from .file_handler.updates import update_achilles_results_data
-from .models import AchillesResults, PendingUpload, UploadHistory
+from .file_handler.updates import (
+    changed_analyses,
+    current_upload_id,
+    update_achilles_results_data,
+)
+from .models import AchillesResults, DataSource, PendingUpload, UploadHistory
+from .resumable import expire_sessions
+from .retention import apply_retention, rehydrate_upload
+from .storage import collect, sweep
 
 logger = get_task_logger(__name__)
 
@@ -33,6 +44,10 @@ def upload_results_file(pending_upload_id: int):
         pending_upload_id,
     )
 
+    # validated data of the uploaded file, so the following stages don't have to parse it again.
+    #  Stored files are shared by identical uploads, so the path is specific to this upload
+    spill_path = f"{pending_upload.uploaded_file.path}.{pending_upload.id}.arrow"
+
     try:
         # To prevent the database owner from uploading the same data to the datasource
 
@@ -42,7 +57,7 @@ def upload_results_file(pending_upload_id: int):
             pending_upload.id,
         )
 
-        check_for_duplicated_files(pending_upload.uploaded_file, data_source.id)
+        check_for_duplicated_files(pending_upload)
 
         logger.info(
             "Checking file format and data [datasource %d, pending upload %d]",
@@ -50,7 +65,7 @@ def upload_results_file(pending_upload_id: int):
             pending_upload_id,
         )
         file_metadata, data = extract_data_from_uploaded_file(
-            pending_upload.uploaded_file
+            pending_upload.uploaded_file, spill_path
         )
 
         logger.info(
@@ -63,19 +78,39 @@ def upload_results_file(pending_upload_id: int):
 
         cache = caches["workers_locks"]
 
-        try:
-            cache.incr("celery_workers_updating", ignore_key_check=True)
-
-            with RWLock(  # several workers can update their records in paralel -> same as -> several threads can read from the same file
-                cache.client.get_client(),
-                "celery_worker_updating",
-                RWLock.READ,
-                expire=None,
-            ), cache.lock(  # but only one worker can make updates associated to a specific data source at the same time
-                f"celery_worker_lock_db_{data_source.id}"
-            ), transaction.atomic(
+        with RWLock(  # several workers can update their records in paralel -> same as -> several threads can read from the same file
+            cache.client.get_client(),
+            "celery_worker_updating",
+            RWLock.READ,
+            expire=None,
+        ), cache.lock(  # but only one worker can make updates associated to a specific data source at the same time
+            f"celery_worker_lock_db_{data_source.id}"
+        ):
+            with transaction.atomic(
                 using=router.db_for_write(AchillesResults)
             ), settings.ACHILLES_DB_SQLALCHEMY_ENGINE.connect() as pandas_connection, pandas_connection.begin():
+                logger.info(
+                    "Creating an upload history record [datasource %d, pending upload %d]",
+                    data_source.id,
+                    pending_upload_id,
+                )
+
+                # found before the new upload is created, so it can't be mistaken for it
+                previous_upload_id = current_upload_id(data_source.id)
+
+                upload_history = UploadHistory.objects.create(
+                    data_source=data_source,
+                    r_package_version=data["r_package_version"],
+                    generation_date=data["generation_date"],
+                    cdm_release_date=data["cdm_release_date"],
+                    cdm_version=data["cdm_version"],
+                    vocabulary_version=data["vocabulary_version"],
+                    # the stored file is shared instead of copied
+                    uploaded_file=pending_upload.uploaded_file.name,
+                    pending_upload_id=pending_upload.id,
+                    content_hash=pending_upload.content_hash,
+                )
+
                 logger.info(
                     "Updating results data [datasource %d, pending upload %d]",
                     data_source.id,
@@ -88,68 +123,138 @@ def upload_results_file(pending_upload_id: int):
                     pending_upload,
                     file_metadata,
                     pandas_connection,
-                )
-
-                logger.info(
-                    "Creating an upload history record [datasource %d, pending upload %d]",
-                    data_source.id,
-                    pending_upload_id,
+                    upload_history,
+                    previous_upload_id,
                 )
 
                 data_source.release_date = data["source_release_date"]
                 data_source.save()
 
-                pending_upload.uploaded_file.seek(0)
-                UploadHistory.objects.create(
-                    data_source=data_source,
-                    r_package_version=data["r_package_version"],
-                    generation_date=data["generation_date"],
-                    cdm_release_date=data["cdm_release_date"],
-                    cdm_version=data["cdm_version"],
-                    vocabulary_version=data["vocabulary_version"],
-                    uploaded_file=pending_upload.uploaded_file.file,
-                    pending_upload_id=pending_upload.id,
-                )
-
-                pending_upload.uploaded_file.delete()
                 pending_upload.delete()
 
-        finally:
-            workers_updating = cache.decr("celery_workers_updating")
+            # compared once the new records are committed, but before another upload of the
+            #  data source replaces them. Delta ingestion already recorded which analyses changed
+            analyses = upload_history.changed_analyses
+            if analyses is None:
+                with connections["achilles"].cursor() as cursor:
+                    analyses = changed_analyses(
+                        cursor, data_source.id, previous_upload_id
+                    )
+
+                upload_history.changed_analyses = sorted(analyses)
+                upload_history.save(update_fields=("changed_analyses",))
 
     except Exception as e:
-        pending_upload.status = PendingUpload.STATE_FAILED
-        pending_upload.save()
+        # if deleted, the records of the upload were already committed
+        if pending_upload.id is not None:
+            pending_upload.status = PendingUpload.STATE_FAILED
+            pending_upload.save()
 
         raise e
+    finally:
+        if os.path.exists(spill_path):
+            os.remove(spill_path)
+
+    logger.info(
+        "%d analyses changed [datasource %d, pending upload %d]",
+        len(analyses),
+        data_source.id,
+        pending_upload_id,
+    )
 
-    # The lines below can be used to later update materialized views of each chart
-    # To be more efficient, they should only be updated when the is no more workers inserting records
-    if not workers_updating:
-        refresh(logger, data_source.id)
+    # Only the materialized views that use the changed analyses are refreshed, once
+    #  uploads stop arriving for a while, so several uploads are covered by a single refresh
+    names = affected_queries(analyses)
+    if names:
+        schedule_refresh(data_source.id, names)
+
+    apply_archive_retention.delay(data_source.id)
 
 
 @shared_task
 def delete_datasource(objs):
     cache = caches["workers_locks"]
 
-    cache.incr("celery_workers_updating", ignore_key_check=True)
+    with RWLock(
+        cache.client.get_client(),
+        "celery_worker_updating",
+        RWLock.READ,
+        expire=None,
+    ):
+        objs = serializers.deserialize("json", objs)
 
-    try:
-        with RWLock(
-            cache.client.get_client(),
-            "celery_worker_updating",
-            RWLock.READ,
-            expire=None,
-        ):
-            objs = serializers.deserialize("json", objs)
+        deleted = []
+        for obj in objs:
+            obj = obj.object
+            with cache.lock(f"celery_worker_lock_db_{obj.pk}"):
+                if delete_data_source(obj.pk):
+                    deleted.append(obj.pk)
 
-            for obj in objs:
-                obj = obj.object
-                with cache.lock(f"celery_worker_lock_db_{obj.pk}"):
-                    obj.delete()
-    finally:
-        workers_updating = cache.decr("celery_workers_updating")
+    for db_id in deleted:
+        schedule_refresh(db_id)
+
+    # the stored files of the deleted uploads are no longer referenced
+    if deleted:
+        sweep_results_files.delay()
+
+
+@shared_task
+def collect_results_file(name):
+    if collect(name):
+        logger.info("Deleted stored results file %s, no longer referenced", name)
 
-    if not workers_updating:
-        refresh(logger)
+
+@shared_task
+def sweep_results_files():
+    expired = expire_sessions()
+    if expired:
+        logger.info("Deleted %d expired upload sessions", expired)
+
+    for name in sweep():
+        logger.info("Deleted stored file %s, no longer referenced", name)
+
+
+@shared_task
+def apply_archive_retention(data_source_id):
+    cache = caches["workers_locks"]
+
+    with RWLock(
+        cache.client.get_client(),
+        "celery_worker_updating",
+        RWLock.READ,
+        expire=None,
+    ), cache.lock(f"celery_worker_lock_db_{data_source_id}"):
+        try:
+            data_source = DataSource.objects.get(id=data_source_id)
+        except DataSource.DoesNotExist:
+            return  # deleted in the meantime
+
+        for upload_history in apply_retention(data_source):
+            logger.info(
+                "Archived records moved to %s [datasource %d, upload history %d]",
+                upload_history.archive_file.name,
+                data_source_id,
+                upload_history.id,
+            )
+
+
+@shared_task
+def rehydrate_archived_upload(upload_history_id):
+    cache = caches["workers_locks"]
+
+    upload_history = UploadHistory.objects.get(id=upload_history_id)
+
+    with RWLock(
+        cache.client.get_client(),
+        "celery_worker_updating",
+        RWLock.READ,
+        expire=None,
+    ), cache.lock(f"celery_worker_lock_db_{upload_history.data_source_id}"):
+        count = rehydrate_upload(upload_history)
+
+    logger.info(
+        "%d archived records restored [datasource %d, upload history %d]",
+        count,
+        upload_history.data_source_id,
+        upload_history_id,
+    )
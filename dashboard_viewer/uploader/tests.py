@@ -1,24 +1,50 @@
+import datetime
+import gzip
+import hashlib
 import io
 import logging
+import os
+import tempfile
+import time
+from unittest.mock import patch
 
 import numpy
+import pyarrow
+import pyarrow.ipc
+import pyarrow.parquet
+import zstandard
 from celery.utils.log import get_task_logger
 from django.conf import settings
-from django.core.cache import caches
+from django.contrib.auth.models import Permission, User
+from django.core import serializers
+from django.core.files.base import ContentFile
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command, CommandError
+from django.db import connections, transaction
 from django.test import override_settings, tag, TestCase, TransactionTestCase
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
 from sqlalchemy import create_engine
 
+from materialized_queries_manager.analyses import referenced_analyses
+from materialized_queries_manager.models import MaintainedQuery
 from .file_handler.checks import (
+    _validate_with_arrow,
     DuplicatedMetadataRow,
     EqualFileAlreadyUploaded,
     extract_data_from_uploaded_file,
     FileChecksException,
+    FileDataCorrupted,
+    InvalidCSVFile,
     InvalidFieldValue,
     InvalidFileFormat,
     MissingFieldValue,
+    upload_data_to_tmp_table,
+)
+from .file_handler.updates import (
+    changed_analyses,
+    update_achilles_results_data,
 )
-from .file_handler.updates import update_achilles_results_data
 from .models import (
     AchillesResults,
     AchillesResultsArchive,
@@ -26,12 +52,38 @@ from .models import (
     DataSource,
     PendingUpload,
     UploadHistory,
+    UploadSession,
+)
+from .partitions import archive_partition_name, partition_name
+from .resumable import expire_sessions
+from .storage import (
+    collect,
+    content_address,
+    results_files_storage,
+    SPILL_FILE_MAX_AGE,
+    sweep,
 )
-from .tasks import upload_results_file
+from .tasks import delete_datasource, upload_results_file
+from .versions import VERSIONS_TABLE
 
 logger = get_task_logger(__name__)
 
 
+def _columnar_file(table, file_format):
+    file = io.BytesIO()
+    if file_format == "parquet":
+        pyarrow.parquet.write_table(table, file, row_group_size=2)
+    else:
+        new_writer = (
+            pyarrow.ipc.new_file if file_format == "arrow" else pyarrow.ipc.new_stream
+        )
+        with new_writer(file, table.schema) as writer:
+            writer.write_table(table, max_chunksize=2)
+
+    file.seek(0)
+    return file
+
+
 @tag("third-party-app")
 @override_settings(ALLOWED_HOSTS=["thisapp.host.com", "mainapp.host.com"])
 class UploaderRestrictedAccess(TestCase):
@@ -105,7 +157,24 @@ class DataSourceCreator:
 datasource_creator = DataSourceCreator()
 
 
-class UpdateAchillesResultsDataTestCase(TransactionTestCase):
+class TemporaryMediaRootMixin:
+    """
+    Stores the files written by a test on a temporary MEDIA_ROOT, deleted once the test ends
+    """
+
+    def setUp(self):
+        self._media_root = tempfile.TemporaryDirectory()
+        self._media_root_settings = override_settings(MEDIA_ROOT=self._media_root.name)
+        self._media_root_settings.enable()
+        super().setUp()
+
+    def tearDown(self):
+        super().tearDown()
+        self._media_root_settings.disable()
+        self._media_root.cleanup()
+
+
+class UpdateAchillesResultsDataTestCase(TemporaryMediaRootMixin, TransactionTestCase):
     databases = "__all__"
 
     file_metadata = {
@@ -161,11 +230,13 @@ class UpdateAchillesResultsDataTestCase(TransactionTestCase):
         super().tearDownClass()
 
     def setUp(self) -> None:
+        super().setUp()
         self._pending_upload.data_source = DataSource.objects.get(acronym="test1")
         self._pandas_connection = self._pandas_connection_engine.connect()
 
     def tearDown(self):
         self._pandas_connection.close()
+        super().tearDown()
 
     def _update_and_check(self, count, archive_count):
         self._pending_upload.uploaded_file.seek(0)
@@ -246,6 +317,514 @@ class UpdateAchillesResultsDataTestCase(TransactionTestCase):
         self.assertEqual(2, AchillesResults.objects.count())
         self.assertEqual(0, AchillesResults.objects.filter(stratum_1="0").count())
 
+    def test_copy_null_and_quoted_values(self):
+        file_metadata, _ = extract_data_from_uploaded_file(
+            io.BytesIO(
+                bytes(
+                    "analysis_id,stratum_1,stratum_2,stratum_3,stratum_4,stratum_5,count,min,max,avg,std,mean,p10,p25,p75,p90\n"
+                    "0,,,,,,1000,,,,,,,,,\n"
+                    '5000,"a, ""b""",,,,,1001,4,4.5,2,5,5.3,3,3,4,3.44\n',
+                    "utf8",
+                )
+            )
+        )
+
+        new_pending_upload = PendingUpload.objects.create(
+            data_source=DataSource.objects.get(acronym="test1"),
+            uploaded_file=SimpleUploadedFile(
+                "dummy",
+                bytes(
+                    "analysis_id,stratum_1,stratum_2,stratum_3,stratum_4,stratum_5,count,min,max,avg,std,mean,p10,p25,p75,p90\n"
+                    "0,,,,,,1000,,,,,,,,,\n"
+                    '5000,"a, ""b""",,,,,1001,4,4.5,2,5,5.3,3,3,4,3.44\n',
+                    "utf8",
+                ),
+            ),
+        )
+
+        update_achilles_results_data(
+            self._logger,
+            new_pending_upload,
+            file_metadata,
+            self._pandas_connection,
+        )
+
+        metadata_0 = AchillesResults.objects.get(analysis_id=0)
+        self.assertIsNone(metadata_0.stratum_1)
+        self.assertIsNone(metadata_0.min_value)
+
+        metadata_5000 = AchillesResults.objects.get(analysis_id=5000)
+        self.assertEqual('a, "b"', metadata_5000.stratum_1)
+        self.assertEqual(1001, metadata_5000.count_value)
+        self.assertEqual(3.44, metadata_5000.p90_value)
+
+    def test_load_from_spill_file(self):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            file_metadata, _ = extract_data_from_uploaded_file(
+                io.BytesIO(
+                    bytes(
+                        "analysis_id,stratum_1,stratum_2,stratum_3,stratum_4,stratum_5,count_value\n"
+                        "0,,5,0,,,2000\n"
+                        '101,"a, ""b""",5,,,,2000\n'
+                        "5000,,1,,2,4,1001\n",
+                        "utf8",
+                    )
+                ),
+                os.path.join(spill_dir, "spill.arrow"),
+            )
+
+            # the uploaded file is not read again if the validation stage created a spill file
+            new_pending_upload = PendingUpload.objects.create(
+                data_source=DataSource.objects.get(acronym="test1"),
+                uploaded_file=SimpleUploadedFile("dummy", b""),
+            )
+
+            update_achilles_results_data(
+                self._logger,
+                new_pending_upload,
+                file_metadata,
+                self._pandas_connection,
+            )
+
+        self.assertEqual(3, AchillesResults.objects.count())
+        self.assertEqual(
+            'a, "b"', AchillesResults.objects.get(analysis_id=101).stratum_1
+        )
+        self.assertIsNone(AchillesResults.objects.get(analysis_id=0).stratum_1)
+
+    def test_load_columnar_file(self):
+        parquet_file = _columnar_file(
+            pyarrow.table(
+                {
+                    "analysis_id": [0, 101, 5000],
+                    "stratum_1": [None, 'a, "b"', None],
+                    "stratum_2": ["5", "5", "1"],
+                    "stratum_3": ["0", None, None],
+                    "stratum_4": [None, None, "2"],
+                    "stratum_5": [None, None, "4"],
+                    "count_value": [2000, 2000, 1001],
+                }
+            ),
+            "parquet",
+        )
+        file_metadata, _ = extract_data_from_uploaded_file(parquet_file)
+
+        new_pending_upload = PendingUpload.objects.create(
+            data_source=DataSource.objects.get(acronym="test1"),
+            uploaded_file=SimpleUploadedFile(
+                "results.parquet", parquet_file.getvalue()
+            ),
+        )
+
+        update_achilles_results_data(
+            self._logger,
+            new_pending_upload,
+            file_metadata,
+            self._pandas_connection,
+        )
+
+        self.assertEqual(3, AchillesResults.objects.count())
+        self.assertEqual(
+            'a, "b"', AchillesResults.objects.get(analysis_id=101).stratum_1
+        )
+        self.assertIsNone(AchillesResults.objects.get(analysis_id=0).stratum_1)
+
+
+class PartitionedUpdateAchillesResultsDataTestCase(UpdateAchillesResultsDataTestCase):
+    """
+    Same checks as UpdateAchillesResultsDataTestCase, but with the achilles_results
+     table partitioned by data source
+    """
+
+    def setUp(self):
+        call_command("partition_achilles_results", stdout=io.StringIO())
+        super().setUp()
+
+    def tearDown(self):
+        super().tearDown()
+        call_command("partition_achilles_results", undo=True, stdout=io.StringIO())
+
+    def _partitions(self):
+        with connections["achilles"].cursor() as cursor:
+            cursor.execute(
+                "SELECT inhrelid::regclass::text FROM pg_inherits "
+                "WHERE inhparent = 'achilles_results'::regclass"
+            )
+            return {row[0] for row in cursor.fetchall()}
+
+    def test_partitions(self):
+        self.assertEqual(
+            {
+                partition_name(data_source.id)
+                for data_source in DataSource.objects.all()
+            },
+            self._partitions(),
+        )
+
+        data_source = DataSource.objects.create(
+            name="partitioned",
+            acronym="partitioned",
+            database_type="Test",
+            latitude=0,
+            longitude=0,
+        )
+        partition = partition_name(data_source.id)
+        self.assertIn(partition, self._partitions())
+
+        data_source.delete()
+        self.assertNotIn(partition, self._partitions())
+
+    def test_swap_after_commit(self):
+        self._update_and_check(2, 0)
+        partition = partition_name(self._pending_upload.data_source.id)
+
+        self._pending_upload.uploaded_file.seek(0)
+        with transaction.atomic(using="achilles"):
+            with self._pandas_connection.begin():
+                update_achilles_results_data(
+                    self._logger,
+                    self._pending_upload,
+                    self.file_metadata,
+                    self._pandas_connection,
+                )
+
+            # the new records are loaded, but the partition is not replaced yet
+            self.assertIn(
+                f"{partition}_new", connections["achilles"].introspection.table_names()
+            )
+            self.assertIn(partition, self._partitions())
+
+        self.assertEqual(2, AchillesResults.objects.count())
+        self.assertEqual(2, AchillesResultsArchive.objects.count())
+        self.assertIn(partition, self._partitions())
+
+        tables = connections["achilles"].introspection.table_names()
+        self.assertNotIn(f"{partition}_new", tables)
+        self.assertNotIn(f"{partition}_old", tables)
+
+
+class PartitionedArchiveUpdateAchillesResultsDataTestCase(
+    UpdateAchillesResultsDataTestCase
+):
+    """
+    Same checks as UpdateAchillesResultsDataTestCase, but with the achilles_results_archive
+     table partitioned by upload
+    """
+
+    def setUp(self):
+        call_command("partition_achilles_results", archive=True, stdout=io.StringIO())
+        super().setUp()
+
+    def tearDown(self):
+        super().tearDown()
+        call_command(
+            "partition_achilles_results", archive=True, undo=True, stdout=io.StringIO()
+        )
+
+    def _partitions(self):
+        with connections["achilles"].cursor() as cursor:
+            cursor.execute(
+                "SELECT inhrelid::regclass::text FROM pg_inherits "
+                "WHERE inhparent = 'achilles_results_archive'::regclass"
+            )
+            return {row[0] for row in cursor.fetchall()}
+
+    def test_partitions(self):
+        self._update_and_check(2, 0)
+        self._update_and_check(2, 2)
+        self._update_and_check(2, 4)
+
+        # the last upload has no archived records yet
+        uploads = list(UploadHistory.objects.order_by("upload_date"))
+        self.assertEqual(
+            {archive_partition_name(upload.id) for upload in uploads[:2]},
+            self._partitions(),
+        )
+
+        # deleting an upload drops the partition with its records
+        partition = archive_partition_name(uploads[0].id)
+        uploads[0].delete()
+        self.assertNotIn(partition, self._partitions())
+        self.assertEqual(2, AchillesResultsArchive.objects.count())
+
+        DataSource.objects.get(acronym="test1").delete()
+        self.assertEqual(set(), self._partitions())
+
+    def test_versioned(self):
+        with self.assertRaises(CommandError):
+            call_command("version_achilles_results", stdout=io.StringIO())
+
+    def test_upload(self):
+        data_source = DataSource.objects.get(acronym="test1")
+        for count_value in (1, 2):
+            pending_upload = PendingUpload.objects.create(
+                data_source=data_source,
+                uploaded_file=SimpleUploadedFile(
+                    "results.csv",
+                    b"analysis_id,stratum_1,stratum_2,stratum_3,stratum_4,stratum_5,count_value\n"
+                    b"0,,3,0,,,1000\n" + f"5000,,1,,2,4,{count_value}\n".encode(),
+                ),
+            )
+            upload_results_file.delay(pending_upload.id)
+
+        first = UploadHistory.objects.order_by("upload_date").first()
+        self.assertEqual({archive_partition_name(first.id)}, self._partitions())
+        self.assertEqual(
+            2, AchillesResultsArchive.objects.filter(upload_info=first).count()
+        )
+
+
+@override_settings(UPLOADER_DELTA_INGESTION=True)
+class DeltaUpdateAchillesResultsDataTestCase(
+    TemporaryMediaRootMixin, TransactionTestCase
+):
+    databases = "__all__"
+
+    fixtures = ("countries", "two_data_sources")
+
+    header = (
+        "analysis_id,stratum_1,stratum_2,stratum_3,stratum_4,stratum_5,count_value\n"
+    )
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls._pandas_connection_engine = create_engine(
+            "postgresql"
+            f"://{settings.DATABASES['achilles']['USER']}:{settings.DATABASES['achilles']['PASSWORD']}"
+            f"@{settings.DATABASES['achilles']['HOST']}:{settings.DATABASES['achilles']['PORT']}"
+            f"/{settings.DATABASES['achilles']['NAME']}"
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._pandas_connection_engine.dispose()
+        super().tearDownClass()
+
+    def _upload(self, rows):
+        content = bytes(self.header + rows, "utf8")
+        file_metadata, _ = extract_data_from_uploaded_file(io.BytesIO(content))
+
+        data_source = DataSource.objects.get(acronym="test1")
+        upload_history = UploadHistory.objects.create(data_source=data_source)
+
+        with self._pandas_connection_engine.connect() as pandas_connection:
+            update_achilles_results_data(
+                logger,
+                PendingUpload.objects.create(
+                    data_source=data_source,
+                    uploaded_file=SimpleUploadedFile("dummy", content),
+                ),
+                file_metadata,
+                pandas_connection,
+                upload_history,
+            )
+
+        upload_history.refresh_from_db()
+        return upload_history
+
+    def test_apply_changed_records_only(self):
+        first = self._upload(
+            "0,,,,,,1000\n" "101,a,,,,,5\n" "102,b,,,,,6\n" "5000,,,,,,1001\n"
+        )
+        self.assertEqual([0, 101, 102, 5000], first.changed_analyses)
+        unchanged_id = AchillesResults.objects.get(analysis_id=0).id
+
+        second = self._upload(
+            "0,,,,,,1000\n" "101,a,,,,,7\n" "103,c,,,,,8\n" "5000,,,,,,1001\n"
+        )
+        self.assertEqual([101, 102, 103], second.changed_analyses)
+
+        self.assertEqual(
+            {(0, 1000), (101, 7), (103, 8), (5000, 1001)},
+            set(AchillesResults.objects.values_list("analysis_id", "count_value")),
+        )
+        # records that didn't change are not rewritten
+        self.assertEqual(unchanged_id, AchillesResults.objects.get(analysis_id=0).id)
+
+        # the archived records of the previous upload are all of its records
+        self.assertEqual(
+            {
+                (0, 1000, first.id),
+                (101, 5, first.id),
+                (102, 6, first.id),
+                (5000, 1001, first.id),
+            },
+            set(
+                AchillesResultsArchive.objects.values_list(
+                    "analysis_id", "count_value", "upload_info_id"
+                )
+            ),
+        )
+        with connections["achilles"].cursor() as cursor:
+            self.assertEqual(
+                {101, 102, 103},
+                changed_analyses(cursor, first.data_source_id, first.id),
+            )
+
+    def test_identical_records(self):
+        rows = "0,,,,,,1000\n" "101,a,,,,,5\n" "101,a,,,,,5\n"
+        self._upload(rows)
+
+        second = self._upload(rows)
+        self.assertEqual([], second.changed_analyses)
+        self.assertEqual(3, AchillesResults.objects.count())
+        self.assertEqual(3, AchillesResultsArchive.objects.count())
+
+        self.assertEqual(
+            [101], self._upload("0,,,,,,1000\n" "101,a,,,,,5\n").changed_analyses
+        )
+        self.assertEqual(2, AchillesResults.objects.count())
+        self.assertEqual(
+            3, AchillesResultsArchive.objects.filter(upload_info=second).count()
+        )
+
+
+class VersionedUpdateAchillesResultsDataTestCase(TransactionTestCase):
+    """
+    Checks the update process when the records of all uploads are stored on a single table
+    """
+
+    databases = "__all__"
+
+    file_metadata = UpdateAchillesResultsDataTestCase.file_metadata
+    file = UpdateAchillesResultsDataTestCase.file
+
+    fixtures = ("countries", "two_data_sources")
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls._pandas_connection_engine = create_engine(
+            "postgresql"
+            f"://{settings.DATABASES['achilles']['USER']}:{settings.DATABASES['achilles']['PASSWORD']}"
+            f"@{settings.DATABASES['achilles']['HOST']}:{settings.DATABASES['achilles']['PORT']}"
+            f"/{settings.DATABASES['achilles']['NAME']}"
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._pandas_connection_engine.dispose()
+        super().tearDownClass()
+
+    def setUp(self):
+        call_command("version_achilles_results", stdout=io.StringIO())
+        self._pandas_connection = self._pandas_connection_engine.connect()
+
+    def tearDown(self):
+        self._pandas_connection.close()
+        call_command("version_achilles_results", undo=True, stdout=io.StringIO())
+
+    def _update(self, acronym):
+        data_source = DataSource.objects.get(acronym=acronym)
+        upload_history = UploadHistory.objects.create(data_source=data_source)
+
+        self.file.seek(0)
+        update_achilles_results_data(
+            logger,
+            PendingUpload(id=1, data_source=data_source, uploaded_file=self.file),
+            self.file_metadata,
+            self._pandas_connection,
+            upload_history,
+        )
+
+        return upload_history
+
+    def _versions_count(self):
+        with connections["achilles"].cursor() as cursor:
+            cursor.execute(f"SELECT count(*) FROM {VERSIONS_TABLE}")
+            return cursor.fetchone()[0]
+
+    def test_migrations_refused(self):
+        with self.assertRaisesMessage(CommandError, "version_achilles_results --undo"):
+            call_command(
+                "migrate", "uploader", "0020", database="achilles", verbosity=0
+            )
+
+        # the last migration was not reverted
+        with connections["achilles"].cursor() as cursor:
+            self.assertIn(
+                "user_id",
+                [
+                    column.name
+                    for column in connections[
+                        "achilles"
+                    ].introspection.get_table_description(
+                        cursor, UploadSession._meta.db_table
+                    )
+                ],
+            )
+
+    def test_insert(self):
+        first_upload = self._update("test1")
+        self.assertEqual(2, AchillesResults.objects.count())
+        self.assertEqual(0, AchillesResultsArchive.objects.count())
+
+        second_upload = self._update("test1")
+        self.assertEqual(2, AchillesResults.objects.count())
+        self.assertEqual(
+            2, AchillesResultsArchive.objects.filter(upload_info=first_upload).count()
+        )
+
+        self._update("test1")
+        self.assertEqual(2, AchillesResults.objects.count())
+        self.assertEqual(
+            {first_upload.id, second_upload.id},
+            set(AchillesResultsArchive.objects.values_list("upload_info", flat=True)),
+        )
+
+        # records are never moved
+        self.assertEqual(6, self._versions_count())
+
+    def test_move_records_of_only_one_db(self):
+        self._update("test1")
+        self._update("test2")
+
+        self.assertEqual(4, AchillesResults.objects.count())
+        self.assertEqual(0, AchillesResultsArchive.objects.count())
+
+        self._update("test1")
+
+        self.assertEqual(4, AchillesResults.objects.count())
+        self.assertEqual(2, AchillesResultsArchive.objects.count())
+
+    def test_upload_history_required(self):
+        self.file.seek(0)
+        with self.assertRaises(ValueError):
+            update_achilles_results_data(
+                logger,
+                PendingUpload(
+                    id=1,
+                    data_source=DataSource.objects.get(acronym="test1"),
+                    uploaded_file=self.file,
+                ),
+                self.file_metadata,
+                self._pandas_connection,
+            )
+
+    def test_undo(self):
+        self._update("test1")
+        self._update("test1")
+
+        call_command("version_achilles_results", undo=True, stdout=io.StringIO())
+        self.assertEqual(2, AchillesResults.objects.count())
+        self.assertEqual(2, AchillesResultsArchive.objects.count())
+
+        call_command("version_achilles_results", stdout=io.StringIO())
+        self.assertEqual(2, AchillesResults.objects.count())
+        self.assertEqual(2, AchillesResultsArchive.objects.count())
+        self.assertEqual(4, self._versions_count())
+
+    def test_delete_data_source(self):
+        self._update("test1")
+        self._update("test1")
+
+        DataSource.objects.get(acronym="test1").delete()
+
+        self.assertEqual(0, self._versions_count())
+
 
 class ExtractDataFromUploadedFileTestCase(TestCase):
     file_7 = io.BytesIO(
@@ -342,6 +921,15 @@ class ExtractDataFromUploadedFileTestCase(TestCase):
             self.file_7_mandatory_empty,
         )
 
+    def test_blank_line(self):
+        file = io.BytesIO(
+            b"analysis_id,stratum_1,stratum_2,stratum_3,stratum_4,stratum_5,count_value\n"
+            b"0,,3,0,,,1000\n"
+            b"\n"
+            b"5000,,1,,2,4,1001\n"
+        )
+        self.assertRaises(InvalidFieldValue, extract_data_from_uploaded_file, file)
+
     def test_missing_analysis_id_0(self):
         self.assertRaises(
             MissingFieldValue, extract_data_from_uploaded_file, self.file_7_missing_0
@@ -354,6 +942,45 @@ class ExtractDataFromUploadedFileTestCase(TestCase):
             self.file_7_duplicated,
         )
 
+    def test_duplicated_analysis_id_0_after_sorted_rows(self):
+        # the first chunks are sorted by analysis id and already past the metadata analyses
+        file = io.BytesIO(
+            bytes(
+                "analysis_id,stratum_1,stratum_2,stratum_3,stratum_4,stratum_5,count_value\n"
+                "0,,,,,,1\n"
+                + "".join(
+                    f"{analysis_id},,,,,,1\n" for analysis_id in range(5001, 5300)
+                )
+                + "0,,,,,,1\n",
+                "utf8",
+            )
+        )
+
+        self.assertRaises(
+            DuplicatedMetadataRow,
+            extract_data_from_uploaded_file,
+            file,
+        )
+
+    def test_metadata_of_sorted_file(self):
+        file = io.BytesIO(
+            bytes(
+                "analysis_id,stratum_1,stratum_2,stratum_3,stratum_4,stratum_5,count_value\n"
+                "0,,3,0,,,1000\n"
+                + "".join(f"{analysis_id},,,,,,1\n" for analysis_id in range(1, 300))
+                + "5000,,1,,2,4,1001\n"
+                + "".join(
+                    f"{analysis_id},,,,,,1\n" for analysis_id in range(5001, 5300)
+                ),
+                "utf8",
+            )
+        )
+
+        _, metadata = extract_data_from_uploaded_file(file)
+
+        self.assertEqual("1", metadata["source_release_date"])
+        self.assertEqual("3", metadata["r_package_version"])
+
     def test_return_value(self):
         self.file_7.seek(0)
 
@@ -372,19 +999,135 @@ class ExtractDataFromUploadedFileTestCase(TestCase):
         )
 
         self.assertEquals(
-            file_metadata, UpdateAchillesResultsDataTestCase.file_metadata
+            file_metadata,
+            {
+                **UpdateAchillesResultsDataTestCase.file_metadata,
+                "analyses": {0, 5000},
+            },
         )
 
+    def test_columnar_files(self):
+        table = pyarrow.table(
+            {
+                "analysis_id": [0, 1, 5000],
+                "stratum_1": [None, 10, 20],
+                "stratum_2": ["3", None, "1"],
+                "stratum_3": ["0", None, None],
+                "stratum_4": [None, None, "2"],
+                "stratum_5": [None, None, "4"],
+                "count": pyarrow.array([1000, 5, 1001], pyarrow.int32()),
+            }
+        )
 
-class UploadResultsFileTestCase(TransactionTestCase):
-    databases = "__all__"
+        for file_format in ("parquet", "arrow", "arrow_stream"):
+            with self.subTest(file_format=file_format):
+                file_metadata, metadata = extract_data_from_uploaded_file(
+                    _columnar_file(table, file_format)
+                )
 
-    fixtures = ("countries", "two_data_sources")
+                self.assertEqual(file_format, file_metadata["format"])
+                self.assertEqual({0, 1, 5000}, file_metadata["analyses"])
+                self.assertEqual("3", metadata["r_package_version"])
+                self.assertEqual("4", metadata["vocabulary_version"])
 
-    # files that fail lead to django closing them somewhere so I store the content here
-    #  instead of using the BytesIO pointer of the ExtractDataFromUploadedFileTestCase class
-    file_7_invalid_column_count = bytes(
-        "analysis_id,stratum_1,stratum_2,stratum_3,stratum_4,stratum_5,count_value\n"
+    def test_columnar_invalid_values(self):
+        columns = UpdateAchillesResultsDataTestCase.file_metadata["columns"]
+
+        self.assertRaises(
+            InvalidFieldValue,
+            extract_data_from_uploaded_file,
+            _columnar_file(
+                pyarrow.table(
+                    [[0], [None], [None], [None], [None], [None], ["notanumber"]],
+                    names=columns,
+                ),
+                "parquet",
+            ),
+        )
+        self.assertRaises(
+            InvalidFieldValue,
+            extract_data_from_uploaded_file,
+            _columnar_file(
+                pyarrow.table([[0, None], *[[None, None]] * 5, [1, 2]], names=columns),
+                "parquet",
+            ),
+        )
+        self.assertRaises(
+            InvalidFileFormat,
+            extract_data_from_uploaded_file,
+            _columnar_file(
+                pyarrow.table([[0], [1000]], names=["analysis_id", "count_value"]),
+                "arrow",
+            ),
+        )
+
+    def test_compressed_files(self):
+        content = self.file_16.getvalue()
+
+        for compress in (gzip.compress, zstandard.ZstdCompressor().compress):
+            with self.subTest(compress=compress):
+                file_metadata, metadata = extract_data_from_uploaded_file(
+                    io.BytesIO(compress(content))
+                )
+
+                self.assertEqual(16, len(file_metadata["columns"]))
+                self.assertEqual({0, 5000}, file_metadata["analyses"])
+
+    def test_corrupted_compressed_file(self):
+        # truncated in the middle of the compressed stream
+        content = gzip.compress(self.file_16.getvalue())[:-20]
+
+        self.assertRaises(
+            InvalidCSVFile, extract_data_from_uploaded_file, io.BytesIO(content)
+        )
+
+
+@override_settings(UPLOADER_VALIDATION_ENGINE="arrow")
+class ArrowExtractDataFromUploadedFileTestCase(ExtractDataFromUploadedFileTestCase):
+    """
+    Same checks as ExtractDataFromUploadedFileTestCase, but using the arrow validation engine
+    """
+
+    # files that fail are closed by pandas, so the ones of the parent class can't be reused
+    file_7 = io.BytesIO(ExtractDataFromUploadedFileTestCase.file_7.getvalue())
+    file_16 = io.BytesIO(ExtractDataFromUploadedFileTestCase.file_16.getvalue())
+    file_7_invalid_column_count = io.BytesIO(
+        ExtractDataFromUploadedFileTestCase.file_7_invalid_column_count.getvalue()
+    )
+    file_7_invalid_types = io.BytesIO(
+        ExtractDataFromUploadedFileTestCase.file_7_invalid_types.getvalue()
+    )
+    file_7_mandatory_empty = io.BytesIO(
+        ExtractDataFromUploadedFileTestCase.file_7_mandatory_empty.getvalue()
+    )
+    file_7_missing_0 = io.BytesIO(
+        ExtractDataFromUploadedFileTestCase.file_7_missing_0.getvalue()
+    )
+    file_7_duplicated = io.BytesIO(
+        ExtractDataFromUploadedFileTestCase.file_7_duplicated.getvalue()
+    )
+
+    def test_no_fallback_on_valid_file(self):
+        try:
+            columns, _, metadata = _validate_with_arrow(
+                io.BytesIO(self.file_16.getvalue()), None
+            )
+        except pyarrow.ArrowException:
+            self.fail("Valid file validated with the pandas engine")
+
+        self.assertEqual(16, len(columns))
+        self.assertTrue(metadata.found(5000))
+
+
+class UploadResultsFileTestCase(TemporaryMediaRootMixin, TransactionTestCase):
+    databases = "__all__"
+
+    fixtures = ("countries", "two_data_sources")
+
+    # files that fail lead to django closing them somewhere so I store the content here
+    #  instead of using the BytesIO pointer of the ExtractDataFromUploadedFileTestCase class
+    file_7_invalid_column_count = bytes(
+        "analysis_id,stratum_1,stratum_2,stratum_3,stratum_4,stratum_5,count_value\n"
         "0,,,,,,1000\n"
         "1,,,,,,1000,,,,,\n",
         "utf8",
@@ -425,7 +1168,6 @@ class UploadResultsFileTestCase(TransactionTestCase):
         self.assertRaises(
             PendingUpload.DoesNotExist, PendingUpload.objects.get, id=pending_upload_id
         )
-        self.assertEqual(0, caches["workers_locks"].get("celery_workers_updating"))
 
         try:
             UploadHistory.objects.get(pending_upload_id=pending_upload_id)
@@ -434,6 +1176,77 @@ class UploadResultsFileTestCase(TransactionTestCase):
                 "No upload history record with the associated pending upload id created"
             )
 
+    @patch("uploader.tasks.schedule_refresh")
+    def test_refresh_views_of_changed_analyses(self, schedule_refresh):
+        data_source = DataSource.objects.get(acronym="test1")
+
+        with connections["achilles"].cursor() as cursor:
+            for analysis_id in (0, 5000):
+                cursor.execute(
+                    f"CREATE MATERIALIZED VIEW analysis_{analysis_id} AS "
+                    "SELECT count_value FROM achilles_results "
+                    f"WHERE analysis_id = {analysis_id}"
+                )
+
+        try:
+            for count_value in (1001, 2002):
+                upload_results_file.delay(
+                    PendingUpload.objects.create(
+                        data_source=data_source,
+                        uploaded_file=SimpleUploadedFile(
+                            "dummy",
+                            b"analysis_id,stratum_1,stratum_2,stratum_3,stratum_4,stratum_5,count_value\n"
+                            b"0,,3,0,,,1000\n"
+                            b"5000,,1,,2,4," + str(count_value).encode() + b"\n",
+                        ),
+                    ).id
+                )
+        finally:
+            with connections["achilles"].cursor() as cursor:
+                cursor.execute("DROP MATERIALIZED VIEW analysis_0, analysis_5000")
+
+        (first_id, first_names), (second_id, second_names) = (
+            call.args for call in schedule_refresh.call_args_list
+        )
+        self.assertEqual(data_source.id, first_id)
+        self.assertTrue({"analysis_0", "analysis_5000"} <= first_names)
+
+        # only the records of analysis 5000 changed
+        self.assertEqual(data_source.id, second_id)
+        self.assertIn("analysis_5000", second_names)
+        self.assertNotIn("analysis_0", second_names)
+
+    def test_records_without_active_upload(self):
+        data_source = DataSource.objects.get(acronym="test1")
+
+        def upload(count_value):
+            pending_upload = PendingUpload.objects.create(
+                data_source=data_source,
+                uploaded_file=SimpleUploadedFile(
+                    "dummy",
+                    b"analysis_id,stratum_1,stratum_2,stratum_3,stratum_4,stratum_5,count_value\n"
+                    b"0,,3,0,,,1000\n"
+                    b"5000,,1,,2,4," + str(count_value).encode() + b"\n",
+                ),
+            )
+            upload_results_file.delay(pending_upload.id)
+            return UploadHistory.objects.get(pending_upload_id=pending_upload.id)
+
+        first = upload(1001)
+        # records loaded before the active upload of data sources was tracked
+        DataSource.objects.filter(id=data_source.id).update(active_upload=None)
+
+        second = upload(2002)
+
+        # the previous records are archived with the upload they came from
+        self.assertEqual(
+            2, AchillesResultsArchive.objects.filter(upload_info=first).count()
+        )
+        self.assertFalse(
+            AchillesResultsArchive.objects.filter(upload_info=second).exists()
+        )
+        self.assertEqual([5000], second.changed_analyses)
+
     def test_invalid_file_due_to_checksum(self):
         ExtractDataFromUploadedFileTestCase.file_7.seek(0)
 
@@ -512,3 +1325,797 @@ class UploadResultsFileTestCase(TransactionTestCase):
             self.fail(
                 "No upload history record with the associated pending upload id created"
             )
+
+    def test_compressed_file(self):
+        ExtractDataFromUploadedFileTestCase.file_7.seek(0)
+        content = ExtractDataFromUploadedFileTestCase.file_7.read()
+        compressed = gzip.compress(content)
+
+        pending_upload = PendingUpload.objects.create(
+            data_source=DataSource.objects.get(acronym="test1"),
+            uploaded_file=SimpleUploadedFile("results.csv.gz", compressed),
+        )
+        upload_results_file.delay(pending_upload.id)
+
+        upload_history = UploadHistory.objects.get(pending_upload_id=pending_upload.id)
+        # the file is stored compressed
+        self.assertEqual(content, gzip.decompress(upload_history.uploaded_file.read()))
+        self.assertEqual(
+            2, AchillesResults.objects.filter(data_source__acronym="test1").count()
+        )
+
+        # the digest is of the stored bytes, which is also the name of the stored file
+        self.assertEqual(
+            hashlib.sha256(compressed).hexdigest(),
+            upload_history.content_hash,
+        )
+        self.assertEqual(
+            content_address(upload_history.content_hash),
+            upload_history.uploaded_file.name,
+        )
+
+    def test_invalid_file_due_to_checksum_of_older_upload(self):
+        ExtractDataFromUploadedFileTestCase.file_7.seek(0)
+        file_7 = ExtractDataFromUploadedFileTestCase.file_7.read()
+        other_file = bytes(
+            "analysis_id,stratum_1,stratum_2,stratum_3,stratum_4,stratum_5,count_value\n"
+            "0,,5,0,,,2000\n"
+            "5000,,1,,2,4,1001\n",
+            "utf8",
+        )
+
+        for content in (file_7, other_file):
+            pending_upload = PendingUpload.objects.create(
+                data_source=DataSource.objects.get(acronym="test1"),
+                uploaded_file=SimpleUploadedFile("dummy", content),
+            )
+            upload_results_file.delay(pending_upload.id)
+
+        self.assertEqual(
+            2,
+            UploadHistory.objects.filter(
+                data_source__acronym="test1", content_hash__isnull=False
+            ).count(),
+        )
+
+        # the file is equal to the one uploaded before the latest upload
+        new_pending_upload = PendingUpload.objects.create(
+            data_source=DataSource.objects.get(acronym="test1"),
+            uploaded_file=SimpleUploadedFile("dummy", file_7),
+        )
+
+        try:
+            upload_results_file.delay(new_pending_upload.id)
+        except EqualFileAlreadyUploaded:
+            pass
+
+        self.assertEqual(
+            PendingUpload.objects.get(id=new_pending_upload.id).status,
+            PendingUpload.STATE_FAILED,
+        )
+
+
+class UploadDataToTmpTableTestCase(TemporaryMediaRootMixin, TransactionTestCase):
+    databases = "__all__"
+
+    fixtures = ("countries", "two_data_sources")
+
+    def setUp(self):
+        super().setUp()
+        with connections["achilles"].cursor() as cursor:
+            cursor.execute(
+                "CREATE MATERIALIZED VIEW stratum_1_numeric AS "
+                "SELECT CAST(stratum_1 AS INTEGER) AS value FROM achilles_results "
+                "WHERE analysis_id = 101"
+            )
+
+    def tearDown(self):
+        with connections["achilles"].cursor() as cursor:
+            cursor.execute("DROP MATERIALIZED VIEW stratum_1_numeric")
+        super().tearDown()
+
+    def _upload_data_to_tmp_table(self, content):
+        pending_upload = PendingUpload.objects.create(
+            data_source=DataSource.objects.get(acronym="test1"),
+            uploaded_file=SimpleUploadedFile("dummy", content),
+        )
+
+        file_metadata, _ = extract_data_from_uploaded_file(pending_upload.uploaded_file)
+        try:
+            upload_data_to_tmp_table(
+                pending_upload.data_source_id, file_metadata, pending_upload
+            )
+        finally:
+            self.assertNotIn(
+                f"achilles_results_tmp_{pending_upload.id}",
+                connections["achilles"].introspection.table_names(),
+            )
+
+    def test_valid_data(self):
+        try:
+            self._upload_data_to_tmp_table(
+                b"analysis_id,stratum_1,stratum_2,stratum_3,stratum_4,stratum_5,count_value\n"
+                b"0,,,,,,1\n"
+                b"101,10,,,,,1\n"
+            )
+        except FileDataCorrupted:
+            self.fail("Valid data considered corrupted")
+
+    def test_corrupted_data(self):
+        self.assertRaises(
+            FileDataCorrupted,
+            self._upload_data_to_tmp_table,
+            b"analysis_id,stratum_1,stratum_2,stratum_3,stratum_4,stratum_5,count_value\n"
+            b"0,,,,,,1\n"
+            b"101,notanumber,,,,,1\n",
+        )
+
+    def test_failed_query(self):
+        MaintainedQuery.objects.create(
+            name="missing_column", definition="SELECT missing FROM achilles_results"
+        )
+
+        with self.assertRaises(FileChecksException) as context:
+            self._upload_data_to_tmp_table(
+                b"analysis_id,stratum_1,stratum_2,stratum_3,stratum_4,stratum_5,count_value\n"
+                b"0,,,,,,1\n"
+                b"101,10,,,,,1\n"
+            )
+        self.assertNotIsInstance(context.exception, FileDataCorrupted)
+
+    @override_settings(UPLOADER_VALIDATION_CONNECTIONS=2)
+    def test_cancel_running_queries(self):
+        MaintainedQuery.objects.create(
+            name="slow", definition="SELECT pg_sleep(60) FROM achilles_results"
+        )
+        MaintainedQuery.objects.create(
+            name="fails_later",
+            definition="SELECT count_value / 0 FROM achilles_results "
+            "WHERE pg_sleep(1) IS NOT NULL",
+        )
+
+        start = time.perf_counter()
+        self.assertRaises(
+            FileDataCorrupted,
+            self._upload_data_to_tmp_table,
+            b"analysis_id,stratum_1,stratum_2,stratum_3,stratum_4,stratum_5,count_value\n"
+            b"0,,,,,,1\n",
+        )
+        self.assertLess(time.perf_counter() - start, 30)
+
+    def test_skip_views_of_missing_analyses(self):
+        try:
+            self._upload_data_to_tmp_table(
+                b"analysis_id,stratum_1,stratum_2,stratum_3,stratum_4,stratum_5,count_value\n"
+                b"0,,,,,,1\n"
+                b"102,notanumber,,,,,1\n"
+            )
+        except FileDataCorrupted:
+            self.fail("Query of a view of an analysis not present on the file executed")
+
+    def testreferenced_analyses(self):
+        self.assertEqual(
+            {1, 2, 5},
+            referenced_analyses(
+                "SELECT count_value FROM achilles_results "
+                "WHERE ((achilles_results.analysis_id = ANY (ARRAY[(1)::bigint, (2)::bigint])) "
+                "OR (achilles_results.analysis_id = 5))"
+            ),
+        )
+        self.assertIsNone(
+            referenced_analyses(
+                "SELECT count_value FROM achilles_results WHERE (analysis_id > 5)"
+            )
+        )
+        self.assertIsNone(
+            referenced_analyses("SELECT count_value FROM achilles_results")
+        )
+        # results data selected without filter on another statement
+        self.assertIsNone(
+            referenced_analyses(
+                "SELECT count_value FROM achilles_results WHERE (analysis_id = 5) "
+                "UNION ALL SELECT count_value FROM achilles_results"
+            )
+        )
+        self.assertIsNone(
+            referenced_analyses(
+                "SELECT count_value, (SELECT max(count_value) FROM achilles_results) "
+                "FROM achilles_results WHERE (analysis_id = 5)"
+            )
+        )
+        self.assertEqual(
+            {5, 6},
+            referenced_analyses(
+                "SELECT a.count_value FROM achilles_results a "
+                "JOIN achilles_results b ON (a.stratum_1 = b.stratum_1) "
+                "WHERE ((a.analysis_id = 5) AND (b.analysis_id = 6))"
+            ),
+        )
+
+
+@patch("uploader.views.refresh_materialized_views_task")
+class DataSourceChangeRefreshTestCase(TransactionTestCase):
+    databases = "__all__"
+
+    fixtures = ("countries", "two_data_sources")
+
+    views = {
+        "public_sources": "SELECT acronym FROM data_source WHERE draft = false",
+        "source_links": "SELECT link FROM data_source",
+        "from_source_links": "SELECT count(*) FROM source_links",
+        "results_count": "SELECT count(*) FROM achilles_results",
+    }
+
+    def setUp(self):
+        with connections["achilles"].cursor() as cursor:
+            for name, definition in self.views.items():
+                cursor.execute(f"CREATE MATERIALIZED VIEW {name} AS {definition}")
+
+    def tearDown(self):
+        with connections["achilles"].cursor() as cursor:
+            for name in reversed(list(self.views)):
+                cursor.execute(f"DROP MATERIALIZED VIEW {name}")
+
+    def _patch(self, data):
+        response = self.client.patch(
+            "/uploader/api/test1/", data, content_type="application/json"
+        )
+        self.assertEqual(200, response.status_code)
+
+    def test_refresh_affected_views(self, refresh_task):
+        self._patch({"draft": False})
+        refresh_task.delay.assert_called_once_with(["public_sources"], db_ids=[1])
+
+    def test_refresh_dependent_views(self, refresh_task):
+        self._patch({"link": "https://example.com"})
+        refresh_task.delay.assert_called_once_with(
+            ["from_source_links", "source_links"], db_ids=[1]
+        )
+
+    def test_nothing_changed(self, refresh_task):
+        self._patch({"draft": True, "link": ""})
+        refresh_task.delay.assert_not_called()
+
+    def _edit(self, **changes):
+        data_source = DataSource.objects.get(hash="test1")
+        response = self.client.post(
+            "/uploader/test1/edit/",
+            {
+                "name": data_source.name,
+                "country": data_source.country_id,
+                "link": data_source.link,
+                "database_type": data_source.database_type,
+                "coordinates_0": data_source.latitude,
+                "coordinates_1": data_source.longitude,
+                **changes,
+            },
+        )
+        self.assertEqual(302, response.status_code)
+
+    def test_edit_form(self, refresh_task):
+        # no view uses the name of the data sources
+        self._edit(name="renamed")
+        refresh_task.delay.assert_not_called()
+
+        self._edit(link="https://example.com")
+        refresh_task.delay.assert_called_once_with(
+            ["from_source_links", "source_links"], db_ids=[1]
+        )
+
+
+@patch("uploader.storage.GC_GRACE_PERIOD", 0)
+class ContentAddressedStorageTestCase(TemporaryMediaRootMixin, TransactionTestCase):
+    databases = "__all__"
+
+    fixtures = ("countries", "two_data_sources")
+
+    content = (
+        b"analysis_id,stratum_1,stratum_2,stratum_3,stratum_4,stratum_5,count_value\n"
+        b"0,,3,0,,,1000\n"
+        b"5000,,1,,2,4,1001\n"
+    )
+
+    def _pending_upload(self, acronym, content=None):
+        return PendingUpload.objects.create(
+            data_source=DataSource.objects.get(acronym=acronym),
+            uploaded_file=SimpleUploadedFile("results.csv", content or self.content),
+        )
+
+    def test_identical_files_stored_once(self):
+        pending_uploads = [
+            self._pending_upload("test1"),
+            self._pending_upload("test1"),
+            self._pending_upload("test2"),
+        ]
+
+        name = content_address(hashlib.sha256(self.content).hexdigest())
+        for pending_upload in pending_uploads:
+            self.assertEqual(name, pending_upload.uploaded_file.name)
+        self.assertEqual(
+            self.content, pending_uploads[0].uploaded_file.storage.open(name).read()
+        )
+
+    def test_collect_once_unreferenced(self):
+        first, second = self._pending_upload("test1"), self._pending_upload("test2")
+        storage, name = first.uploaded_file.storage, first.uploaded_file.name
+
+        first.delete()
+        self.assertTrue(storage.exists(name))
+
+        second.delete()
+        self.assertFalse(storage.exists(name))
+
+    def test_reuse_protects_from_sweep(self):
+        name = results_files_storage.save("orphan", ContentFile(self.content))
+        path = results_files_storage.path(name)
+        os.utime(path, (0, 0))
+
+        # stored again, e.g. by an upload whose record isn't inserted yet
+        self.assertEqual(
+            name, results_files_storage.save("orphan", ContentFile(self.content))
+        )
+
+        with patch("uploader.storage.GC_GRACE_PERIOD", 60):
+            self.assertEqual([], sweep())
+            self.assertFalse(collect(name))
+        self.assertTrue(os.path.exists(path))
+
+    def test_successful_upload_shares_file(self):
+        pending_upload = self._pending_upload("test1")
+        name = pending_upload.uploaded_file.name
+
+        upload_results_file.delay(pending_upload.id)
+
+        upload_history = UploadHistory.objects.get(pending_upload_id=pending_upload.id)
+        self.assertEqual(name, upload_history.uploaded_file.name)
+        self.assertTrue(upload_history.uploaded_file.storage.exists(name))
+
+        # deleting the data source deletes its last reference
+        DataSource.objects.get(acronym="test1").delete()
+        self.assertFalse(upload_history.uploaded_file.storage.exists(name))
+
+
+class ResumableUploadTestCase(TemporaryMediaRootMixin, TransactionTestCase):
+    databases = "__all__"
+
+    fixtures = ("countries", "two_data_sources")
+
+    content = (
+        b"analysis_id,stratum_1,stratum_2,stratum_3,stratum_4,stratum_5,count_value\n"
+        b"0,,3,0,,,1000\n"
+        b"5000,,1,,2,4,1001\n"
+    )
+
+    def _start(self, url, **data):
+        response = self.client.post(
+            url,
+            {"file_name": "results.csv", "size": len(self.content), **data},
+            content_type="application/json",
+        )
+        self.assertEqual(201, response.status_code)
+        return f"{url}{response.json()['id']}/"
+
+    def _put(self, url, start, end):
+        return self.client.put(
+            url,
+            self.content[start : end + 1],
+            content_type="application/octet-stream",
+            HTTP_CONTENT_RANGE=f"bytes {start}-{end}/{len(self.content)}",
+        )
+
+    def _upload(self, url):
+        half = len(self.content) // 2
+
+        response = self._put(url, 0, half - 1)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(half, response.json()["offset"])
+        self.assertNotIn("pending_upload", response.json())
+
+        # a chunk that was already received
+        response = self._put(url, 0, half - 1)
+        self.assertEqual(409, response.status_code)
+        self.assertEqual(half, response.json()["offset"])
+
+        self.assertEqual(half, self.client.get(url).json()["offset"])
+
+        response = self._put(url, half, len(self.content) - 1)
+        self.assertEqual(200, response.status_code)
+        return response.json()["pending_upload"]
+
+    def test_upload_page(self):
+        url = self._start("/uploader/test1/uploads/")
+        pending_upload_id = self._upload(url)
+
+        # the file was processed
+        upload = UploadHistory.objects.get(pending_upload_id=pending_upload_id)
+        self.assertEqual("test1", upload.data_source.hash)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual(404, self.client.get(url).status_code)
+
+    @override_settings(
+        SINGLE_APPLICATION_MODE=False,
+        MAIN_APPLICATION_HOST="mainapp.host.com",
+        ALLOWED_HOSTS=["thisapp.host.com", "mainapp.host.com"],
+    )
+    def test_block_if_wrong_host(self):
+        response = self.client.post(
+            "/uploader/test1/uploads/",
+            {"file_name": "results.csv", "size": len(self.content)},
+            content_type="application/json",
+            HTTP_HOST="thisapp.host.com",
+        )
+        self.assertEqual(403, response.status_code)
+        self.assertFalse(UploadSession.objects.exists())
+
+        response = self.client.post(
+            "/uploader/test1/uploads/",
+            {"file_name": "results.csv", "size": len(self.content)},
+            content_type="application/json",
+            HTTP_HOST="mainapp.host.com",
+        )
+        self.assertEqual(201, response.status_code)
+
+        url = f"/uploader/test1/uploads/{response.json()['id']}/"
+        self.assertEqual(
+            403, self.client.get(url, HTTP_HOST="thisapp.host.com").status_code
+        )
+        self.assertEqual(
+            403,
+            self.client.put(
+                url,
+                self.content,
+                content_type="application/octet-stream",
+                HTTP_CONTENT_RANGE=f"bytes 0-{len(self.content) - 1}/{len(self.content)}",
+                HTTP_HOST="thisapp.host.com",
+            ).status_code,
+        )
+
+    def test_invalid_range(self):
+        url = self._start("/uploader/test1/uploads/")
+
+        response = self.client.put(
+            url,
+            self.content,
+            content_type="application/octet-stream",
+            HTTP_CONTENT_RANGE=f"bytes 0-{len(self.content) - 1}/{len(self.content) + 1}",
+        )
+        self.assertEqual(400, response.status_code)
+
+        # fewer bytes than declared
+        response = self.client.put(
+            url,
+            self.content[:10],
+            content_type="application/octet-stream",
+            HTTP_CONTENT_RANGE=f"bytes 0-19/{len(self.content)}",
+        )
+        self.assertEqual(400, response.status_code)
+        self.assertEqual(0, self.client.get(url).json()["offset"])
+
+    def test_failed_completion(self):
+        url = self._start("/uploader/test1/uploads/")
+        half = len(self.content) // 2
+        self.assertEqual(200, self._put(url, 0, half - 1).status_code)
+
+        with patch(
+            "uploader.resumable.PendingUpload.objects.create", side_effect=OSError
+        ), self.assertRaises(OSError):
+            self._put(url, half, len(self.content) - 1)
+
+        # the last chunk can be sent again
+        self.assertEqual(half, self.client.get(url).json()["offset"])
+        response = self._put(url, half, len(self.content) - 1)
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(
+            UploadHistory.objects.filter(
+                pending_upload_id=response.json()["pending_upload"]
+            ).exists()
+        )
+
+    def test_expired_sessions(self):
+        expired = UploadSession.objects.get(
+            id=self._start("/uploader/test1/uploads/").split("/")[-2]
+        )
+        self.assertEqual(
+            200, self._put(f"/uploader/test1/uploads/{expired.id}/", 0, 9).status_code
+        )
+        recent = UploadSession.objects.get(
+            id=self._start("/uploader/test2/uploads/").split("/")[-2]
+        )
+
+        UploadSession.objects.filter(id=expired.id).update(
+            updated_date=timezone.now()
+            - datetime.timedelta(
+                days=settings.UPLOADER_RESUMABLE_SESSION_EXPIRY_DAYS + 1
+            )
+        )
+        self.assertEqual(1, expire_sessions())
+
+        self.assertEqual([recent], list(UploadSession.objects.all()))
+        self.assertFalse(os.path.exists(expired.path))
+
+    def test_token_api(self):
+        self.assertEqual(
+            401,
+            self.client.post(
+                "/uploader/api/uploads/", {}, content_type="application/json"
+            ).status_code,
+        )
+
+        self._authenticate(self._uploader("uploader"))
+
+        url = self._start("/uploader/api/uploads/", data_source="test2")
+        pending_upload_id = self._upload(url)
+
+        upload = UploadHistory.objects.get(pending_upload_id=pending_upload_id)
+        self.assertEqual("test2", upload.data_source.hash)
+
+    @staticmethod
+    def _uploader(username):
+        user = User.objects.create(username=username)
+        user.user_permissions.add(Permission.objects.get(codename="add_uploadsession"))
+        return user
+
+    def _authenticate(self, user):
+        token = Token.objects.create(user=user)
+        self.client.defaults["HTTP_AUTHORIZATION"] = f"Token {token.key}"
+
+    def test_token_api_other_user(self):
+        self._authenticate(self._uploader("uploader"))
+        url = self._start("/uploader/api/uploads/", data_source="test2")
+
+        # can't continue the uploads of other users
+        self._authenticate(self._uploader("other"))
+        self.assertEqual(404, self.client.get(url).status_code)
+        self.assertEqual(404, self._put(url, 0, 9).status_code)
+
+        # nor upload files without permission
+        self._authenticate(User.objects.create(username="no permission"))
+        self.assertEqual(404, self.client.get(url).status_code)
+        response = self.client.post(
+            "/uploader/api/uploads/",
+            {
+                "file_name": "results.csv",
+                "size": len(self.content),
+                "data_source": "test2",
+            },
+            content_type="application/json",
+        )
+        self.assertEqual(400, response.status_code)
+        self.assertIn("data_source", response.json())
+
+        self.assertEqual(0, UploadSession.objects.get().offset)
+
+
+class ArchiveRetentionTestCase(TemporaryMediaRootMixin, TransactionTestCase):
+    databases = "__all__"
+
+    fixtures = ("countries", "two_data_sources")
+
+    def _upload(self, acronym, count_value):
+        pending_upload = PendingUpload.objects.create(
+            data_source=DataSource.objects.get(acronym=acronym),
+            uploaded_file=SimpleUploadedFile(
+                "results.csv",
+                b"analysis_id,stratum_1,stratum_2,stratum_3,stratum_4,stratum_5,count_value,"
+                b"min_value,max_value,avg_value,stdev_value,median_value,p10_value,p25_value,"
+                b"p75_value,p90_value\n"
+                b"0,,3,0,,,1000,,,,,,,,,\n"
+                + f'5000,,"a,b",,2,4,{count_value},1.5,,,,,,,,\n'.encode(),
+            ),
+        )
+        upload_results_file.delay(pending_upload.id)
+
+        return UploadHistory.objects.get(pending_upload_id=pending_upload.id)
+
+    def _archived(self, upload_history):
+        return list(
+            AchillesResultsArchive.objects.filter(upload_info=upload_history)
+            .order_by("analysis_id")
+            .values_list("analysis_id", "stratum_2", "count_value", "min_value")
+        )
+
+    def test_keep_last_uploads(self):
+        DataSource.objects.filter(acronym="test1").update(archive_keep_uploads=2)
+
+        first = self._upload("test1", 1)
+        second = self._upload("test1", 2)
+        first_records = self._archived(first)
+        self.assertEqual(2, len(first_records))
+
+        third = self._upload("test1", 3)
+        self._upload("test2", 1)
+        self._upload("test2", 2)
+
+        first.refresh_from_db()
+        self.assertTrue(first.archive_file)
+        self.assertEqual([], self._archived(first))
+        self.assertEqual(2, len(self._archived(second)))
+        self.assertFalse(UploadHistory.objects.get(id=second.id).archive_file)
+        self.assertFalse(UploadHistory.objects.get(id=third.id).archive_file)
+
+        # other data sources use the default policy, which keeps everything
+        self.assertEqual(
+            2,
+            AchillesResultsArchive.objects.filter(data_source__acronym="test2").count(),
+        )
+
+        self.assertEqual(
+            2, pyarrow.parquet.read_table(first.archive_file.path).num_rows
+        )
+
+        # rehydrated records are equal to the exported ones
+        call_command("rehydrate_upload", first.id, stdout=io.StringIO())
+        self.assertEqual(first_records, self._archived(first))
+
+        # and are removed again once the retention policy is applied
+        call_command("apply_archive_retention", "test1", stdout=io.StringIO())
+        self.assertEqual([], self._archived(first))
+
+        path = first.archive_file.path
+        first.delete()
+        self.assertFalse(os.path.exists(path))
+
+    @override_settings(UPLOADER_ARCHIVE_KEEP_DAYS=0)
+    def test_keep_days(self):
+        first = self._upload("test1", 1)
+        second = self._upload("test1", 2)
+
+        self.assertEqual([], self._archived(first))
+        self.assertFalse(UploadHistory.objects.get(id=second.id).archive_file)
+
+        # the data source policy has precedence over the default one
+        DataSource.objects.filter(acronym="test1").update(archive_keep_uploads=3)
+        self._upload("test1", 3)
+        self.assertEqual(2, len(self._archived(second)))
+
+    def test_versioned(self):
+        call_command("version_achilles_results", stdout=io.StringIO())
+        try:
+            DataSource.objects.filter(acronym="test1").update(archive_keep_uploads=1)
+
+            first = self._upload("test1", 1)
+            second = self._upload("test1", 2)
+
+            self.assertEqual([], self._archived(first))
+            self.assertEqual(2, AchillesResults.objects.count())
+
+            call_command("rehydrate_upload", first.id, stdout=io.StringIO())
+            self.assertEqual(2, len(self._archived(first)))
+            self.assertEqual(
+                [second.id],
+                list(
+                    AchillesResults.objects.values_list(
+                        "data_source__active_upload", flat=True
+                    ).distinct()
+                ),
+            )
+        finally:
+            call_command("version_achilles_results", undo=True, stdout=io.StringIO())
+
+
+@patch("uploader.storage.GC_GRACE_PERIOD", 0)
+class DeleteDataSourceTestCase(TemporaryMediaRootMixin, TransactionTestCase):
+    databases = "__all__"
+
+    fixtures = ("countries", "two_data_sources")
+
+    def _upload(self, acronym, count_value):
+        pending_upload = PendingUpload.objects.create(
+            data_source=DataSource.objects.get(acronym=acronym),
+            uploaded_file=SimpleUploadedFile(
+                "results.csv",
+                b"analysis_id,stratum_1,stratum_2,stratum_3,stratum_4,stratum_5,count_value\n"
+                b"0,,3,0,,,1000\n" + f"5000,,1,,2,4,{count_value}\n".encode(),
+            ),
+        )
+        upload_results_file.delay(pending_upload.id)
+
+        return UploadHistory.objects.get(pending_upload_id=pending_upload.id)
+
+    def _delete_and_check(self):
+        test1 = DataSource.objects.get(acronym="test1")
+        uploads = [self._upload("test1", 1), self._upload("test1", 2)]
+        kept = self._upload("test2", 3)
+
+        session = UploadSession.objects.create(
+            data_source=test1, file_name="results.csv", size=10
+        )
+        os.makedirs(os.path.dirname(session.path))
+        with open(session.path, "wb") as file:
+            file.write(b"analysis")
+
+        delete_datasource.delay(serializers.serialize("json", [test1]))
+
+        self.assertFalse(DataSource.objects.filter(acronym="test1").exists())
+        for model in (
+            AchillesResults,
+            AchillesResultsArchive,
+            PendingUpload,
+            UploadHistory,
+            UploadSession,
+        ):
+            self.assertFalse(model.objects.filter(data_source=test1.id).exists())
+
+        self.assertEqual(
+            2, AchillesResults.objects.filter(data_source=kept.data_source).count()
+        )
+
+        # the stored files of the deleted data source are swept
+        for upload in uploads:
+            self.assertFalse(os.path.exists(upload.uploaded_file.path))
+        self.assertFalse(os.path.exists(session.path))
+        self.assertTrue(os.path.exists(kept.uploaded_file.path))
+
+    def test_delete(self):
+        self._delete_and_check()
+
+    def test_delete_partitioned(self):
+        call_command("partition_achilles_results", stdout=io.StringIO())
+        call_command("partition_achilles_results", archive=True, stdout=io.StringIO())
+        try:
+            self._delete_and_check()
+
+            with connections["achilles"].cursor() as cursor:
+                cursor.execute(
+                    "SELECT count(*) FROM pg_inherits WHERE inhparent IN "
+                    "('achilles_results'::regclass, 'achilles_results_archive'::regclass)"
+                )
+                # partition of test2. Its only upload has no archived records
+                self.assertEqual(1, cursor.fetchone()[0])
+        finally:
+            call_command("partition_achilles_results", undo=True, stdout=io.StringIO())
+            call_command(
+                "partition_achilles_results",
+                archive=True,
+                undo=True,
+                stdout=io.StringIO(),
+            )
+
+    def test_delete_versioned(self):
+        call_command("version_achilles_results", stdout=io.StringIO())
+        try:
+            self._delete_and_check()
+        finally:
+            call_command("version_achilles_results", undo=True, stdout=io.StringIO())
+
+    def test_sweep(self):
+        name = results_files_storage.save("orphan", ContentFile(b"orphan"))
+        spill_path = results_files_storage.path(f"{name}.1.arrow")
+        with open(spill_path, "wb") as file:
+            file.write(b"spill")
+
+        with patch("uploader.storage.GC_GRACE_PERIOD", 60):
+            call_command("sweep_results_files", stdout=io.StringIO())
+        self.assertTrue(results_files_storage.exists(name))
+
+        call_command("sweep_results_files", stdout=io.StringIO())
+        self.assertFalse(results_files_storage.exists(name))
+        self.assertTrue(os.path.exists(spill_path))
+
+        # left behind by a worker that was killed
+        modified = time.time() - SPILL_FILE_MAX_AGE - 1
+        os.utime(spill_path, (modified, modified))
+        call_command("sweep_results_files", stdout=io.StringIO())
+        self.assertFalse(os.path.exists(spill_path))
+
+    def test_sweep_races(self):
+        # a file stored on the directory after it was listed
+        results_files_storage.save("orphan", ContentFile(b"orphan"))
+        with patch("uploader.storage.os.rmdir", side_effect=OSError):
+            sweep()
+
+        # the directory removed after it was created for a new file
+        makedirs = os.makedirs
+        calls = []
+
+        def removed_makedirs(*args, **kwargs):
+            calls.append(args)
+            if len(calls) > 1:
+                makedirs(*args, **kwargs)
+
+        with patch(
+            "django.core.files.storage.os.makedirs", side_effect=removed_makedirs
+        ):
+            name = results_files_storage.save("new", ContentFile(b"new"))
+        self.assertTrue(results_files_storage.exists(name))
+        self.assertEqual(2, len(calls))
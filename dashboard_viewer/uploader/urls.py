@@ -4,6 +4,8 @@ from rest_framework.routers import DefaultRouter
 from . import views
 
 router = DefaultRouter()
+# registered first, since the data source routes would also match its urls
+router.register("uploads", views.ResumableUploadAPI, basename="ResumableUpload")
 router.register("", views.DataSourceUpdate, basename="DataSource")
 
 urlpatterns = [
@@ -14,6 +16,16 @@ urlpatterns = [
         name="upload_achilles_results",
     ),
     path("<str:data_source>/edit/", views.edit_data_source, name="edit_data_source"),
+    path(
+        "<str:data_source>/uploads/",
+        views.ResumableUpload.as_view({"post": "create"}),
+        name="resumable_upload",
+    ),
+    path(
+        "<str:data_source>/uploads/<uuid:pk>/",
+        views.ResumableUpload.as_view({"get": "retrieve", "put": "update"}),
+        name="resumable_upload_chunk",
+    ),
     path(
         "<str:data_source>/upload/<int:upload_id>/status/", views.get_upload_task_status
     ),
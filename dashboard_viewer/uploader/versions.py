@@ -0,0 +1,227 @@
+from django.core.management.base import CommandError
+from django.db import connections, router
+
+from . import partitions
+from .models import (
+    AchillesResults,
+    AchillesResultsArchive,
+    DataSource,
+    UploadHistory,
+)
+
+VERSIONS_TABLE = "achilles_results_versions"
+
+
+def _columns(model):
+    return [field.column for field in model._meta.concrete_fields]
+
+
+def _active_condition(alias):
+    return (
+        f"({alias}.data_source_id, {alias}.upload_info_id) IN "
+        f"(SELECT id, active_upload_id FROM {DataSource._meta.db_table})"
+    )
+
+
+def is_versioned(cursor):
+    """
+    Checks if the achilles_results table was replaced by a view over the records
+     of all uploads, as done by the version_table function
+
+    :param cursor: cursor of a connection to the achilles database
+    """
+    cursor.execute(
+        "SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)",
+        (AchillesResults._meta.db_table,),
+    )
+    row = cursor.fetchone()
+    return row is not None and row[0] == "v"
+
+
+def set_active_uploads(cursor):
+    """
+    Points each data source without an active upload to its latest upload.
+     A data source that has results data but no uploads gets an empty upload record,
+     so its records can be associated with one.
+
+    :param cursor: cursor of a connection to the achilles database
+    """
+    data_source = DataSource._meta.db_table
+    upload_history = UploadHistory._meta.db_table
+
+    cursor.execute(
+        f"""
+        INSERT INTO {upload_history} (data_source_id, upload_date)
+        SELECT id, now()
+        FROM {data_source}
+        WHERE active_upload_id IS NULL
+            AND NOT EXISTS (
+                SELECT 1 FROM {upload_history} WHERE data_source_id = {data_source}.id
+            )
+            AND EXISTS (
+                SELECT 1 FROM {AchillesResults._meta.db_table}
+                WHERE data_source_id = {data_source}.id
+            )
+        """
+    )
+    cursor.execute(
+        f"""
+        UPDATE {data_source}
+        SET active_upload_id = (
+            SELECT id FROM {upload_history}
+            WHERE data_source_id = {data_source}.id
+            ORDER BY upload_date DESC
+            LIMIT 1
+        )
+        WHERE active_upload_id IS NULL
+        """
+    )
+
+
+def _create_views(cursor):
+    results = AchillesResults._meta.db_table
+    archive = AchillesResultsArchive._meta.db_table
+
+    cursor.execute(
+        f"CREATE VIEW {results} AS "
+        f"SELECT {', '.join(_columns(AchillesResults))} "
+        f"FROM {VERSIONS_TABLE} AS version "
+        f"WHERE {_active_condition('version')}"
+    )
+    cursor.execute(
+        f"CREATE VIEW {archive} AS "
+        f"SELECT {', '.join(_columns(AchillesResultsArchive))} "
+        f"FROM {VERSIONS_TABLE} AS version "
+        "WHERE NOT EXISTS ("
+        f"SELECT 1 FROM {DataSource._meta.db_table} AS data_source "
+        "WHERE data_source.id = version.data_source_id "
+        "AND data_source.active_upload_id = version.upload_info_id"
+        ")"
+    )
+
+    # both views are simple enough to be updatable, so the records can still be
+    #  deleted through the django models
+    cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", (VERSIONS_TABLE,))
+    sequence = cursor.fetchone()[0]
+    for view in (results, archive):
+        cursor.execute(
+            f"ALTER VIEW {view} ALTER COLUMN id SET DEFAULT nextval('{sequence}')"
+        )
+
+
+def version_table(schema_editor):
+    """
+    Stores the records of all uploads on a single table, where each record is associated with
+     the upload it came from. The achilles_results and achilles_results_archive tables are
+     replaced by views over it, that select the records of the active upload of each
+     data source or the remaining ones, respectively. A new upload is then loaded
+     next to the previous ones and archiving the old records only requires changing the
+     active upload of the data source. Should run inside a transaction.
+
+    :param schema_editor: django schema editor of the achilles database
+    """
+    results = AchillesResults._meta.db_table
+    archive = AchillesResultsArchive._meta.db_table
+
+    with schema_editor.connection.cursor() as cursor:
+        if partitions.is_partitioned(cursor):
+            raise ValueError(
+                f"The {results} table is partitioned and can't also be versioned"
+            )
+        if partitions.is_archive_partitioned(cursor):
+            raise ValueError(
+                f"The {archive} table is partitioned and can't also be versioned"
+            )
+
+        # the tables are altered after records are inserted, which is not allowed
+        #  while there are deferred foreign key checks to run
+        cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+
+        set_active_uploads(cursor)
+
+        views = partitions._drop_materialized_views(cursor)
+
+        # the records already archived stay where they are
+        cursor.execute(f"ALTER TABLE {archive} RENAME TO {VERSIONS_TABLE}")
+
+        columns = [column for column in _columns(AchillesResults) if column != "id"]
+        cursor.execute(
+            f"INSERT INTO {VERSIONS_TABLE} ({', '.join(columns)}, upload_info_id) "
+            f"SELECT {', '.join(f'results.{column}' for column in columns)}, "
+            "data_source.active_upload_id "
+            f"FROM {results} AS results "
+            f"JOIN {DataSource._meta.db_table} AS data_source "
+            "ON data_source.id = results.data_source_id"
+        )
+        cursor.execute(f"DROP TABLE {results}")
+        cursor.execute(
+            f"CREATE INDEX {VERSIONS_TABLE}_active_idx "
+            f"ON {VERSIONS_TABLE} (data_source_id, upload_info_id)"
+        )
+
+        _create_views(cursor)
+
+        partitions._create_materialized_views(cursor, views)
+
+
+def unversion_table(schema_editor):
+    """
+    Reverts what the version_table function did, moving the records of the active upload
+     of each data source back to a regular achilles_results table.
+     Should run inside a transaction.
+
+    :param schema_editor: django schema editor of the achilles database
+    """
+    results = AchillesResults._meta.db_table
+    archive = AchillesResultsArchive._meta.db_table
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+
+        views = partitions._drop_materialized_views(cursor)
+
+        cursor.execute(f"DROP VIEW {results}")
+        cursor.execute(f"DROP VIEW {archive}")
+
+    # indexes and foreign keys are only created once the schema editor exits
+    schema_editor.create_model(AchillesResults)
+
+    with schema_editor.connection.cursor() as cursor:
+        columns = ", ".join(_columns(AchillesResults))
+        cursor.execute(
+            f"INSERT INTO {results} ({columns}) "
+            f"SELECT {columns} FROM {VERSIONS_TABLE} AS version "
+            f"WHERE {_active_condition('version')}"
+        )
+        cursor.execute(
+            f"DELETE FROM {VERSIONS_TABLE} AS version "
+            f"WHERE {_active_condition('version')}"
+        )
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence('{results}', 'id'), "
+            f"coalesce(max(id), 1), max(id) IS NOT NULL) FROM {results}"
+        )
+
+        cursor.execute(f"DROP INDEX {VERSIONS_TABLE}_active_idx")
+        cursor.execute(f"ALTER TABLE {VERSIONS_TABLE} RENAME TO {archive}")
+
+        partitions._create_materialized_views(cursor, views)
+
+
+def refuse_versioned_migrations(sender, using, plan=None, **_):
+    """
+    pre_migrate receiver of the uploader app. Its migrations expect the achilles_results and
+     achilles_results_archive tables to be regular tables, so they are not applied, or
+     reverted, while the achilles_results table is versioned.
+    """
+    if not plan or all(migration.app_label != sender.label for migration, _ in plan):
+        return
+    if not router.allow_migrate(using, sender.label):
+        return
+
+    with connections[using].cursor() as cursor:
+        if is_versioned(cursor):
+            raise CommandError(
+                "The achilles_results table is versioned. "
+                "Run version_achilles_results --undo before migrating the uploader app"
+            )
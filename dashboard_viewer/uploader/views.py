@@ -1,6 +1,7 @@
 import itertools
 
 import constance
+from django.conf import settings
 from django.contrib import messages
 from django.db import router, transaction
 from django.forms import fields
@@ -8,20 +9,41 @@ from django.http import HttpResponseRedirect, JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.utils.html import format_html, mark_safe
 from django.views.decorators.clickjacking import xframe_options_exempt
-from rest_framework import viewsets
+from rest_framework import status, viewsets
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
-from materialized_queries_manager.models import MaterializedQuery
+from materialized_queries_manager.analyses import queries_using_columns
 from materialized_queries_manager.tasks import refresh_materialized_views_task
-from . import serializers
-from .decorators import uploader_decorator
+from . import resumable, serializers
+from .decorators import FromMainApplication, uploader_decorator
 from .forms import AchillesResultsForm, EditSourceForm, SourceForm
-from .models import Country, DataSource, PendingUpload, UploadHistory
+from .models import (
+    Country,
+    DataSource,
+    PendingUpload,
+    UploadHistory,
+    UploadSession,
+)
 from .tasks import upload_results_file
 
 PAGE_TITLE = "Dashboard Data Upload"
 
 
+_UPLOAD_SUCCESS_MESSAGE = (
+    "File uploaded with success. The file is being processed and its status, on the upload history table "
+    "should update in the meantime."
+)
+
+
+def _process_upload(pending_upload):
+    task = upload_results_file.delay(pending_upload.id)
+
+    # the task might have already finished and deleted the record
+    PendingUpload.objects.filter(id=pending_upload.id).update(task_id=task.task_id)
+
+
 @uploader_decorator
 @xframe_options_exempt
 def upload_achilles_results(request, *args, **kwargs):
@@ -39,16 +61,9 @@ def upload_achilles_results(request, *args, **kwargs):
                 data_source=obj_data_source, uploaded_file=request.FILES["results_file"]
             )
 
-            messages.success(
-                request,
-                "File uploaded with success. The file is being processed and its status, on the upload history table "
-                "should update in the meantime.",
-            )
-
-            task = upload_results_file.delay(pending_upload.id)
+            messages.success(request, _UPLOAD_SUCCESS_MESSAGE)
 
-            pending_upload.task_id = task.task_id
-            pending_upload.save()
+            _process_upload(pending_upload)
     else:
         form = AchillesResultsForm()
 
@@ -73,6 +88,7 @@ def upload_achilles_results(request, *args, **kwargs):
             "submit_button_text": mark_safe("<i class='fas fa-upload'></i> Upload"),
             "constance_config": constance.config,
             "page_title": PAGE_TITLE,
+            "chunk_size": settings.UPLOADER_RESUMABLE_CHUNK_SIZE,
         },
     )
 
@@ -239,6 +255,31 @@ def create_data_source(request, *_, **kwargs):
     )
 
 
+def _column_values(data_source):
+    return {
+        field.column: getattr(data_source, field.attname)
+        for field in DataSource._meta.concrete_fields
+    }
+
+
+def _refresh_changed_columns(previous_values, data_source):
+    """
+    Refreshes, on the background, the materialized views and maintained tables that use
+     the columns of a data source that changed
+    """
+    changed = [
+        column
+        for column, value in _column_values(data_source).items()
+        if previous_values[column] != value
+    ]
+    if not changed:
+        return
+
+    names = queries_using_columns(DataSource._meta.db_table, changed)
+    if names:
+        refresh_materialized_views_task.delay(sorted(names), db_ids=[data_source.id])
+
+
 @uploader_decorator
 @xframe_options_exempt
 def edit_data_source(request, *_, **kwargs):
@@ -266,6 +307,8 @@ def edit_data_source(request, *_, **kwargs):
             }
         )
     elif request.method == "POST":
+        # the form changes the instance while validating
+        previous_values = _column_values(data_source)
         form = EditSourceForm(request.POST, instance=data_source)
         if form.is_valid():
             obj = form.save(commit=False)
@@ -273,6 +316,8 @@ def edit_data_source(request, *_, **kwargs):
             obj.latitude, obj.longitude = float(lat), float(lon)
             obj.save()
 
+            _refresh_changed_columns(previous_values, obj)
+
             messages.success(
                 request,
                 format_html("Data source <b>{}</b> edited with success.", obj.name),
@@ -363,13 +408,12 @@ class DataSourceUpdate(viewsets.GenericViewSet):
     def partial_update(self, request, *_, **__):
         with transaction.atomic(using=router.db_for_write(DataSource)):
             instance = self.get_object_for_patch()
+            previous_values = _column_values(instance)
             serializer = self.get_serializer(instance, data=request.data, partial=True)
             serializer.is_valid(raise_exception=True)
             serializer.save()
 
-        refresh_materialized_views_task.delay(
-            [obj.matviewname for obj in MaterializedQuery.objects.all()],
-        )
+        _refresh_changed_columns(previous_values, instance)
 
         if getattr(instance, "_prefetched_objects_cache", None):
             # If 'prefetch_related' has been applied to a queryset, we need to
@@ -377,3 +421,89 @@ class DataSourceUpdate(viewsets.GenericViewSet):
             instance._prefetched_objects_cache = {}  # noqa
 
         return Response(serializer.data)
+
+
+class ResumableUpload(viewsets.GenericViewSet):
+    """
+    Upload of a results file in several chunks, each sent on a PUT request with a
+     Content-Range header. After a failed request, the upload resumes from the offset
+     returned by a GET request. Used by the upload page, where the data source is
+     identified by its hash on the url.
+    """
+
+    # as on the upload page, the hash of the data source is what grants access to it
+    authentication_classes = ()
+    permission_classes = (FromMainApplication,)
+
+    serializer_class = serializers.UploadSessionSerializer
+
+    def get_data_source(self):
+        return get_object_or_404(DataSource, hash=self.kwargs["data_source"])
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(data_source=self.get_data_source())
+
+    def perform_create(self, serializer):
+        serializer.save(data_source=self.get_data_source())
+
+    def create(self, request, *_, **__):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def retrieve(self, *_, **__):
+        return Response(self.get_serializer(self.get_object()).data)
+
+    def update(self, request, *_, **__):
+        upload_session = self.get_object()
+
+        try:
+            upload_session, pending_upload = resumable.append_chunk(
+                upload_session.id,
+                request.META.get("HTTP_CONTENT_RANGE"),
+                request.stream,
+            )
+        except resumable.OffsetMismatch as e:
+            return Response(
+                {"detail": str(e), "offset": e.offset}, status=status.HTTP_409_CONFLICT
+            )
+        except resumable.InvalidChunk as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        data = self.get_serializer(upload_session).data
+        if pending_upload is not None:
+            self.on_complete(request, pending_upload)
+            data["pending_upload"] = pending_upload.id
+
+        return Response(data)
+
+    def on_complete(self, request, pending_upload):
+        messages.success(request, _UPLOAD_SUCCESS_MESSAGE)
+        _process_upload(pending_upload)
+
+
+class ResumableUploadAPI(ResumableUpload):
+    """
+    Same as ResumableUpload, for clients authenticated with a token. The data source is
+     identified on the request that starts the upload. Users need the permission to add
+     upload sessions and can only continue the uploads they started.
+    """
+
+    authentication_classes = (TokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    serializer_class = serializers.APIUploadSessionSerializer
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(
+            user_id=self.request.user.id,
+            data_source__in=serializers.uploadable_data_sources(self.request.user),
+        )
+
+    def perform_create(self, serializer):
+        serializer.save(user_id=self.request.user.id)
+
+    def on_complete(self, request, pending_upload):
+        _process_upload(pending_upload)